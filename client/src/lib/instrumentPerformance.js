@@ -0,0 +1,96 @@
+import { supabase } from "./supabaseClient";
+
+// Snapshot réécrit à chaque refresh (cron toutes les 20 min) : au-delà de
+// deux refresh manqués, la ligne est considérée périmée.
+const MAX_AGE_MS = 45 * 60 * 1000;
+
+// Ids par appel prices_at : une ligne par id, sous le plafond de 1000 lignes.
+const RPC_CHUNK = 1000;
+
+const DAY_MS = 24 * 60 * 60 * 1000;
+
+const WINDOWS = [
+  ["prev1d", "ref_1d"],
+  ["prev30d", "ref_30d"],
+  ["prevYtd", "ref_ytd"],
+  ["prev1y", "ref_1y"],
+];
+
+// Mêmes débuts de fenêtre que window_starts (scripts/compute_instrument_performance.py) :
+// 1d / 30d glissants, YTD = 1er janvier 00:00 Paris, 1Y = même instant un an plus tôt.
+function windowStarts(now) {
+  const parisYear = Number(
+    new Intl.DateTimeFormat("en-CA", { timeZone: "Europe/Paris", year: "numeric" }).format(now)
+  );
+  // Paris est en UTC+1 (CET) le 1er janvier.
+  const yearStart = new Date(Date.UTC(parisYear, 0, 1) - 60 * 60 * 1000);
+
+  const oneYear = new Date(now);
+  oneYear.setUTCFullYear(now.getUTCFullYear() - 1);
+  if (oneYear.getUTCMonth() !== now.getUTCMonth()) oneYear.setUTCDate(0); // 29 février
+
+  return {
+    prev1d: new Date(now.getTime() - DAY_MS).toISOString(),
+    prev30d: new Date(now.getTime() - 30 * DAY_MS).toISOString(),
+    prevYtd: yearStart.toISOString(),
+    prev1y: oneYear.toISOString(),
+  };
+}
+
+// Prix de référence calculés à la volée par la RPC prices_at (même règle
+// que le snapshot), pour les instruments absents ou périmés du snapshot.
+async function fetchPricesAt(instrumentIds, perf) {
+  const starts = windowStarts(new Date());
+
+  for (const [key] of WINDOWS) {
+    for (let i = 0; i < instrumentIds.length; i += RPC_CHUNK) {
+      const { data, error } = await supabase.rpc("prices_at", {
+        p_instrument_ids: instrumentIds.slice(i, i + RPC_CHUNK),
+        p_at: starts[key],
+      });
+
+      if (error) {
+        console.error(`Erreur récupération prix de référence (${key}) :`, error);
+        break;
+      }
+      for (const row of data || []) {
+        if (row.price !== null && row.price !== undefined) perf[key][row.instrument_id] = Number(row.price);
+      }
+    }
+  }
+}
+
+// Prix de référence 1D / 30D / YTD / 1Y par instrument : snapshot
+// instrument_performance (scripts/compute_instrument_performance.py) ; les
+// instruments sans ligne, dont la ligne date de plus de MAX_AGE_MS, ou tous
+// si la table n'est pas disponible, passent par la RPC prices_at.
+export async function fetchInstrumentPerformance(instrumentIds) {
+  const perf = { prev1d: {}, prev30d: {}, prevYtd: {}, prev1y: {} };
+  const fresh = new Set();
+
+  const { data, error } = await supabase
+    .from("instrument_performance")
+    .select("instrument_id, ref_1d, ref_30d, ref_ytd, ref_1y, computed_at")
+    .in("instrument_id", instrumentIds);
+
+  if (error) {
+    console.error("instrument_performance indisponible :", error);
+  }
+
+  const minComputedAt = Date.now() - MAX_AGE_MS;
+  for (const row of data || []) {
+    const computedAt = Date.parse(row.computed_at);
+    if (!Number.isFinite(computedAt) || computedAt < minComputedAt) continue;
+
+    const id = row.instrument_id;
+    fresh.add(id);
+    for (const [key, column] of WINDOWS) {
+      if (row[column] !== null && row[column] !== undefined) perf[key][id] = Number(row[column]);
+    }
+  }
+
+  const missing = instrumentIds.filter((id) => !fresh.has(id));
+  if (missing.length > 0) await fetchPricesAt(missing, perf);
+
+  return perf;
+}
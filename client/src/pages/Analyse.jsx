@@ -13,6 +13,7 @@ import {
   Bot,
 } from "lucide-react";
 import { supabase } from "../lib/supabaseClient";
+import { fetchInstrumentPerformance } from "../lib/instrumentPerformance";
 import { motion } from "framer-motion";
 
 
@@ -391,18 +392,6 @@ export default function Analyse() {
       if (instrumentIds.length > 0) {
         const now = new Date();
 
-        const date1d = new Date(now);
-        date1d.setDate(now.getDate() - 1);
-        const iso1d = date1d.toISOString();
-
-        const date30d = new Date(now);
-        date30d.setDate(now.getDate() - 30);
-        const iso30d = date30d.toISOString();
-
-        const startOfYearDate = new Date(now.getFullYear(), 0, 2);
-        const isoYtdStart = startOfYearDate.toISOString();
-
-        
         const historyStart = new Date(now);
         historyStart.setFullYear(now.getFullYear() - 2);
         historyStart.setHours(0, 0, 0, 0);
@@ -416,53 +405,11 @@ export default function Analyse() {
         if (instError) throw instError;
 
         instrumentsById = Object.fromEntries((instruments || []).map((inst) => [inst.id, inst]));
+        const perf = await fetchInstrumentPerformance(instrumentIds);
+        prev1dByInstrument = perf.prev1d;
+        prev30dByInstrument = perf.prev30d;
+        prevYtdByInstrument = perf.prevYtd;
 
-        
-        const { data: prices1d } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", iso1d)
-          .order("fetched_at", { ascending: true });
-
-        if (prices1d) {
-          for (const p of prices1d) {
-            const id = p.instrument_id;
-            if (!prev1dByInstrument[id]) prev1dByInstrument[id] = toNumber(p.price);
-          }
-        }
-
-        
-        const { data: prices30d } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", iso30d)
-          .order("fetched_at", { ascending: true });
-
-        if (prices30d) {
-          for (const p of prices30d) {
-            const id = p.instrument_id;
-            if (!prev30dByInstrument[id]) prev30dByInstrument[id] = toNumber(p.price);
-          }
-        }
-
-        
-        const { data: pricesYtd } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", isoYtdStart)
-          .order("fetched_at", { ascending: true });
-
-        if (pricesYtd) {
-          for (const p of pricesYtd) {
-            const id = p.instrument_id;
-            if (!prevYtdByInstrument[id]) prevYtdByInstrument[id] = toNumber(p.price);
-          }
-        }
-
-        
         try {
           const dailyRows = await fetchAssetPricesDailySafe({
             instrumentIds,
@@ -18,6 +18,7 @@ import {
   Bot, 
 } from "lucide-react";
 import { supabase } from "../lib/supabaseClient";
+import { fetchInstrumentPerformance } from "../lib/instrumentPerformance";
 import { motion } from "framer-motion";
 
 const toNumber = (v) => (v === null || v === undefined || v === "" ? 0 : Number(v));
@@ -233,43 +234,9 @@ export default function Dashboard() {
       let prev30dByInstrument = {};
 
       if (instrumentIds.length > 0) {
-        const now = new Date();
-
-        const d1 = new Date(now);
-        d1.setDate(now.getDate() - 1);
-        const iso1d = d1.toISOString();
-
-        const d30 = new Date(now);
-        d30.setDate(now.getDate() - 30);
-        const iso30d = d30.toISOString();
-
-        const { data: prices1d } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", iso1d)
-          .order("fetched_at", { ascending: true });
-
-        if (prices1d) {
-          for (const p of prices1d) {
-            const id = p.instrument_id;
-            if (!prev1dByInstrument[id]) prev1dByInstrument[id] = toNumber(p.price);
-          }
-        }
-
-        const { data: prices30d } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", iso30d)
-          .order("fetched_at", { ascending: true });
-
-        if (prices30d) {
-          for (const p of prices30d) {
-            const id = p.instrument_id;
-            if (!prev30dByInstrument[id]) prev30dByInstrument[id] = toNumber(p.price);
-          }
-        }
+        const perf = await fetchInstrumentPerformance(instrumentIds);
+        prev1dByInstrument = perf.prev1d;
+        prev30dByInstrument = perf.prev30d;
       }
 
       let daily = 0;
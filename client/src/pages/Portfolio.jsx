@@ -12,6 +12,7 @@ import {
   Bot,
 } from "lucide-react";
 import { supabase } from "../lib/supabaseClient";
+import { fetchInstrumentPerformance } from "../lib/instrumentPerformance";
 import { motion } from "framer-motion";
 
 
@@ -180,53 +181,9 @@ export default function Portfolio() {
       let prev30dByInstrument = {};
 
       if (instrumentIds.length > 0) {
-        const now = new Date();
-
-        const date1d = new Date(now);
-        date1d.setDate(now.getDate() - 1);
-        const iso1d = date1d.toISOString();
-
-        const date30d = new Date(now);
-        date30d.setDate(now.getDate() - 30);
-        const iso30d = date30d.toISOString();
-
-        
-        const { data: prices1d, error: p1Error } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", iso1d)
-          .order("fetched_at", { ascending: true });
-
-        if (p1Error) {
-          console.error("Erreur récupération prix 1j :", p1Error);
-        } else if (prices1d) {
-          for (const p of prices1d) {
-            const id = p.instrument_id;
-            if (!prev1dByInstrument[id]) {
-              prev1dByInstrument[id] = toNumber(p.price); 
-            }
-          }
-        }
-
-        
-        const { data: prices30d, error: p30Error } = await supabase
-          .from("asset_prices")
-          .select("instrument_id, price, fetched_at")
-          .in("instrument_id", instrumentIds)
-          .gte("fetched_at", iso30d)
-          .order("fetched_at", { ascending: true });
-
-        if (p30Error) {
-          console.error("Erreur récupération prix 30j :", p30Error);
-        } else if (prices30d) {
-          for (const p of prices30d) {
-            const id = p.instrument_id;
-            if (!prev30dByInstrument[id]) {
-              prev30dByInstrument[id] = toNumber(p.price); 
-            }
-          }
-        }
+        const perf = await fetchInstrumentPerformance(instrumentIds);
+        prev1dByInstrument = perf.prev1d;
+        prev30dByInstrument = perf.prev30d;
       }
 
       
@@ -207,6 +207,7 @@ export default function Simulation() {
         const { data: returnsData, error: retErr } = await supabase
           .from("instrument_returns")
           .select("instrument_id, cagr, period_years")
+          .eq("period_years", 1)
           .in("instrument_id", instrumentIds);
 
         if (retErr) throw retErr;
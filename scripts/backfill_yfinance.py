@@ -1,29 +1,44 @@
-﻿import os
-from typing import List, Set
-from datetime import datetime
+﻿import argparse
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
+
+from olympe.client import supabase, supabase_credentials
+from olympe.frames import price_payload
+from olympe.market_calendar import has_session_after, market_for
+from olympe.metrics import METRICS, job, timer
+from olympe.reader import fetch_rows, stream_rows
+from olympe.utils import to_float
+from olympe.workers import (
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_UPSERT_WORKERS,
+    PipelineStats,
+    run_pipeline,
+)
+from olympe.yf_cache import ADJ_TOLERANCE, cached_download
+from olympe.yf_scheduler import YF_SCHEDULER, prioritize_held
 
-import yfinance as yf
-from supabase import create_client, Client
 
 
+MANUAL_SYMBOLS: List[str] = [
+    
+    
+]
 
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+DEFAULT_BATCH_SIZE = 50
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    raise RuntimeError(
-        "SUPABASE_URL ou SUPABASE_SERVICE_ROLE_KEY manquants dans les variables d'environnement."
-    )
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+BACKFILL_SOURCE = "yahoo_yfinance"
 
 
+OVERLAP_DAYS = 5
 
-MANUAL_SYMBOLS: List[str] = [
-    
-    
-]
+
+WATERMARK_LOOKBACK_DAYS = 14
+
+
+UPSERT_CHUNK_SIZE = 500
 
 
 
@@ -35,15 +50,9 @@ def fetch_symbols_from_instruments() -> List[str]:
     """
     print("→ Récupération des symboles depuis instruments…")
 
-    resp = supabase.table("instruments").select("symbol").execute()
-
-    if getattr(resp, "error", None):
-        print("  Erreur Supabase:", resp.error)
-        raise RuntimeError(resp.error)
-
     symbols_set: Set[str] = set()
 
-    for row in resp.data or []:
+    for row in stream_rows(supabase, "instruments", "symbol"):
         symbol = row.get("symbol")
         if symbol:
             symbols_set.add(symbol)
@@ -97,130 +106,475 @@ def get_or_create_instrument(symbol: str) -> str:
 
 
 
+def get_instruments(symbols: List[str]) -> Dict[str, dict]:
+    """
+    Récupère en une requête les instruments (id, exchange, asset_class) d'un
+    lot de symboles, puis crée ceux qui manquent (via get_or_create_instrument).
+    """
+    rows = fetch_rows(
+        supabase,
+        "instruments",
+        "id,symbol,exchange,asset_class",
+        filters=lambda q: q.in_("symbol", symbols),
+    )
+
+    instruments: Dict[str, dict] = {}
+    for row in rows:
+        symbol = row.get("symbol")
+        if symbol and row.get("id") and symbol not in instruments:
+            instruments[symbol] = row
+
+    for symbol in symbols:
+        if symbol not in instruments:
+            instruments[symbol] = {"id": get_or_create_instrument(symbol), "symbol": symbol}
+
+    return instruments
 
-def backfill_symbol(symbol: str):
+
+def get_watermarks(instrument_ids: List[str]) -> Dict[str, str]:
     """
-    Backfill complet d'un symbole :
-    - récupère / crée instrument
-    - télécharge l'historique yfinance
-    - UPSERT dans asset_prices (doublons gérés par la DB via UNIQUE)
+    High-water mark par instrument : date (YYYY-MM-DD) du dernier prix daily
+    déjà stocké par le backfill (source yahoo_yfinance, les quotes intraday
+    du refresh sont ignorées).
+
+    Une requête groupée sur les WATERMARK_LOOKBACK_DAYS derniers jours couvre
+    le cas courant ; les instruments non trouvés (nouveaux, ou backfill en
+    retard) sont interrogés un par un.
     """
-    print(f"\n========== BACKFILL {symbol} ==========")
+    since = (datetime.now(timezone.utc) - timedelta(days=WATERMARK_LOOKBACK_DAYS)).date().isoformat()
 
-    instrument_id = get_or_create_instrument(symbol)
+    rows = stream_rows(
+        supabase,
+        "asset_prices",
+        "instrument_id,fetched_at",
+        filters=lambda q: q.in_("instrument_id", instrument_ids).eq("source", BACKFILL_SOURCE).gte("fetched_at", since),
+    )
 
-    print(f"→ Téléchargement historique yfinance pour {symbol}...")
-    df = yf.download(symbol, period="max", interval="1d", auto_adjust=False)
+    watermarks: Dict[str, str] = {}
+    for row in rows:
+        iid = row.get("instrument_id")
+        day = (row.get("fetched_at") or "")[:10]
+        if iid and day and day > watermarks.get(iid, ""):
+            watermarks[iid] = day
 
-    if df.empty:
-        print(f"  Aucune donnée retournée par yfinance pour {symbol}")
-        return
+    for iid in instrument_ids:
+        if iid in watermarks:
+            continue
 
-    
-    
-    if hasattr(df.columns, "nlevels") and df.columns.nlevels > 1:
-        df.columns = [" ".join([str(x) for x in col if x]).strip() for col in df.columns.values]
+        last = (
+            supabase.table("asset_prices")
+            .select("fetched_at")
+            .eq("instrument_id", iid)
+            .eq("source", BACKFILL_SOURCE)
+            .order("fetched_at", desc=True)
+            .limit(1)
+            .execute()
+        )
+        if last.data:
+            watermarks[iid] = last.data[0]["fetched_at"][:10]
 
-    print(f"  {len(df)} lignes reçues depuis yfinance.")
+    return watermarks
 
-    rows_to_upsert = []
 
-    for index, row in df.iterrows():
-        if isinstance(index, datetime):
-            date_str = index.strftime("%Y-%m-%d")
-        else:
-            date_str = str(index)[:10]
-
-        
-        price = None
-        try:
-            if "Adj Close" in df.columns:
-                value = row["Adj Close"]
-            elif "Close" in df.columns:
-                value = row["Close"]
-            else:
-                
-                continue
+def skip_idle(symbols: List[str], instruments: Dict[str, dict], watermarks: Dict[str, str]) -> List[str]:
+    """
+    Retire les symboles dont le marché n'a pas eu de séance terminée depuis
+    leur dernière barre daily stockée (week-end, férié, nuit) : Yahoo n'a
+    aucune nouvelle barre à renvoyer. Cf. olympe.market_calendar.
+    """
+    now = datetime.now(timezone.utc)
+    active = []
+    for symbol in symbols:
+        inst = instruments[symbol]
+        market = market_for(symbol, inst.get("exchange"), inst.get("asset_class"))
+        if has_session_after(market, watermarks.get(inst["id"]), now):
+            active.append(symbol)
 
-            
-            if hasattr(value, "iloc"):
-                value = value.iloc[0]
+    skipped = len(symbols) - len(active)
+    if skipped:
+        print(f"  {skipped} symbole(s) sans nouvelle séance depuis leur dernier prix : ignoré(s).")
+        METRICS.incr("calendar_skipped", skipped)
+    return active
 
-            if value is not None:
-                price = float(value)
-        except Exception:
+
+def incremental_start(watermark: Optional[str]) -> Optional[str]:
+    """
+    Date de début du téléchargement incrémental : watermark - OVERLAP_DAYS
+    (pour rattraper les clôtures corrigées). None = pas d'historique, tout télécharger.
+    """
+    if not watermark:
+        return None
+    start = datetime.strptime(watermark, "%Y-%m-%d") - timedelta(days=OVERLAP_DAYS)
+    return start.date().isoformat()
+
+
+def stored_prices(instrument_ids: List[str], since: str) -> Dict[Tuple[str, str], float]:
+    """
+    Prix backfill déjà stockés depuis since : {(instrument_id, jour): prix}.
+    """
+    rows = stream_rows(
+        supabase,
+        "asset_prices",
+        "id,instrument_id,fetched_at,price",
+        filters=lambda q: q.in_("instrument_id", instrument_ids).eq("source", BACKFILL_SOURCE).gte("fetched_at", since),
+    )
+    return {(row["instrument_id"], row["fetched_at"][:10]): to_float(row["price"]) for row in rows}
+
+
+def readjusted(rows: List[dict], stored: Dict[Tuple[str, str], float], watermark: Optional[str]) -> bool:
+    """
+    True si un Adj Close des jours recouverts s'écarte du prix stocké : Yahoo
+    a réajusté la série (dividende, split) et tout l'historique stocké est sur
+    l'ancienne base. Le jour du watermark est ignoré (barre éventuellement
+    stockée en cours de séance).
+    """
+    for row in rows:
+        day = row["fetched_at"][:10]
+        if watermark and day >= watermark:
             continue
+        old = stored.get((row["instrument_id"], day))
+        if old is not None and abs(row["price"] - old) > ADJ_TOLERANCE * abs(old):
+            return True
+    return False
 
-        if price is None or price <= 0:
+
+def full_history_rows(
+    symbols: List[str],
+    instrument_ids: Dict[str, str],
+    on_history: Optional[Callable[[str], None]] = None,
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Toutes les lignes asset_prices des symboles réajustés (period="max", servi
+    par le cache s'il vient d'être rechargé), pour réécrire l'historique
+    entier sur la nouvelle base.
+    """
+    print(f"→ Adj Close réajusté, historique complet ré-écrit : {symbols}")
+    METRICS.incr("backfill_readjusted", len(symbols))
+    frames = download_history(symbols, None)
+    for symbol in symbols:
+        df = frames.get(symbol)
+        if df is None:
+            print(f"  {symbol} : aucune donnée retournée par yfinance")
             continue
-        
+        rows = build_price_rows(instrument_ids[symbol], df)
+        print(f"  {symbol} : {len(rows)} lignes à upsert (historique complet).")
+        if on_history is not None:
+            on_history(instrument_ids[symbol])
+        yield symbol, rows
 
-        
-        fetched_at = datetime.strptime(date_str, "%Y-%m-%d").isoformat() + "Z"
 
-        rows_to_upsert.append(
-            {
-                "instrument_id": instrument_id,
-                "price": price,
-                "currency": None,
-                "source": "yahoo_yfinance",
-                "fetched_at": fetched_at,
-            }
-        )
+def download_history(symbols: List[str], start: Optional[str], refresh: bool = False) -> Dict[str, object]:
+    """
+    Historique daily yfinance : depuis start si fourni, sinon tout l'historique
+    (period="max"), lu à travers le cache local (olympe.yf_cache) ; un yf.download
+    multi-ticker pour les symboles absents ou périmés.
+    refresh=True ignore le cache (--full : reprend aussi les Adj Close réajustés).
+    Renvoie {symbol: DataFrame mono-symbole ou None}.
+    """
+    return cached_download(symbols, start=start, refresh=refresh)
 
-    print(f"  {len(rows_to_upsert)} lignes (tentatives) à upsert dans asset_prices.")
 
-    if not rows_to_upsert:
-        print("  Rien à insérer.")
-        return
+def build_price_rows(instrument_id: str, df) -> List[dict]:
+    """
+    Transforme un DataFrame yfinance (colonnes simples) en lignes asset_prices.
+    Prix = 'Adj Close' si dispo, sinon 'Close' ; NaN / inf / prix <= 0 ignorés.
+    Conversion vectorisée (voir olympe.frames.price_payload).
+    """
+    return price_payload(
+        df,
+        instrument_id,
+        date_key="fetched_at",
+        date_suffix="T00:00:00Z",
+        currency=None,
+        source=BACKFILL_SOURCE,
+    )
 
-    batch_size = 500
-    processed_total = 0
 
-    for i in range(0, len(rows_to_upsert), batch_size):
-        chunk = rows_to_upsert[i: i + batch_size]
-        print(f"  → Upsert chunk {i} - {i + len(chunk)}...")
+def upsert_chunk(symbol: str, offset: int, chunk: List[dict]) -> None:
+    """
+    UPSERT d'un chunk dans asset_prices
+    (doublons gérés par la DB via UNIQUE instrument_id,fetched_at).
+    """
+    print(f"  → Upsert {symbol} chunk {offset} - {offset + len(chunk)}...")
 
-        res = (
-            supabase.table("asset_prices")
-            .upsert(chunk, on_conflict="instrument_id,fetched_at")
-            .execute()
-        )
+    res = (
+        supabase.table("asset_prices")
+        .upsert(chunk, on_conflict="instrument_id,fetched_at")
+        .execute()
+    )
 
-        if getattr(res, "error", None):
-            print("    Erreur Supabase:", res.error)
-            raise RuntimeError(res.error)
+    if getattr(res, "error", None):
+        print("    Erreur Supabase:", res.error)
+        raise RuntimeError(res.error)
 
-        processed_total += len(chunk)
+    METRICS.incr("rows_written", len(chunk))
 
-    print(
-        f"✅ Backfill terminé pour {symbol} : {processed_total} lignes traitées (doublons ignorés)."
-    )
 
+def download_start(start: Optional[str], history_start: Optional[str]) -> Optional[str]:
+    """
+    Début effectif du téléchargement : le plus ancien de start (incrémental)
+    et history_start (historique demandé par une étape suivante du pipeline,
+    cf. nightly_pipeline.py). None = tout l'historique.
+    """
+    if start is None or history_start is None:
+        return start
+    return min(start, history_start)
+
+
+def prepare_symbol(
+    symbol: str,
+    full: bool = False,
+    history_start: Optional[str] = None,
+    on_frame: Optional[Callable[[str, object], None]] = None,
+    on_history: Optional[Callable[[str], None]] = None,
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Partie "téléchargement" du backfill d'un symbole :
+    - récupère / crée instrument
+    - télécharge l'historique yfinance (complet si full, sinon depuis le watermark)
+    - produit (symbol, lignes asset_prices)
+
+    history_start / on_frame : si le symbole est téléchargé (les symboles sans
+    nouvelle séance restent sautés), l'historique l'est au moins depuis
+    history_start et le DataFrame est transmis à on_frame(symbol, df), pour
+    être réutilisé par les étapes suivantes sans nouveau téléchargement.
+    on_history(instrument_id) : appelé quand tout l'historique de l'instrument
+    est (ré)écrit (cold start, full, réajustement), cf. sync_asset_prices_daily.
+    """
+    print(f"\n========== BACKFILL {symbol} ==========")
+
+    instruments = get_instruments([symbol])
+    instrument_id = instruments[symbol]["id"]
 
+    start = None
+    watermarks: Dict[str, str] = {}
+    if not full:
+        watermarks = get_watermarks([instrument_id])
+        if not skip_idle([symbol], instruments, watermarks):
+            return
+        start = incremental_start(watermarks.get(instrument_id))
 
+    if start:
+        print(f"→ Téléchargement incrémental yfinance pour {symbol} depuis {start}...")
+    else:
+        print(f"→ Téléchargement historique yfinance pour {symbol}...")
+    df = download_history([symbol], download_start(start, history_start), refresh=full).get(symbol)
+    if df is None:
+        print(f"  Aucune donnée retournée par yfinance pour {symbol}")
+        return
 
-def main():
+    print(f"  {len(df)} lignes reçues depuis yfinance.")
+
+    if on_frame is not None:
+        on_frame(symbol, df)
+
+    rows = build_price_rows(instrument_id, df)
+    if start:
+        rows = [r for r in rows if r["fetched_at"] >= start]
+        if readjusted(rows, stored_prices([instrument_id], start), watermarks.get(instrument_id)):
+            yield from full_history_rows([symbol], {symbol: instrument_id}, on_history)
+            return
+    elif on_history is not None:
+        on_history(instrument_id)
+
+    yield symbol, rows
+
+
+def prepare_batch(
+    symbols: List[str],
+    full: bool = False,
+    history_start: Optional[str] = None,
+    on_frame: Optional[Callable[[str, object], None]] = None,
+    on_history: Optional[Callable[[str], None]] = None,
+) -> Iterator[Tuple[str, List[dict]]]:
+    """
+    Partie "téléchargement" du backfill d'un lot de symboles : un yf.download
+    multi-ticker, puis découpage du résultat (MultiIndex) par symbole. Les lignes
+    produites sont identiques à celles de prepare_symbol.
+
+    En incrémental, les symboles sans historique (cold start) sont téléchargés
+    en period="max", les autres depuis le plus ancien de leurs débuts
+    incrémentaux ; chaque symbole ne garde ensuite que ses lignes >= son début,
+    sauf si ses jours recouverts ont été réajustés (tout l'historique est alors
+    ré-écrit, cf. readjusted).
+    Les symboles sans nouvelle séance depuis leur dernière barre stockée ne
+    sont pas téléchargés (skip_idle).
+    history_start / on_frame / on_history : cf. prepare_symbol.
+    """
+    print(f"\n========== BACKFILL lot de {len(symbols)} symboles ==========")
+
+    instruments = get_instruments(symbols)
+    instrument_ids = {symbol: inst["id"] for symbol, inst in instruments.items()}
+
+    starts: Dict[str, Optional[str]] = {symbol: None for symbol in symbols}
+    watermarks: Dict[str, str] = {}
+    if not full:
+        watermarks = get_watermarks(list(instrument_ids.values()))
+        for symbol in symbols:
+            starts[symbol] = incremental_start(watermarks.get(instrument_ids[symbol]))
+        symbols = skip_idle(symbols, instruments, watermarks)
+
+    cold = [s for s in symbols if starts[s] is None]
+    warm = [s for s in symbols if starts[s] is not None]
+
+    groups = []
+    if cold:
+        groups.append((cold, None))
+    if warm:
+        groups.append((warm, download_start(min(starts[s] for s in warm), history_start)))
+
+    for group, group_start in groups:
+        if group_start:
+            print(f"→ Téléchargement incrémental yfinance (multi-ticker) depuis {group_start} : {group}")
+        else:
+            print(f"→ Téléchargement historique yfinance (multi-ticker) : {group}")
+        frames = download_history(group, group_start, refresh=full)
+        stored: Dict[Tuple[str, str], float] = {}
+        if group_start:
+            stored = stored_prices([instrument_ids[s] for s in group], min(starts[s] for s in group))
+        stale: List[str] = []
+
+        for symbol in group:
+            sub = frames.get(symbol)
+            if sub is None:
+                print(f"  {symbol} : aucune donnée retournée par yfinance")
+                continue
+
+            if on_frame is not None:
+                on_frame(symbol, sub)
+
+            rows = build_price_rows(instrument_ids[symbol], sub)
+            if starts[symbol]:
+                rows = [r for r in rows if r["fetched_at"] >= starts[symbol]]
+                if readjusted(rows, stored, watermarks.get(instrument_ids[symbol])):
+                    stale.append(symbol)
+                    continue
+            elif on_history is not None:
+                on_history(instrument_ids[symbol])
+            print(f"  {symbol} : {len(sub)} lignes reçues, {len(rows)} à upsert.")
+            yield symbol, rows
+
+        if stale:
+            yield from full_history_rows(stale, instrument_ids, on_history)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill YFinance vers Supabase")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Nombre de symboles par yf.download multi-ticker (<= 1 : un appel par symbole).",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-télécharge tout l'historique (period=\"max\") au lieu de repartir du dernier prix stocké.",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=DEFAULT_DOWNLOAD_WORKERS,
+        help="Threads de préparation (lookups instruments, téléchargements, conversion).",
+    )
+    parser.add_argument(
+        "--upsert-workers",
+        type=int,
+        default=DEFAULT_UPSERT_WORKERS,
+        help="Threads d'upsert Supabase.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Nombre max de chunks en attente d'upsert (plafond mémoire).",
+    )
+    return parser.parse_args()
+
+
+def run_backfill(
+    *,
+    full: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    upsert_workers: int = DEFAULT_UPSERT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    history_start: Optional[str] = None,
+    on_frame: Optional[Callable[[str, object], None]] = None,
+    on_history: Optional[Callable[[str], None]] = None,
+) -> Optional[PipelineStats]:
+    """
+    Backfill de tous les symboles (MANUAL_SYMBOLS sinon table instruments).
+    history_start / on_frame / on_history : cf. prepare_symbol.
+    Lève RuntimeError si des lots ont échoué. Renvoie None s'il n'y a rien à traiter.
+    """
     print("=== Backfill YFinance vers Supabase ===")
-    print(f"SUPABASE_URL = {SUPABASE_URL}")
+    print(f"SUPABASE_URL = {supabase_credentials()[0]}")
 
     if MANUAL_SYMBOLS:
         symbols = MANUAL_SYMBOLS
         print("Utilisation de la liste MANUAL_SYMBOLS :", symbols)
     else:
-        symbols = fetch_symbols_from_instruments()
+        with timer("symbols"):
+            symbols = fetch_symbols_from_instruments()
 
     if not symbols:
         print("Aucun symbole à traiter, fin.")
-        return
+        return None
 
-    print(f"Symboles à traiter : {symbols}")
+    # Instruments détenus d'abord (lots et file d'attente YF_SCHEDULER) :
+    # si Yahoo throttle, c'est la longue traîne qui attend.
+    held = prioritize_held(supabase)
+    symbols = YF_SCHEDULER.order(symbols)
+    print(f"Symboles à traiter : {symbols} (dont {len(held)} détenus, en premier)")
+    print("Mode :", "complet (--full)" if full else f"incrémental (recouvrement {OVERLAP_DAYS} j)")
 
-    for symbol in symbols:
-        backfill_symbol(symbol)
+    if batch_size <= 1:
+        items = [[symbol] for symbol in symbols]
+    else:
+        items = [symbols[i: i + batch_size] for i in range(0, len(symbols), batch_size)]
+
+    def produce(batch: List[str]):
+        prepare = prepare_symbol if len(batch) == 1 else prepare_batch
+        target = batch[0] if len(batch) == 1 else batch
+        for symbol, rows in prepare(
+            target, full=full, history_start=history_start, on_frame=on_frame, on_history=on_history
+        ):
+            for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                yield symbol, i, rows[i: i + UPSERT_CHUNK_SIZE]
+
+    with timer("pipeline"):
+        stats = run_pipeline(
+            items,
+            produce,
+            lambda unit: upsert_chunk(*unit),
+            download_workers=download_workers,
+            upsert_workers=upsert_workers,
+            queue_size=queue_size,
+            label=lambda x: f"{x[0]} chunk {x[1]}" if isinstance(x, tuple) else ",".join(x),
+        )
+
+    print(f"\n{stats.units} chunks upsert pour {stats.items} lots.")
+
+    if stats.errors:
+        raise RuntimeError(f"{len(stats.errors)} erreur(s) pendant le backfill : {stats.errors}")
+
+    print("Tous les symboles ont été traités.")
+    return stats
 
-    print("\nTous les symboles ont été traités.")
+
+def main():
+    args = parse_args()
+
+    run_backfill(
+        full=args.full,
+        batch_size=args.batch_size,
+        download_workers=args.download_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+    )
 
 
 if __name__ == "__main__":
-    main()
+    with job("backfill_yfinance"):
+        main()
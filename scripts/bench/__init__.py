@@ -0,0 +1,8 @@
+"""
+Banc de mesure hors-ligne des jobs Olympe (cf. scripts/benchmark.py).
+
+- fake_postgrest : stand-in Supabase/PostgREST sur SQLite en mémoire
+  (même API de query builder que supabase-py, RPC comprises) ;
+- fake_yfinance : fournisseur yfinance déterministe (historiques synthétiques) ;
+- datasets : génération de jeux de données (instruments, users, holdings, années).
+"""
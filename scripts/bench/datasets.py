@@ -0,0 +1,152 @@
+"""
+Jeux de données synthétiques pour le banc de mesure.
+
+generate(fake, DatasetSpec(instruments=N, users=M, holdings=K, years=Y)) remplit le stand-in
+PostgREST : instruments (suffixes de places variés, quelques titres radiés),
+comptes (un ou deux par user, dont des comptes sans position), holdings
+répartis entre les users, un mouvement BUY par holding (plus quelques SELL)
+et, optionnellement, des quotes intraday récentes dans asset_prices.
+Tout est tiré d'un random.Random(seed) : même seed, même dataset.
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+
+SUFFIXES = ("", ".PA", ".AS", ".DE", ".L", "-USD")
+
+DEAD_SHARE = 0.02
+
+QUOTES_PER_DAY = 8
+
+
+@dataclass
+class DatasetSpec:
+    instruments: int = 100
+    users: int = 50
+    holdings: int = 300
+    years: int = 5
+    quote_days: int = 5
+    seed: int = 42
+
+
+def _instruments(fake, rng: random.Random, n: int) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(n):
+        prefix = "DEAD" if rng.random() < DEAD_SHARE else "SYM"
+        suffix = SUFFIXES[i % len(SUFFIXES)]
+        rows.append(
+            {
+                "id": fake.new_id(),
+                "symbol": f"{prefix}{i:05d}{suffix}",
+                "name": f"Instrument {i}",
+                "asset_class": "crypto" if suffix == "-USD" else "equity",
+                "currency": "EUR" if suffix in (".PA", ".AS", ".DE") else "USD",
+                "exchange": None,
+            }
+        )
+    return rows
+
+
+def generate(fake, spec: DatasetSpec) -> Dict[str, int]:
+    """
+    Remplit `fake` (FakeSupabase) selon spec ; renvoie le nombre de lignes par table.
+    """
+    rng = random.Random(spec.seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    instruments = _instruments(fake, rng, spec.instruments)
+
+    users = [fake.new_id() for _ in range(spec.users)]
+    accounts = []
+    for uid in users:
+        for k in range(rng.choice((1, 1, 2))):
+            accounts.append(
+                {
+                    "id": fake.new_id(),
+                    "user_id": uid,
+                    "name": f"Compte {k + 1}",
+                    "type": rng.choice(("PEA", "CTO", "LIVRET")),
+                    "current_amount": round(rng.uniform(0, 20_000), 2),
+                }
+            )
+
+    holdings, movements, seen = [], [], set()
+    attempts = 0
+    while len(holdings) < spec.holdings and attempts < spec.holdings * 10 and accounts and instruments:
+        attempts += 1
+        acc = rng.choice(accounts)
+        inst = rng.choice(instruments)
+        if (acc["id"], inst["id"]) in seen:
+            continue
+        seen.add((acc["id"], inst["id"]))
+
+        qty = round(rng.uniform(1, 200), 3)
+        price = round(rng.uniform(10, 300), 2)
+        bought = now - timedelta(days=rng.randint(1, 366 * spec.years))
+        hid = fake.new_id()
+        holdings.append(
+            {
+                "id": hid,
+                "user_id": acc["user_id"],
+                "account_id": acc["id"],
+                "instrument_id": inst["id"],
+                "quantity": qty,
+                "avg_buy_price": price,
+                "current_price": price,
+                "current_value": round(qty * price, 2),
+                "asset_label": inst["symbol"],
+            }
+        )
+
+        # Quantité actuelle = achats - ventes (cf. quantity_timeline du portfolio).
+        sold = round(qty * rng.uniform(0.1, 0.5), 3) if rng.random() < 0.2 else 0.0
+        movements.append(_movement(fake, acc, hid, "BUY", qty + sold, price, bought))
+        if sold:
+            movements.append(_movement(fake, acc, hid, "SELL", sold, price, bought + (now - bought) / 2))
+
+    quotes = []
+    held = sorted({h["instrument_id"] for h in holdings})
+    for d in range(spec.quote_days):
+        day = now - timedelta(days=d)
+        for iid in held:
+            base = rng.uniform(10, 300)
+            for q in range(QUOTES_PER_DAY):
+                quotes.append(
+                    {
+                        "instrument_id": iid,
+                        "price": round(base * (1 + rng.gauss(0, 0.002)), 4),
+                        "currency": "EUR",
+                        "source": "bench",
+                        "fetched_at": (day - timedelta(hours=q)).isoformat(),
+                    }
+                )
+
+    tables = {
+        "instruments": instruments,
+        "accounts": accounts,
+        "holdings": holdings,
+        "movements": movements,
+        "asset_prices": quotes,
+    }
+    for table, rows in tables.items():
+        fake.load(table, rows)
+    return {table: len(rows) for table, rows in tables.items()}
+
+
+def _movement(fake, acc, holding_id, kind, qty, price, at) -> Dict[str, Any]:
+    return {
+        "id": fake.new_id(),
+        "user_id": acc["user_id"],
+        "account_id": acc["id"],
+        "holding_id": holding_id,
+        "type": kind,
+        "quantity": qty,
+        "unit_price": price,
+        "amount": round(qty * price, 2),
+        "description": f"{kind} bench",
+        "occurred_at": at.isoformat(),
+        "created_at": at.isoformat(),
+    }
+
@@ -0,0 +1,600 @@
+"""
+Stand-in PostgREST/Supabase sur SQLite en mémoire, pour le banc de mesure.
+
+Implémente le sous-ensemble de supabase-py utilisé par les scripts :
+table().select/insert/upsert/update/delete, filtres eq/neq/gt/gte/lt/lte/
+in_/is_/or_/filter, order/limit/range, embeddings "alias:table(cols)",
+plafond max_rows de 1000 lignes, et les RPC des migrations (latest_prices,
+latest_prices_for_day, prices_at).
+
+Chaque execute() est compté (requêtes, lignes lues / écrites, octets JSON,
+temps passé côté "serveur") pour que le banc puisse séparer le coût des
+scripts de celui du stand-in.
+"""
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from olympe.utils import paris_day_bounds_utc
+
+
+MAX_ROWS = 1000
+
+
+SCHEMA = """
+create table instruments (
+  id text primary key, symbol text, name text, asset_class text, currency text, exchange text
+);
+create index instruments_symbol on instruments (symbol);
+
+create table accounts (
+  id text primary key, user_id text, name text, type text, current_amount real
+);
+create index accounts_user on accounts (user_id);
+
+create table holdings (
+  id text primary key, user_id text, account_id text, instrument_id text,
+  quantity real, avg_buy_price real, current_price real, current_value real, asset_label text,
+  updated_at text
+);
+create index holdings_user on holdings (user_id);
+
+create table movements (
+  id text primary key, user_id text, account_id text, holding_id text, type text,
+  amount real, unit_price real, quantity real, description text, occurred_at text, created_at text
+);
+
+create table asset_prices (
+  id integer primary key autoincrement, instrument_id text, price real,
+  currency text, source text, fetched_at text,
+  unique (instrument_id, fetched_at)
+);
+create index asset_prices_fetched_at on asset_prices (fetched_at, id);
+
+create table asset_prices_daily (
+  instrument_id text, day text, price real, currency text, source text,
+  fetched_at text, updated_at text,
+  primary key (instrument_id, day)
+);
+create index asset_prices_daily_day on asset_prices_daily (day, instrument_id);
+
+create table instrument_returns (
+  instrument_id text, period_years integer, cagr real, source text, last_updated_at text,
+  unique (instrument_id, period_years)
+);
+
+create table instrument_performance (
+  instrument_id text primary key, computed_at text
+);
+
+create table portfolio_history_daily (
+  user_id text, day text, total_value real, computed_at text,
+  unique (user_id, day)
+);
+
+create table sync_watermarks (
+  job text primary key, watermark text, updated_at text
+);
+
+create table job_metrics (
+  id integer primary key autoincrement, job text, status text,
+  started_at text, finished_at text, duration_s real, summary text
+);
+"""
+
+
+_TS_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}")
+
+
+class APIError(Exception):
+    def __init__(self, message: str, code: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def norm(value: Any) -> Any:
+    """
+    Timestamps ISO normalisés (UTC, microsecondes, +00:00) pour que la
+    comparaison texte SQLite suive l'ordre chronologique, comme timestamptz.
+    """
+    if isinstance(value, str) and _TS_RE.match(value):
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc).isoformat(timespec="microseconds")
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)  # jsonb stocké en texte
+    return value
+
+
+def _q(name: str) -> str:
+    return '"' + name + '"'
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return value
+
+
+def _split_top(expr: str) -> List[str]:
+    parts, depth, quoted, current = [], 0, False, ""
+    i = 0
+    while i < len(expr):
+        ch = expr[i]
+        if ch == "\\" and quoted and i + 1 < len(expr):
+            current += expr[i: i + 2]
+            i += 2
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+        i += 1
+    parts.append(current)
+    return [p.strip() for p in parts if p.strip()]
+
+
+_OPS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+def _condition(column: str, op: str, value: Any) -> Tuple[str, List[Any]]:
+    if op in _OPS:
+        return f'"{column}" {_OPS[op]} ?', [norm(value)]
+    if op == "in":
+        values = value
+        if isinstance(value, str):
+            values = [_unquote(v) for v in _split_top(value.strip("()"))]
+        values = list(values)
+        if not values:
+            return "0", []
+        return f'"{column}" in ({",".join("?" * len(values))})', [norm(v) for v in values]
+    if op == "is":
+        if value in (None, "null"):
+            return f'"{column}" is null', []
+        return f'"{column}" is ?', [norm(value)]
+    raise APIError(f"operator not supported by the bench stand-in: {op}")
+
+
+def _logic(expr: str, joiner: str) -> Tuple[str, List[Any]]:
+    sql, params = [], []
+    for term in _split_top(expr):
+        for kind in ("and", "or"):
+            if term.startswith(kind + "(") and term.endswith(")"):
+                s, p = _logic(term[len(kind) + 1: -1], kind)
+                break
+        else:
+            column, op, raw = term.split(".", 2)
+            s, p = _condition(column, op, _unquote(raw) if op != "in" else raw)
+        sql.append(f"({s})")
+        params.extend(p)
+    return f" {joiner} ".join(sql) or "1", params
+
+
+@dataclass
+class Stats:
+    requests: int = 0
+    by_kind: Counter = field(default_factory=Counter)
+    rows_read: int = 0
+    rows_written: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    server_seconds: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "by_kind": dict(self.by_kind),
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "server_seconds": self.server_seconds,
+        }
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+        self.error = None
+        self.count = None
+
+
+class FakeSupabase:
+    """
+    Client supabase-py minimal adossé à SQLite. latency : délai (s) ajouté
+    à chaque requête, hors verrou, pour simuler l'aller-retour réseau.
+    """
+
+    def __init__(self, latency: float = 0.0, seed: int = 0, json_roundtrip: bool = True):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.RLock()
+        self.latency = latency
+        self.json_roundtrip = json_roundtrip
+        self.rng = random.Random(seed)
+        self.stats = Stats()
+        self._columns: Dict[str, List[str]] = {}
+
+    # --- API supabase-py ---------------------------------------------------
+
+    def table(self, name: str) -> "Query":
+        return Query(self, name)
+
+    from_ = table
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> "RpcCall":
+        return RpcCall(self, name, params or {})
+
+    # --- helpers -----------------------------------------------------------
+
+    def new_id(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def columns(self, table: str) -> List[str]:
+        if table not in self._columns:
+            rows = self.conn.execute(f'pragma table_info("{table}")').fetchall()
+            if not rows:
+                raise APIError(f'relation "public.{table}" does not exist')
+            self._columns[table] = [r["name"] for r in rows]
+        return self._columns[table]
+
+    def ensure_columns(self, table: str, names) -> None:
+        known = self.columns(table)
+        for name in names:
+            if name not in known:
+                self.conn.execute(f'alter table "{table}" add column "{name}"')
+                known.append(name)
+
+    def primary_key(self, table: str) -> List[str]:
+        rows = self.conn.execute(f'pragma table_info("{table}")').fetchall()
+        return [r["name"] for r in sorted(rows, key=lambda r: r["pk"]) if r["pk"]]
+
+    def integer_id(self, table: str) -> bool:
+        row = self.conn.execute(f'select type from pragma_table_info("{table}") where name = ?', ("id",)).fetchone()
+        return bool(row) and row[0].upper() == "INTEGER"
+
+    def run(self, kind: str, fn, payload=None):
+        """
+        Exécute fn() sous verrou en comptant la requête ; latence réseau simulée hors verrou.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps(payload, default=str) if payload is not None else ""
+        with self.lock:
+            t0 = time.perf_counter()
+            try:
+                data, written = fn()
+                out = json.dumps(data, default=str)
+                if self.json_roundtrip:
+                    data = json.loads(out)
+            finally:
+                self.stats.server_seconds += time.perf_counter() - t0
+            self.stats.requests += 1
+            self.stats.by_kind[kind] += 1
+            self.stats.rows_read += len(data) if isinstance(data, list) and not written else 0
+            self.stats.rows_written += written
+            self.stats.bytes_in += len(body)
+            self.stats.bytes_out += len(out)
+        return Response(data)
+
+    def load(self, table: str, rows: Sequence[Dict[str, Any]]) -> None:
+        """
+        Chargement direct (génération du dataset), non compté.
+        """
+        if not rows:
+            return
+        with self.lock:
+            cols = sorted({k for r in rows for k in r})
+            self.ensure_columns(table, cols)
+            self.conn.executemany(
+                f'insert into "{table}" ({",".join(map(_q, cols))}) '
+                f'values ({",".join("?" * len(cols))})',
+                [[norm(r.get(c)) for c in cols] for r in rows],
+            )
+
+    def count(self, table: str) -> int:
+        with self.lock:
+            return self.conn.execute(f'select count(*) from "{table}"').fetchone()[0]
+
+
+def _parse_select(columns: str) -> Tuple[List[str], List[Tuple[str, str, List[str]]]]:
+    """
+    'a, b, alias:table!fk(c, d)' -> (["a", "b"], [("alias", "table", ["c", "d"])]).
+    """
+    plain, embeds = [], []
+    for part in _split_top(" ".join(columns.split())):
+        if "(" in part:
+            head, inner = part.split("(", 1)
+            alias, _, target = head.partition(":")
+            target = (target or alias).split("!")[0].strip()
+            embeds.append((alias.strip(), target, [c.strip() for c in inner.rstrip(")").split(",") if c.strip()]))
+        else:
+            plain.append(part.strip())
+    return plain, embeds
+
+
+class Query:
+    def __init__(self, client: FakeSupabase, table: str):
+        self.client = client
+        self.table_name = table
+        self.action = "select"
+        self.columns = "*"
+        self.where: List[Tuple[str, List[Any]]] = []
+        self.orders: List[Tuple[str, bool]] = []
+        self.limit_n: Optional[int] = None
+        self.offset_n = 0
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.returning = True
+
+    # --- actions -----------------------------------------------------------
+
+    def select(self, columns: str = "*", **_):
+        if self.action == "select":
+            self.columns = columns
+        else:
+            self.returning = True
+        return self
+
+    def insert(self, rows, **_):
+        self.action, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None, **_):
+        self.action, self.payload, self.on_conflict = "upsert", rows, on_conflict
+        return self
+
+    def update(self, values, **_):
+        self.action, self.payload = "update", values
+        return self
+
+    def delete(self, **_):
+        self.action = "delete"
+        return self
+
+    # --- filtres -----------------------------------------------------------
+
+    def filter(self, column: str, op: str, value):
+        self.where.append(_condition(column, op, value))
+        return self
+
+    def eq(self, c, v):
+        return self.filter(c, "eq", v)
+
+    def neq(self, c, v):
+        return self.filter(c, "neq", v)
+
+    def gt(self, c, v):
+        return self.filter(c, "gt", v)
+
+    def gte(self, c, v):
+        return self.filter(c, "gte", v)
+
+    def lt(self, c, v):
+        return self.filter(c, "lt", v)
+
+    def lte(self, c, v):
+        return self.filter(c, "lte", v)
+
+    def in_(self, c, values):
+        return self.filter(c, "in", list(values))
+
+    def is_(self, c, v):
+        return self.filter(c, "is", v)
+
+    def or_(self, expr: str, **_):
+        self.where.append(_logic(expr, "or"))
+        return self
+
+    def order(self, column: str, desc: bool = False, **_):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int, **_):
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int, **_):
+        self.offset_n, self.limit_n = start, end - start + 1
+        return self
+
+    # --- exécution ---------------------------------------------------------
+
+    def _where_sql(self) -> Tuple[str, List[Any]]:
+        if not self.where:
+            return "", []
+        sql = " and ".join(f"({s})" for s, _ in self.where)
+        return " where " + sql, [p for _, ps in self.where for p in ps]
+
+    def execute(self) -> Response:
+        kind = f"{self.action.upper()} {self.table_name}"
+        return self.client.run(kind, getattr(self, "_" + self.action), self.payload)
+
+    def _select(self):
+        c = self.client
+        plain, embeds = _parse_select(self.columns)
+        known = c.columns(self.table_name)
+        cols = known if plain in ([], ["*"]) else [p for p in plain if p in known]
+        missing = [p for p in plain if p not in known and p != "*"]
+        if missing:
+            raise APIError(f"column {self.table_name}.{missing[0]} does not exist")
+
+        where, params = self._where_sql()
+        order = ""
+        if self.orders:
+            order = " order by " + ", ".join(f'"{col}" {"desc" if d else "asc"}' for col, d in self.orders)
+        limit = min(self.limit_n, MAX_ROWS) if self.limit_n is not None else MAX_ROWS
+        fk_cols = [f"{alias}_id" for alias, _, _ in embeds if f"{alias}_id" in known and f"{alias}_id" not in cols]
+        select_cols = ",".join(map(_q, cols + fk_cols))
+
+        rows = [
+            dict(r)
+            for r in c.conn.execute(
+                f'select {select_cols} from "{self.table_name}"{where}{order} limit ? offset ?',
+                params + [limit, self.offset_n],
+            )
+        ]
+
+        for alias, target, sub_cols in embeds:
+            fk = f"{alias}_id"
+            ids = sorted({r.get(fk) for r in rows if r.get(fk)})
+            found = {}
+            for i in range(0, len(ids), 500):
+                chunk = ids[i: i + 500]
+                for r in c.conn.execute(
+                    f'select id, {",".join(map(_q, sub_cols))} from "{target}" '
+                    f'where id in ({",".join("?" * len(chunk))})',
+                    chunk,
+                ):
+                    found[r["id"]] = {s: r[s] for s in sub_cols}
+            for r in rows:
+                r[alias] = found.get(r.get(fk))
+                if fk in fk_cols:
+                    r.pop(fk, None)
+
+        return rows, 0
+
+    def _rows(self) -> List[Dict[str, Any]]:
+        rows = self.payload if isinstance(self.payload, list) else [self.payload]
+        return [{k: norm(v) for k, v in r.items()} for r in rows]
+
+    def _write(self, conflict: Optional[List[str]]):
+        c = self.client
+        rows = self._rows()
+        if not rows:
+            return [], 0
+
+        pk = c.primary_key(self.table_name)
+        # id uuid généré côté "serveur" (default gen_random_uuid()), sauf identité entière
+        uuid_pk = pk == ["id"] and not c.integer_id(self.table_name)
+        out = []
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for r in rows:
+            if uuid_pk and "id" not in r:
+                r["id"] = c.new_id()
+            groups.setdefault(tuple(sorted(r)), []).append(r)
+
+        for cols, group in groups.items():
+            c.ensure_columns(self.table_name, cols)
+            col_sql = ",".join(map(_q, cols))
+            sql = f'insert into "{self.table_name}" ({col_sql}) values ({",".join("?" * len(cols))})'
+            if conflict is not None:
+                target = conflict or pk
+                updates = [col for col in cols if col not in target]
+                sql += f' on conflict ({",".join(map(_q, target))}) do '
+                sql += ("update set " + ",".join(f'"{u}" = excluded."{u}"' for u in updates)) if updates else "nothing"
+            try:
+                c.conn.executemany(sql, [[r[col] for col in cols] for r in group])
+            except sqlite3.IntegrityError as e:
+                raise APIError(str(e))
+            out.extend(group)
+
+        return (out if self.returning else []), len(rows)
+
+    def _insert(self):
+        return self._write(None)
+
+    def _upsert(self):
+        conflict = [s.strip() for s in self.on_conflict.split(",")] if self.on_conflict else []
+        return self._write(conflict)
+
+    def _update(self):
+        c = self.client
+        values = {k: norm(v) for k, v in self.payload.items()}
+        c.ensure_columns(self.table_name, values)
+        where, params = self._where_sql()
+        cur = c.conn.execute(
+            f'update "{self.table_name}" set {",".join(_q(k) + " = ?" for k in values)}{where}',
+            list(values.values()) + params,
+        )
+        return [], cur.rowcount
+
+    def _delete(self):
+        where, params = self._where_sql()
+        cur = self.client.conn.execute(f'delete from "{self.table_name}"{where}', params)
+        return [], cur.rowcount
+
+
+class RpcCall:
+    def __init__(self, client: FakeSupabase, name: str, params: Dict[str, Any]):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self) -> Response:
+        fn = getattr(self, "_" + self.name, None)
+        if fn is None:
+            raise APIError(f"function public.{self.name} does not exist", code="PGRST202")
+        return self.client.run(f"RPC {self.name}", fn, self.params)
+
+    def _query(self, sql: str, params: List[Any]):
+        return [dict(r) for r in self.client.conn.execute(sql, params)], 0
+
+    def _latest(self, ids: List[str], extra: str = "", extra_params=(), desc: bool = True):
+        if not ids:
+            return [], 0
+        return self._query(
+            f"""
+            select instrument_id, price, fetched_at from (
+              select instrument_id, price, fetched_at,
+                     row_number() over (partition by instrument_id
+                                        order by fetched_at {"desc" if desc else "asc"}) as rn
+              from asset_prices
+              where instrument_id in ({",".join("?" * len(ids))}) {extra}
+            ) where rn = 1
+            """,
+            list(ids) + list(extra_params),
+        )
+
+    def _latest_prices(self):
+        return self._latest(self.params["p_instrument_ids"])
+
+    def _latest_prices_for_day(self):
+        start, end = paris_day_bounds_utc(self.params["p_day"])
+        return self._latest(
+            self.params["p_instrument_ids"],
+            "and fetched_at >= ? and fetched_at < ?",
+            (norm(start), norm(end)),
+        )
+
+    def _update_holding_values(self):
+        ids, prices, values = (self.params[k] for k in ("p_ids", "p_prices", "p_values"))
+        updated = []
+        for hid, price, value in zip(ids, prices, values):
+            cur = self.client.conn.execute(
+                "update holdings set current_price = ?, current_value = ? where id = ?",
+                [price, value, hid],
+            )
+            if cur.rowcount:
+                updated.append(hid)
+        return updated, len(updated)
+
+    def _prices_at(self):
+        ids, at = self.params["p_instrument_ids"], norm(self.params["p_at"])
+        before, _ = self._latest(ids, "and fetched_at <= ?", (at,))
+        found = {r["instrument_id"] for r in before}
+        rest = [i for i in ids if i not in found]
+        after, _ = self._latest(rest, "and fetched_at > ?", (at,), desc=False)
+        return before + after, 0
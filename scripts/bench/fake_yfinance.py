@@ -0,0 +1,216 @@
+"""
+Fournisseur yfinance déterministe pour le banc de mesure.
+
+install() remplace le module "yfinance" (sys.modules) par un faux module
+exposant download() et Ticker() : mêmes formes de DataFrames que yfinance
+(colonnes MultiIndex (ticker, champ) avec group_by="ticker", index daté),
+générées par une marche aléatoire seedée par le symbole. Deux runs avec
+les mêmes paramètres voient donc exactement les mêmes prix.
+
+Les symboles préfixés par DEAD ne renvoient aucune donnée (titres radiés).
+throttle_every=N simule le throttling Yahoo : un appel sur N lève
+"429 Too Many Requests" (exerce les retries de olympe.yf_scheduler).
+"""
+import re
+import sys
+import threading
+import time
+import types
+import zlib
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from olympe.lazy import np, pd
+
+
+DEAD_PREFIX = "DEAD"
+
+INTRADAY_BARS = 30
+
+
+def _seed(symbol: str, salt: int = 0) -> int:
+    return (zlib.crc32(symbol.encode()) + salt * 7919) & 0xFFFFFFFF
+
+
+def _period_days(period: Optional[str]) -> Optional[int]:
+    if not period or period == "max":
+        return None
+    m = re.fullmatch(r"(\d+)(d|wk|mo|y)", period)
+    if not m:
+        return None
+    n, unit = int(m.group(1)), m.group(2)
+    return n * {"d": 1, "wk": 7, "mo": 31, "y": 366}[unit]
+
+
+class FakeYFinance(types.ModuleType):
+    """
+    years : profondeur d'historique disponible ; latency : délai (s) par appel
+    réseau simulé (download, history).
+    """
+
+    def __init__(
+        self,
+        years: int = 10,
+        latency: float = 0.0,
+        today: Optional[date] = None,
+        throttle_every: int = 0,
+    ):
+        super().__init__("yfinance")
+        self.years = years
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.today = today or datetime.now(timezone.utc).date()
+        self.calls = Counter()
+        self.tickers_requested = 0
+        self.rows_served = 0
+        self._lock = threading.Lock()
+        self._daily: Dict[str, "pd.DataFrame"] = {}
+
+    # --- génération ---------------------------------------------------------
+
+    def daily(self, symbol: str):
+        """
+        Historique daily complet (jours ouvrés) du symbole, mis en cache.
+        """
+        with self._lock:
+            frame = self._daily.get(symbol)
+        if frame is not None:
+            return frame
+
+        rng = np.random.default_rng(_seed(symbol))
+        start = self.today - timedelta(days=366 * self.years)
+        index = pd.bdate_range(start, self.today, name="Date")
+        n = len(index)
+
+        drift, vol = rng.uniform(-0.0002, 0.0006), rng.uniform(0.008, 0.025)
+        close = rng.uniform(10, 300) * np.exp(np.cumsum(rng.normal(drift, vol, n)))
+        spread = np.abs(rng.normal(0, vol / 2, n))
+        frame = pd.DataFrame(
+            {
+                "Open": close * (1 + rng.normal(0, vol / 3, n)),
+                "High": close * (1 + spread),
+                "Low": close * (1 - spread),
+                "Close": close,
+                "Adj Close": close * 0.99,
+                "Volume": rng.integers(1_000, 1_000_000, n).astype(np.float64),
+            },
+            index=index,
+        )
+        with self._lock:
+            self._daily[symbol] = frame
+        return frame
+
+    def intraday(self, symbol: str, now: Optional[datetime] = None):
+        """
+        Dernières barres 1m (UTC) autour de la dernière clôture daily.
+        """
+        now = (now or datetime.now(timezone.utc)).replace(second=0, microsecond=0)
+        last = float(self.daily(symbol)["Close"].iloc[-1])
+        minute = int(now.timestamp() // 60)
+        rng = np.random.default_rng(_seed(symbol, minute))
+        index = pd.date_range(end=now, periods=INTRADAY_BARS, freq="min", tz="UTC", name="Datetime")
+        close = last * (1 + np.cumsum(rng.normal(0, 0.0005, INTRADAY_BARS)))
+        return pd.DataFrame(
+            {"Open": close, "High": close, "Low": close, "Close": close, "Adj Close": close, "Volume": 100.0},
+            index=index,
+        )
+
+    def _frame(self, symbol: str, interval: str, start=None, end=None, period=None):
+        if symbol.upper().startswith(DEAD_PREFIX):
+            return None
+
+        if interval != "1d":
+            frame = self.intraday(symbol)
+        else:
+            frame = self.daily(symbol)
+            if start is not None:
+                frame = frame[frame.index >= pd.Timestamp(str(start)[:10])]
+            if end is not None:
+                frame = frame[frame.index < pd.Timestamp(str(end)[:10])]
+            days = _period_days(period) if start is None else None
+            if days is not None:
+                frame = frame[frame.index > pd.Timestamp(self.today - timedelta(days=days))]
+        return frame if len(frame) else None
+
+    def _sleep(self, kind: str, n: int = 1) -> None:
+        with self._lock:
+            self.calls[kind] += 1
+            self.tickers_requested += n
+            total = sum(self.calls.values())
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_every and total % self.throttle_every == 0:
+            with self._lock:
+                self.calls["throttled"] += 1
+            raise Exception("429 Client Error: Too Many Requests")
+
+    # --- API yfinance -------------------------------------------------------
+
+    def download(self, tickers, start=None, end=None, period=None, interval="1d", **_):
+        symbols = tickers.split() if isinstance(tickers, str) else list(tickers)
+        self._sleep("download", len(symbols))
+
+        frames = {}
+        for symbol in symbols:
+            frame = self._frame(symbol, interval, start, end, period)
+            if frame is not None:
+                frames[symbol] = frame
+
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, axis=1)
+        df.columns.names = ["Ticker", "Price"]
+        with self._lock:
+            self.rows_served += sum(len(f) for f in frames.values())
+        return df
+
+    def Ticker(self, symbol: str) -> "FakeTicker":
+        return FakeTicker(self, symbol)
+
+    # --- compteurs ----------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "tickers_requested": self.tickers_requested,
+                "rows_served": self.rows_served,
+            }
+
+
+class FakeTicker:
+    def __init__(self, provider: FakeYFinance, symbol: str):
+        self.provider = provider
+        self.ticker = symbol
+
+    def history(self, period="1mo", interval="1d", start=None, end=None, **_):
+        self.provider._sleep("history")
+        frame = self.provider._frame(self.ticker, interval, start, end, period)
+        return frame.copy() if frame is not None else pd.DataFrame()
+
+    def _last(self) -> Optional[float]:
+        frame = self.provider._frame(self.ticker, "1d")
+        return None if frame is None else float(frame["Close"].iloc[-1])
+
+    @property
+    def fast_info(self) -> Dict[str, Optional[float]]:
+        self.provider._sleep("fast_info")
+        return {"last_price": self._last()}
+
+    @property
+    def info(self) -> Dict[str, Optional[float]]:
+        self.provider._sleep("info")
+        return {"regularMarketPrice": self._last()}
+
+
+def install(provider: FakeYFinance) -> FakeYFinance:
+    """
+    Enregistre le faux module ; olympe.lazy.yf le résout au prochain accès.
+    """
+    from olympe import lazy
+
+    sys.modules["yfinance"] = provider
+    lazy.yf.__dict__["_lazy_target"] = None
+    return provider
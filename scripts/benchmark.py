@@ -0,0 +1,330 @@
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from bench.datasets import DatasetSpec, generate
+from bench.fake_postgrest import FakeSupabase
+from bench.fake_yfinance import FakeYFinance, install
+from olympe.client import set_supabase
+from olympe.metrics import METRICS
+from olympe.yf_scheduler import YF_SCHEDULER
+
+
+# Banc de mesure hors-ligne des jobs Olympe.
+#
+# Les scripts tournent dans ce process, sans réseau : Supabase est remplacé par
+# un stand-in PostgREST sur SQLite (bench.fake_postgrest), yfinance par un
+# fournisseur déterministe (bench.fake_yfinance), sur un dataset synthétique
+# (bench.datasets). Chaque étape mesure le temps mur, le temps passé dans le
+# stand-in, les requêtes par table / méthode, les lignes lues et écrites, les
+# appels yfinance et le pic de RSS ; le rapport JSON se compare à un run
+# précédent avec --compare.
+#
+#     python scripts/benchmark.py --instruments 200 --users 100 --holdings 800 \
+#         --years 5 --out bench.json --compare bench-main.json
+
+
+# étape -> (module, argv)
+STAGES: Dict[str, tuple] = {
+    "backfill": ("backfill_yfinance", []),
+    "sync": ("sync_asset_prices_daily", []),
+    "returns": ("fetch_returns", ["--source", "daily"]),
+    "returns_yf": ("fetch_returns", ["--source", "yfinance"]),
+    "refresh": ("refresh_yfinance_prices", []),
+    "performance": ("compute_instrument_performance", []),
+    "portfolio": ("compute_portfolio_history_daily", ["--bulk"]),
+    "portfolio_per_user": ("compute_portfolio_history_daily", []),
+}
+
+DEFAULT_STAGES = "backfill,sync,returns,refresh,portfolio"
+
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+class RssSampler:
+    """
+    Pic de RSS pendant une étape (échantillonnage /proc ; à défaut ru_maxrss,
+    qui est un maximum sur toute la vie du process).
+    """
+
+    def __init__(self):
+        self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            rss = current_rss_mb()
+            if rss is not None and rss > (self.peak or 0):
+                self.peak = rss
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        rss = current_rss_mb()
+        if rss is not None and rss > (self.peak or 0):
+            self.peak = rss
+        if self.peak is None:
+            self.peak = max_rss_mb()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def diff(after: Dict[str, Any], before: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for key, value in after.items():
+        prev = before.get(key)
+        if isinstance(value, dict):
+            out[key] = {k: v - (prev or {}).get(k, 0) for k, v in value.items() if v - (prev or {}).get(k, 0)}
+        elif isinstance(value, (int, float)):
+            out[key] = value - (prev or 0)
+    return out
+
+
+def run_stage(name: str, fake: FakeSupabase, yf: FakeYFinance, verbose: bool) -> Dict[str, Any]:
+    module_name, argv = STAGES[name]
+    module = importlib.import_module(module_name)
+
+    db_before, yf_before = fake.stats.snapshot(), yf.snapshot()
+    METRICS.reset()
+    status, error = "ok", None
+    sink = open(os.devnull, "w") if not verbose else None
+
+    old_argv = sys.argv
+    sys.argv = [module_name + ".py"] + list(argv)
+    t0 = time.perf_counter()
+    try:
+        with RssSampler() as rss, contextlib.redirect_stdout(sink or sys.stdout):
+            try:
+                module.main()
+            except SystemExit as e:
+                if e.code not in (None, 0):
+                    status, error = "failed", f"exit {e.code}"
+            except Exception as e:
+                status, error = "failed", f"{type(e).__name__}: {e}"
+    finally:
+        wall = time.perf_counter() - t0
+        sys.argv = old_argv
+        if sink is not None:
+            sink.close()
+
+    db = diff(fake.stats.snapshot(), db_before)
+    yfd = diff(yf.snapshot(), yf_before)
+    rows = db["rows_read"] + db["rows_written"]
+    return {
+        "stage": name,
+        "status": status,
+        "error": error,
+        "wall_s": round(wall, 4),
+        "server_s": round(db["server_seconds"], 4),
+        "client_s": round(wall - db["server_seconds"], 4),
+        "requests": db["requests"],
+        "requests_by_kind": dict(sorted(db["by_kind"].items())),
+        "rows_read": db["rows_read"],
+        "rows_written": db["rows_written"],
+        "rows_per_s": round(rows / wall, 1) if wall > 0 else None,
+        "bytes_in": db["bytes_in"],
+        "bytes_out": db["bytes_out"],
+        "yf_calls": yfd.get("calls", {}),
+        "yf_tickers": yfd.get("tickers_requested", 0),
+        "yf_rows": yfd.get("rows_served", 0),
+        "peak_rss_mb": round(rss.peak, 1),
+        "metrics": METRICS.snapshot(),
+    }
+
+
+def print_report(report: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> None:
+    before = {s["stage"]: s for s in (previous or {}).get("stages", [])}
+
+    header = f"{'stage':<20}{'status':<8}{'wall_s':>9}{'client_s':>10}{'req':>7}{'rows/s':>11}{'yf':>5}{'rss_mb':>9}"
+    if previous:
+        header += f"{'prev_wall':>11}{'delta':>9}"
+    print(header, file=sys.stderr)
+
+    for s in report["stages"]:
+        line = (
+            f"{s['stage']:<20}{s['status']:<8}{s['wall_s']:>9.3f}{s['client_s']:>10.3f}"
+            f"{s['requests']:>7}{s['rows_per_s'] or 0:>11.0f}{sum(s['yf_calls'].values()):>5}{s['peak_rss_mb']:>9.1f}"
+        )
+        prev = before.get(s["stage"])
+        if prev:
+            delta = (s["wall_s"] - prev["wall_s"]) / prev["wall_s"] * 100 if prev["wall_s"] else 0.0
+            line += f"{prev['wall_s']:>11.3f}{delta:>+8.1f}%"
+        print(line, file=sys.stderr)
+        if s["error"]:
+            print(f"    ! {s['error']}", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Banc de mesure hors-ligne (Supabase et yfinance simulés)")
+    parser.add_argument("--instruments", type=int, default=100)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--holdings", type=int, default=300)
+    parser.add_argument("--years", type=int, default=5, help="Profondeur d'historique yfinance (années).")
+    parser.add_argument("--quote-days", type=int, default=5, help="Jours de quotes intraday pré-chargées.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--stages",
+        default=DEFAULT_STAGES,
+        help=f"Étapes dans l'ordre, répétables (parmi : {', '.join(STAGES)}).",
+    )
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Latence simulée par requête PostgREST.")
+    parser.add_argument("--yf-latency-ms", type=float, default=0.0, help="Latence simulée par appel yfinance.")
+    parser.add_argument(
+        "--yf-rate",
+        type=float,
+        default=0.0,
+        help="Débit YF_SCHEDULER (appels/s) ; 0 = illimité (défaut : mesure du code seul).",
+    )
+    parser.add_argument(
+        "--yf-throttle-every",
+        type=int,
+        default=0,
+        help="Simule un throttling Yahoo (429) tous les N appels.",
+    )
+    parser.add_argument(
+        "--yf-cache",
+        default="cold",
+        help="'cold' (cache neuf, défaut), 'off', ou chemin d'un cache existant.",
+    )
+    parser.add_argument("--out", help="Fichier JSON du rapport.")
+    parser.add_argument("--compare", help="Rapport JSON précédent à comparer.")
+    parser.add_argument("--verbose", action="store_true", help="Garde la sortie des scripts.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    stages: List[str] = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"Étapes inconnues : {', '.join(unknown)}")
+
+    spec = DatasetSpec(
+        instruments=args.instruments,
+        users=args.users,
+        holdings=args.holdings,
+        years=args.years,
+        quote_days=args.quote_days,
+        seed=args.seed,
+    )
+
+    with tempfile.TemporaryDirectory(prefix="olympe-bench-") as tmp:
+        # Jamais de vraie base ni de vrai cache : variables d'env neutralisées.
+        os.environ["SUPABASE_URL"] = "http://bench.invalid"
+        os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "bench"
+        cache = {"cold": os.path.join(tmp, "yf_cache.sqlite"), "off": "off"}.get(args.yf_cache, args.yf_cache)
+        os.environ["OLYMPE_YF_CACHE"] = cache
+
+        fake = FakeSupabase(latency=args.db_latency_ms / 1000, seed=args.seed)
+        yf = install(
+            FakeYFinance(years=args.years, latency=args.yf_latency_ms / 1000, throttle_every=args.yf_throttle_every)
+        )
+        YF_SCHEDULER.configure(rate=args.yf_rate)
+        set_supabase(fake)
+
+        t0 = time.perf_counter()
+        counts = generate(fake, spec)
+        print(f"Dataset généré en {time.perf_counter() - t0:.2f}s : {counts}", file=sys.stderr)
+
+        results = []
+        seen: Dict[str, int] = {}
+        for name in stages:
+            print(f"→ {name}", file=sys.stderr)
+            result = run_stage(name, fake, yf, args.verbose)
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                result["stage"] = f"{name}#{seen[name]}"
+            results.append(result)
+
+        tables = {t: fake.count(t) for t in ("asset_prices", "asset_prices_daily", "instrument_returns", "portfolio_history_daily")}
+        set_supabase(None)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset": asdict(spec),
+            "dataset_rows": counts,
+            "final_rows": tables,
+            "db_latency_ms": args.db_latency_ms,
+            "yf_latency_ms": args.yf_latency_ms,
+            "yf_rate": args.yf_rate,
+            "yf_throttle_every": args.yf_throttle_every,
+            "yf_cache": args.yf_cache,
+        },
+        "stages": results,
+        "totals": {
+            "wall_s": round(sum(s["wall_s"] for s in results), 4),
+            "requests": sum(s["requests"] for s in results),
+            "rows_read": sum(s["rows_read"] for s in results),
+            "rows_written": sum(s["rows_written"] for s in results),
+            "failed": [s["stage"] for s in results if s["status"] != "ok"],
+        },
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print_report(report, previous)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Rapport écrit dans {args.out}", file=sys.stderr)
+
+    if report["totals"]["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from olympe.batch import UpsertResult, upsert_batched
+from olympe.client import supabase
+from olympe.metrics import job, timer
+from olympe.reader import stream_rows
+from olympe.utils import PARIS, to_float
+
+
+UPSERT_BATCH = 500
+
+
+RPC_CHUNK = 1000
+
+
+WINDOWS = ("1d", "30d", "ytd", "1y")
+
+
+def window_starts(now_utc: datetime) -> Dict[str, datetime]:
+    """
+    Début de chaque fenêtre de performance (UTC) :
+    1d / 30d glissants, ytd = 1er janvier 00:00 Paris, 1y = même instant un an plus tôt.
+    """
+    paris_now = now_utc.astimezone(PARIS)
+    year_start = datetime(paris_now.year, 1, 1, tzinfo=PARIS).astimezone(timezone.utc)
+
+    try:
+        one_year = now_utc.replace(year=now_utc.year - 1)
+    except ValueError:  # 29 février
+        one_year = now_utc.replace(year=now_utc.year - 1, day=28)
+
+    return {
+        "1d": now_utc - timedelta(days=1),
+        "30d": now_utc - timedelta(days=30),
+        "ytd": year_start,
+        "1y": one_year,
+    }
+
+
+def fetch_prices(rpc: str, instrument_ids: Sequence[str], **params) -> Dict[str, Tuple[float, str]]:
+    """
+    Appelle une RPC (instrument_id, price, fetched_at) par paquets de RPC_CHUNK ids.
+    Renvoie {instrument_id: (price, fetched_at)}.
+    """
+    out: Dict[str, Tuple[float, str]] = {}
+    ids = list(instrument_ids)
+
+    for i in range(0, len(ids), RPC_CHUNK):
+        rows = (
+            supabase.rpc(rpc, {"p_instrument_ids": ids[i: i + RPC_CHUNK], **params})
+            .execute()
+            .data
+            or []
+        )
+        for r in rows:
+            if r.get("instrument_id") and r.get("price") is not None:
+                out[r["instrument_id"]] = (to_float(r["price"]), r.get("fetched_at"))
+
+    return out
+
+
+def change(last: Optional[float], ref: Optional[float]) -> Optional[float]:
+    if last is None or not ref or ref <= 0:
+        return None
+    return last / ref - 1
+
+
+def performance_rows(
+    instrument_ids: Sequence[str],
+    latest: Dict[str, Tuple[float, str]],
+    refs: Dict[str, Dict[str, Tuple[float, str]]],
+    computed_at: str,
+) -> List[dict]:
+    """
+    Une ligne instrument_performance par instrument ayant au moins un prix.
+    """
+    rows: List[dict] = []
+
+    for iid in instrument_ids:
+        if iid not in latest:
+            continue
+
+        last_price, last_at = latest[iid]
+        row = {
+            "instrument_id": iid,
+            "last_price": last_price,
+            "last_price_at": last_at,
+            "computed_at": computed_at,
+        }
+        for window in WINDOWS:
+            ref_price, ref_at = refs[window].get(iid, (None, None))
+            row[f"ref_{window}"] = ref_price
+            row[f"ref_{window}_at"] = ref_at
+            row[f"change_{window}"] = change(last_price, ref_price)
+        rows.append(row)
+
+    return rows
+
+
+def run_performance(
+    instrument_ids: Optional[Sequence[str]] = None,
+    batch_size: int = UPSERT_BATCH,
+    log=print,
+) -> UpsertResult:
+    """
+    Calcule et écrit le snapshot instrument_performance des instruments
+    demandés (défaut : tous). Une RPC latest_prices + une RPC prices_at
+    par fenêtre, quel que soit le nombre de quotes stockées.
+    """
+    if instrument_ids is None:
+        instrument_ids = [r["id"] for r in stream_rows(supabase, "instruments", "id")]
+    instrument_ids = sorted(set(instrument_ids))
+
+    if not instrument_ids:
+        log("Aucun instrument, snapshot de performance ignoré.")
+        return UpsertResult()
+
+    now_utc = datetime.now(timezone.utc)
+
+    with timer("prices"):
+        latest = fetch_prices("latest_prices", instrument_ids)
+        refs = {
+            window: fetch_prices("prices_at", instrument_ids, p_at=start.isoformat())
+            for window, start in window_starts(now_utc).items()
+        }
+
+    rows = performance_rows(instrument_ids, latest, refs, now_utc.isoformat())
+
+    with timer("upsert"):
+        res = upsert_batched(
+            supabase,
+            "instrument_performance",
+            rows,
+            on_conflict="instrument_id",
+            batch_size=batch_size,
+            log=log,
+        )
+    log(f"instrument_performance : {res.written}/{len(rows)} instruments ({len(instrument_ids)} demandés)")
+    return res
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Snapshot de performance 1D / 30D / YTD / 1Y par instrument")
+    parser.add_argument(
+        "--upsert-batch",
+        type=int,
+        default=UPSERT_BATCH,
+        help="Nombre de lignes instrument_performance par upsert.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    res = run_performance(batch_size=args.upsert_batch)
+
+    if res.failed:
+        raise SystemExit(f"{len(res.failed)} snapshot(s) could not be written.")
+
+
+if __name__ == "__main__":
+    with job("compute_instrument_performance"):
+        main()
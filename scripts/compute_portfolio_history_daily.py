@@ -1,25 +1,37 @@
-import os
-from datetime import datetime
-from zoneinfo import ZoneInfo
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 
-from supabase import create_client, Client
+from supabase import Client
 
+from olympe.batch import upsert_batched
+from olympe.client import get_supabase
+from olympe.columnar import decode_price_rows, latest_per_day
+from olympe.lazy import np
+from olympe.metrics import job, timer
+from olympe.price_matrix import load_daily_matrix
+from olympe.reader import fetch_rows, stream_rows
+from olympe.utils import paris_day_bounds_utc, paris_day_today, to_float, to_paris_day
 
-PARIS = ZoneInfo("Europe/Paris")
 
+PAGE_SIZE = 1000
 
-def to_float(v):
-    if v is None or v == "":
-        return 0.0
-    try:
-        return float(v)
-    except Exception:
-        return 0.0
 
+IN_CHUNK = 200
+
+
+UPSERT_BATCH = 500
+
+
+RPC_CHUNK = 1000
 
-def paris_day_today() -> str:
-    
-    return datetime.now(PARIS).date().isoformat()
+
+# Mode --from/--to : profondeur de prix daily chargée avant le premier jour,
+# pour que le forward-fill ait un point de départ (week-ends, jours fériés).
+PRICE_SEED_DAYS = 30
+
+
+MOVEMENT_SIGNS = {"BUY": 1.0, "SELL": -1.0}
 
 
 def latest_price_for_day(rows, target_day: str) -> dict:
@@ -27,65 +39,178 @@ def latest_price_for_day(rows, target_day: str) -> dict:
     rows: liste d'enregistrements asset_prices (instrument_id, price, fetched_at)
     -> retourne un dict instrument_id -> prix "dernier de la journée target_day (Paris)"
     Si plusieurs quotes le même jour => on garde la plus récente (en Paris).
+    Décodage et réduction en colonnes (olympe.columnar), pas de parsing par ligne.
     """
-    last = {}
-    for r in rows:
-        inst = r["instrument_id"]
-        price = to_float(r["price"])
-        fetched_at = r["fetched_at"]
-        if not fetched_at or not inst:
-            continue
+    ids, days, prices, _ = latest_per_day(decode_price_rows(rows))
 
-        
-        dt = datetime.fromisoformat(fetched_at.replace("Z", "+00:00")).astimezone(PARIS)
-        d = dt.date().isoformat()
+    keep = days == np.datetime64(target_day, "D")
+    return dict(zip(ids[keep].tolist(), prices[keep].tolist()))
 
-        if d != target_day:
+
+def compute_user_total(accounts, holdings, prices_map) -> float:
+    """
+    Valeur totale d'un utilisateur pour la journée :
+    - holdings valorisés au dernier prix du jour (sinon current_value,
+      sinon quantity * current_price)
+    - + montant des comptes sans aucun holding (comptes "standalone")
+    """
+    total_holdings_value = 0.0
+    accounts_with_holdings = set()
+
+    for h in holdings:
+        accounts_with_holdings.add(h.get("account_id"))
+        qty = to_float(h.get("quantity"))
+        if qty <= 0 or not h.get("instrument_id"):
             continue
 
-        prev = last.get(inst)
-        if prev is None or dt > prev["dt"]:
-            last[inst] = {"dt": dt, "price": price}
+        inst = h["instrument_id"]
 
-    return {k: v["price"] for k, v in last.items()}
 
+        daily_price = prices_map.get(inst)
+
+
+        if daily_price is None:
+            cv = h.get("current_value")
+            if cv is not None:
+                total_holdings_value += to_float(cv)
+            else:
+                total_holdings_value += qty * to_float(h.get("current_price"))
+        else:
+            total_holdings_value += qty * to_float(daily_price)
+
+
+    total_standalone = 0.0
+    for a in accounts:
+        aid = a.get("id")
+        if aid and aid not in accounts_with_holdings:
+            total_standalone += to_float(a.get("current_amount"))
+
+    return total_holdings_value + total_standalone
 
-def main():
-    url = os.environ["SUPABASE_URL"]
-    key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
-    supabase: Client = create_client(url, key)
 
-    day = paris_day_today()
+def history_payload(uid: str, day: str, total_value: float) -> dict:
+    return {
+        "user_id": uid,
+        "day": day,
+        "total_value": total_value,
+        "computed_at": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+    }
 
+
+def fetch_all(supabase: Client, table: str, columns: str, filters=None):
+    """
+    Charge toute une table par pages de PAGE_SIZE (pagination keyset sur id).
+    """
+    with timer(f"load.{table}"):
+        return fetch_rows(supabase, table, columns, filters=filters, page_size=PAGE_SIZE)
+
+
+def fetch_day_prices(supabase: Client, instrument_ids, day: str) -> dict:
+    """
+    Dernier prix de la journée `day` (Paris) pour un ensemble d'instruments.
+    Les quotes sont filtrées sur la fenêtre UTC de la journée côté serveur,
+    par paquets de IN_CHUNK instruments et pages de PAGE_SIZE lignes.
+    """
+    start_iso, end_iso = paris_day_bounds_utc(day)
+    rows = []
+
+    for i in range(0, len(instrument_ids), IN_CHUNK):
+        ids = instrument_ids[i: i + IN_CHUNK]
+        rows.extend(
+            stream_rows(
+                supabase,
+                "asset_prices",
+                "instrument_id,price,fetched_at",
+                order="fetched_at",
+                desc=True,
+                filters=lambda q, ids=ids: q.in_("instrument_id", ids).gte("fetched_at", start_iso).lt("fetched_at", end_iso),
+                page_size=PAGE_SIZE,
+            )
+        )
+
+    return latest_price_for_day(rows, day)
+
+
+def fetch_latest_prices_for_day(supabase: Client, instrument_ids, day: str) -> dict:
+    """
+    Dernier prix de la journée `day` (Paris) par instrument, calculé côté
+    serveur (RPC latest_prices_for_day, cf. supabase/migrations) :
+    une ligne par instrument, par paquets de RPC_CHUNK ids.
+    Si la fonction n'est pas déployée, repli sur fetch_day_prices.
+    """
+    prices = {}
+
+    try:
+        with timer("prices"):
+            for i in range(0, len(instrument_ids), RPC_CHUNK):
+                rows = (
+                    supabase.rpc(
+                        "latest_prices_for_day",
+                        {"p_instrument_ids": instrument_ids[i: i + RPC_CHUNK], "p_day": day},
+                    )
+                    .execute()
+                    .data
+                    or []
+                )
+                for r in rows:
+                    if r.get("instrument_id") and r.get("price") is not None:
+                        prices[r["instrument_id"]] = to_float(r["price"])
+    except Exception as e:
+        print(f"[WARN] RPC latest_prices_for_day unavailable ({e}), falling back to asset_prices scan")
+        return fetch_day_prices(supabase, instrument_ids, day)
+
+    return prices
+
+
+def flush_history(supabase: Client, payloads, batch_size: int) -> int:
+    """
+    Upsert des snapshots portfolio_history_daily par paquets (on_conflict user_id,day),
+    repli ligne par ligne si un paquet échoue. Renvoie le nombre de lignes en échec.
+    """
+    if not payloads:
+        return 0
+
+    with timer("upsert"):
+        res = upsert_batched(
+            supabase,
+            "portfolio_history_daily",
+            payloads,
+            on_conflict="user_id,day",
+            batch_size=batch_size,
+        )
+    print(f"Upserted {res.written}/{len(payloads)} snapshots in {res.batches} batch(es)")
+    return len(res.failed)
+
+
+def run_per_user(supabase: Client, day: str, batch_size: int = UPSERT_BATCH) -> int:
     
     
-    acc_rows = supabase.table("accounts").select("user_id").execute().data or []
+    acc_rows = fetch_all(supabase, "accounts", "user_id")
     user_ids = sorted({r["user_id"] for r in acc_rows if r.get("user_id")})
 
     if not user_ids:
         print("No users found (no accounts).")
-        return
+        return 0
+
+    payloads = []
+    failed = 0
 
     
     for uid in user_ids:
         
-        accounts = (
-            supabase.table("accounts")
-            .select("id,user_id,current_amount")
-            .eq("user_id", uid)
-            .execute()
-            .data
-            or []
+        accounts = fetch_all(
+            supabase,
+            "accounts",
+            "id,user_id,current_amount",
+            filters=lambda q: q.eq("user_id", uid),
         )
 
         
-        holdings = (
-            supabase.table("holdings")
-            .select("id,user_id,account_id,instrument_id,quantity,current_price,current_value")
-            .eq("user_id", uid)
-            .execute()
-            .data
-            or []
+        holdings = fetch_all(
+            supabase,
+            "holdings",
+            "id,user_id,account_id,instrument_id,quantity,current_price,current_value",
+            filters=lambda q: q.eq("user_id", uid),
         )
 
         
@@ -93,78 +218,303 @@ def main():
         prices_map = {}
 
         if instrument_ids:
+            prices_map = fetch_latest_prices_for_day(supabase, instrument_ids, day)
+
+        total_value = compute_user_total(accounts, holdings, prices_map)
+
             
-            
-            
-            
-            now_utc = datetime.utcnow()
-            
-            from_iso = (now_utc.replace(microsecond=0)).isoformat() + "Z"
-
-            price_rows = (
-                supabase.table("asset_prices")
-                .select("instrument_id,price,fetched_at")
-                .in_("instrument_id", instrument_ids)
-                .order("fetched_at", desc=True)
-                .limit(5000)  
-                .execute()
-                .data
-                or []
-            )
+        payloads.append(history_payload(uid, day, total_value))
 
-            prices_map = latest_price_for_day(price_rows, day)
+        print(f"[OK] {uid} day={day} total_value={total_value}")
 
-        
-        total_holdings_value = 0.0
-        accounts_with_holdings = set()
+        if len(payloads) >= batch_size:
+            failed += flush_history(supabase, payloads, batch_size)
+            payloads = []
 
-        for h in holdings:
-            accounts_with_holdings.add(h.get("account_id"))
-            qty = to_float(h.get("quantity"))
-            if qty <= 0 or not h.get("instrument_id"):
-                continue
+    failed += flush_history(supabase, payloads, batch_size)
+    return failed
 
-            inst = h["instrument_id"]
 
-            
-            daily_price = prices_map.get(inst)
+def run_bulk(supabase: Client, day: str, batch_size: int = UPSERT_BATCH) -> int:
+    """
+    Même calcul que run_per_user, avec un nombre fixe d'allers-retours :
+    accounts et holdings chargés en entier (paginés), un lookup de prix
+    pour l'union des instruments, regroupement par user en mémoire,
+    puis upserts par paquets de batch_size.
+    """
+    accounts = fetch_all(supabase, "accounts", "id,user_id,current_amount")
+    holdings = fetch_all(
+        supabase,
+        "holdings",
+        "id,user_id,account_id,instrument_id,quantity,current_price,current_value",
+    )
+    print(f"Loaded accounts={len(accounts)} holdings={len(holdings)}")
+
+    accounts_by_user = defaultdict(list)
+    for a in accounts:
+        if a.get("user_id"):
+            accounts_by_user[a["user_id"]].append(a)
+
+    holdings_by_user = defaultdict(list)
+    for h in holdings:
+        holdings_by_user[h.get("user_id")].append(h)
+
+    user_ids = sorted(accounts_by_user)
+    if not user_ids:
+        print("No users found (no accounts).")
+        return 0
+
+    instrument_ids = sorted({
+        h["instrument_id"]
+        for uid in user_ids
+        for h in holdings_by_user.get(uid, [])
+        if h.get("instrument_id")
+    })
+    prices_map = fetch_latest_prices_for_day(supabase, instrument_ids, day) if instrument_ids else {}
+    print(f"Prices for day={day}: {len(prices_map)}/{len(instrument_ids)} instruments")
+
+    payloads = []
+    for uid in user_ids:
+        total_value = compute_user_total(accounts_by_user[uid], holdings_by_user.get(uid, []), prices_map)
+        payloads.append(history_payload(uid, day, total_value))
+        print(f"[OK] {uid} day={day} total_value={total_value}")
 
-            
-            if daily_price is None:
-                cv = h.get("current_value")
-                if cv is not None:
-                    total_holdings_value += to_float(cv)
-                else:
-                    total_holdings_value += qty * to_float(h.get("current_price"))
-            else:
-                total_holdings_value += qty * to_float(daily_price)
+    return flush_history(supabase, payloads, batch_size)
 
-        
-        total_standalone = 0.0
-        for a in accounts:
-            aid = a.get("id")
-            if aid and aid not in accounts_with_holdings:
-                total_standalone += to_float(a.get("current_amount"))
 
-        total_value = total_holdings_value + total_standalone
+def quantity_timeline(days, holding_ids, current_qty, movements) -> "np.ndarray":
+    """
+    Quantités détenues en fin de journée, matrice (len(days), len(holding_ids)).
 
-        
-        payload = {
-            "user_id": uid,
-            "day": day,
-            "total_value": total_value,
-            "computed_at": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
-        }
-
-        supabase.table("portfolio_history_daily").upsert(
-            payload,
-            on_conflict="user_id,day"
-        ).execute()
+    On part des quantités actuelles (holdings) et on remonte le temps :
+    qty(d) = qty actuelle - somme des mouvements BUY/SELL datés après d.
+    Les mouvements sans holding connu (holding supprimé) sont ignorés.
+    """
+    n_days, n_hold = len(days), len(holding_ids)
+    col = {hid: j for j, hid in enumerate(holding_ids)}
+    last_day = days[-1]
+
+    delta = np.zeros((n_days, n_hold))
+    after_range = np.zeros(n_hold)
+
+    for m in movements:
+        j = col.get(m.get("holding_id"))
+        sign = MOVEMENT_SIGNS.get(str(m.get("type") or "").upper())
+        ts = m.get("occurred_at") or m.get("created_at")
+        if j is None or sign is None or not ts:
+            continue
 
-        print(f"[OK] {uid} day={day} total_value={total_value}")
+        day = np.datetime64(to_paris_day(ts), "D")
+        qty = sign * to_float(m.get("quantity"))
+        if day > last_day:
+            after_range[j] += qty
+        elif day >= days[0]:
+            delta[np.searchsorted(days, day), j] += qty
+
+    # Mouvements strictement postérieurs à chaque jour de la plage.
+    after_day = np.cumsum(delta[::-1], axis=0)[::-1] - delta
+
+    qty = np.asarray(current_qty, dtype=np.float64)[None, :] - after_range[None, :] - after_day
+    return np.clip(qty, 0.0, None)
+
+
+def existing_snapshots(supabase: Client, start_day: str, end_day: str) -> set:
+    """
+    Couples (user_id, day) déjà présents dans portfolio_history_daily sur la plage.
+    """
+    rows = fetch_rows(
+        supabase,
+        "portfolio_history_daily",
+        "user_id,day",
+        order="day",
+        id_column="user_id",
+        filters=lambda q: q.gte("day", start_day).lte("day", end_day),
+        page_size=PAGE_SIZE,
+    )
+    return {(r["user_id"], r["day"]) for r in rows}
+
+
+def run_range(
+    supabase: Client,
+    start_day: str,
+    end_day: str,
+    batch_size: int = UPSERT_BATCH,
+    overwrite: bool = False,
+) -> int:
+    """
+    Reconstruit portfolio_history_daily sur [start_day, end_day] en une passe :
+    - timeline des quantités par holding (holdings actuels + movements) ;
+    - matrice jour x instrument des prix daily (asset_prices_daily), forward-fill ;
+      à défaut de prix, current_price du holding (comme le mode journalier) ;
+    - valeur = quantités * prix (vectoriel), sommée par user,
+      + comptes sans holding (current_amount) ;
+    - upserts par paquets.
+
+    Approximation : seules les positions encore présentes dans holdings sont
+    reconstituées (les movements d'un holding supprimé après vente totale
+    n'ont pas d'instrument), et comptes sans holding / repli current_price
+    appliquent l'état actuel à tous les jours passés. Sans overwrite, les
+    jours déjà calculés (par le job quotidien, exacts) sont donc conservés
+    et seuls les couples (user, jour) manquants sont écrits.
+    """
+    days = np.arange(
+        np.datetime64(start_day, "D"),
+        np.datetime64(end_day, "D") + np.timedelta64(1, "D"),
+    )
+    if not len(days):
+        print(f"Empty range {start_day} -> {end_day}.")
+        return 0
+
+    accounts = fetch_all(supabase, "accounts", "id,user_id,current_amount")
+    holdings = [
+        h
+        for h in fetch_all(
+            supabase,
+            "holdings",
+            "id,user_id,account_id,instrument_id,quantity,current_price,current_value",
+        )
+        if h.get("user_id") and h.get("instrument_id")
+    ]
+
+    range_start_utc, _ = paris_day_bounds_utc(start_day)
+    movements = fetch_all(
+        supabase,
+        "movements",
+        "id,holding_id,type,quantity,occurred_at,created_at",
+        filters=lambda q: q.or_(f'occurred_at.gte."{range_start_utc}",created_at.gte."{range_start_utc}"'),
+    )
+    print(f"Loaded accounts={len(accounts)} holdings={len(holdings)} movements={len(movements)}")
+
+    user_ids = sorted({a["user_id"] for a in accounts if a.get("user_id")})
+    if not user_ids:
+        print("No users found (no accounts).")
+        return 0
+
+    # Holdings triés par user : la somme par user devient un np.add.reduceat.
+    user_pos = {uid: i for i, uid in enumerate(user_ids)}
+    holdings = sorted((h for h in holdings if h["user_id"] in user_pos), key=lambda h: user_pos[h["user_id"]])
+
+    qty = quantity_timeline(
+        days,
+        [h["id"] for h in holdings],
+        [to_float(h.get("quantity")) for h in holdings],
+        movements,
+    )
+
+    instrument_ids = sorted({h["instrument_id"] for h in holdings})
+    since = (date.fromisoformat(start_day) - timedelta(days=PRICE_SEED_DAYS)).isoformat()
+    with timer("load.asset_prices_daily"):
+        matrix = load_daily_matrix(supabase, since=since, instrument_ids=instrument_ids)
+    print(f"Daily prices since {since}: {matrix.shape[0]} days x {matrix.shape[1]}/{len(instrument_ids)} instruments")
+
+    cols = matrix.columns([h["instrument_id"] for h in holdings])
+    day_prices = matrix.ffill_on(days)
+
+    prices = np.full((len(days), len(holdings)), np.nan)
+    known = cols >= 0
+    prices[:, known] = day_prices[:, cols[known]]
+
+    fallback = np.array([to_float(h.get("current_price")) for h in holdings], dtype=np.float64)
+    prices = np.where(np.isnan(prices), fallback[None, :], prices)
+
+    values = qty * prices
+
+    totals = np.zeros((len(days), len(user_ids)))
+    if holdings:
+        owners = np.array([user_pos[h["user_id"]] for h in holdings])
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        totals[:, owners[starts]] = np.add.reduceat(values, starts, axis=1)
+
+    accounts_with_holdings = {h.get("account_id") for h in holdings}
+    standalone = np.zeros(len(user_ids))
+    for a in accounts:
+        if a.get("user_id") in user_pos and a.get("id") not in accounts_with_holdings:
+            standalone[user_pos[a["user_id"]]] += to_float(a.get("current_amount"))
+    totals += standalone[None, :]
+
+    day_strings = np.datetime_as_string(days, unit="D").tolist()
+    payloads = [
+        history_payload(uid, day, total)
+        for day, row in zip(day_strings, totals.tolist())
+        for uid, total in zip(user_ids, row)
+    ]
+    print(f"Rebuilt {len(day_strings)} day(s) x {len(user_ids)} user(s) = {len(payloads)} snapshots")
+
+    if not overwrite:
+        existing = existing_snapshots(supabase, start_day, end_day)
+        payloads = [p for p in payloads if (p["user_id"], p["day"]) not in existing]
+        print(f"Keeping {len(existing)} existing snapshot(s) (--overwrite to replace), writing {len(payloads)}")
+
+    return flush_history(supabase, payloads, batch_size)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute portfolio_history_daily for today (Paris)")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Load all accounts/holdings/prices at once instead of ~4 queries per user.",
+    )
+    parser.add_argument(
+        "--upsert-batch",
+        type=int,
+        default=UPSERT_BATCH,
+        help="Number of portfolio_history_daily rows per upsert request.",
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_day",
+        help="Rebuild a range of days (YYYY-MM-DD, Paris) from movements + asset_prices_daily.",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_day",
+        help="Last day of the --from range (default: today, Paris).",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="With --from: replace existing snapshots too (the rebuild ignores fully sold positions).",
+    )
+    return parser.parse_args()
+
+
+def run_portfolio(*, bulk: bool = False, batch_size: int = UPSERT_BATCH, day: str = None) -> int:
+    """
+    Snapshots portfolio_history_daily pour `day` (défaut : aujourd'hui, Paris).
+    Renvoie le nombre de lignes en échec.
+    """
+    supabase: Client = get_supabase()
+
+    day = day or paris_day_today()
+
+    if bulk:
+        return run_bulk(supabase, day, batch_size)
+    return run_per_user(supabase, day, batch_size)
+
+
+def main():
+    args = parse_args()
+
+    if args.from_day:
+        failed = run_range(
+            get_supabase(),
+            args.from_day,
+            args.to_day or paris_day_today(),
+            args.upsert_batch,
+            overwrite=args.overwrite,
+        )
+    elif args.to_day or args.overwrite:
+        raise SystemExit("--to / --overwrite require --from.")
+    else:
+        failed = run_portfolio(bulk=args.bulk, batch_size=args.upsert_batch)
+
+    if failed:
+        raise SystemExit(f"{failed} snapshot(s) could not be written.")
 
     print("Done.")
 
 
 if __name__ == "__main__":
-    main()
+    with job("compute_portfolio_history_daily"):
+        main()
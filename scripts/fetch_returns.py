@@ -1,30 +1,46 @@
-import os
-import math
+import argparse
 import datetime as dt
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+from olympe.batch import UpsertResult, upsert_batched
+from olympe.client import supabase
+from olympe.frames import frame_since, pick_price_series, price_payload
+from olympe.lazy import np, pd
+from olympe.metrics import METRICS, job, timer
+from olympe.price_matrix import PriceMatrix, load_daily_matrix, shift_years
+from olympe.reader import DEFAULT_PAGE_SIZE, stream_rows
+from olympe.utils import chunked
+from olympe.workers import (
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_UPSERT_WORKERS,
+    PipelineStats,
+    run_pipeline,
+)
+from olympe.yf_cache import cached_download
+from olympe.yf_scheduler import YF_SCHEDULER, prioritize_held
 
-import yfinance as yf
-from supabase import create_client
 
+YEARS = 1
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise RuntimeError(
-        "SUPABASE_URL ou SUPABASE_SERVICE_ROLE_KEY n'est pas défini dans les variables d'environnement."
-    )
+HISTORY_YEARS = 10  
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+UPSERT_BATCH = 500
 
-YEARS = 1
 
+# Horizons (années) calculés depuis asset_prices_daily (--source daily).
+HORIZONS = (1, 3, 5, 10)
 
-HISTORY_YEARS = 10  
 
+# Écart max entre la date de début visée (fin - N ans) et le dernier prix
+# disponible à cette date (week-ends, jours fériés) ; au-delà, l'historique
+# est jugé trop troué et le rendement n'est pas calculé.
+MAX_START_GAP_DAYS = 7
 
-UPSERT_BATCH = 500
+
+RETURNS_CONFLICT = "instrument_id,period_years"
 
 
 
@@ -35,151 +51,116 @@ def calculate_cagr(price_start: float, price_end: float, years: int) -> Optional
     return (price_end / price_start) ** (1 / years) - 1
 
 
-def chunked(lst: List[Any], n: int) -> List[List[Any]]:
-    return [lst[i:i + n] for i in range(0, len(lst), n)]
-
-
-def get_instruments(page_size: int = 1000) -> List[Dict[str, Any]]:
+def get_instruments(page_size: int = DEFAULT_PAGE_SIZE) -> List[Dict[str, Any]]:
     """
-    Récupère tous les instruments (pagination).
+    Récupère tous les instruments (pagination keyset, cf. olympe.reader).
     """
     instruments: List[Dict[str, Any]] = []
-    start = 0
-
-    while True:
-        end = start + page_size - 1
-        resp = supabase.table("instruments").select("id, symbol").range(start, end).execute()
 
-        rows = resp.data or []
-        if not rows:
-            break
+    for row in stream_rows(supabase, "instruments", "id, symbol", page_size=page_size):
+        symbol = row.get("symbol")
+        iid = row.get("id")
+        if not symbol or not iid:
+            continue
+        instruments.append({"id": iid, "symbol": symbol})
 
-        for row in rows:
-            symbol = row.get("symbol")
-            iid = row.get("id")
-            if not symbol or not iid:
-                continue
-            instruments.append({"id": iid, "symbol": symbol})
+    return instruments
 
-        if len(rows) < page_size:
-            break
-        start += page_size
 
-    return instruments
+def history_start(years: int) -> dt.datetime:
+    """
+    Début de la fenêtre d'historique daily (years années avant maintenant, UTC).
+    """
+    return dt.datetime.utcnow() - dt.timedelta(days=365 * years)
 
 
 def fetch_daily_history(symbol: str, years: int) -> Optional[Any]:
     """
-    Télécharge un historique daily via yfinance et renvoie un DataFrame.
+    Télécharge un historique daily via yfinance (à travers le cache local
+    olympe.yf_cache) et renvoie un DataFrame.
     """
     end = dt.datetime.utcnow()
-    start = end - dt.timedelta(days=365 * years)
+    start = history_start(years)
 
     
-    df = yf.download(
-        symbol,
-        start=start,
-        end=end,
-        interval="1d",
-        auto_adjust=False,
-        progress=False,
-        threads=False,
-    )
-
-    if df is None or df.empty:
-        return None
-    return df
+    return cached_download([symbol], start=start, end=end).get(symbol)
 
 
 def pick_close_series(df) -> Optional[Any]:
     """
     Choisit 'Adj Close' si dispo, sinon 'Close'.
     """
-    cols = list(df.columns)
-    if "Adj Close" in cols:
-        s = df["Adj Close"]
-    elif "Close" in cols:
-        s = df["Close"]
-    else:
-        return None
-
-    if s is None or s.empty:
-        return None
-    return s
+    return pick_price_series(df)
 
 
-def upsert_asset_prices_daily(instrument_id: str, close_series, source: str = "yfinance") -> int:
+def daily_price_rows(instrument_id: str, close_series, source: str = "yfinance") -> List[Dict[str, Any]]:
     """
-    Upsert dans asset_prices_daily : (instrument_id, day, price, source)
+    Lignes asset_prices_daily : (instrument_id, day, price, source)
     day = date (YYYY-MM-DD)
     """
-    rows: List[Dict[str, Any]] = []
-
-    
-    for ts, price in close_series.items():
-        if price is None or (isinstance(price, float) and (math.isnan(price) or math.isinf(price))):
-            continue
-
-        day = ts.date().isoformat()  
-        rows.append({
-            "instrument_id": instrument_id,
-            "day": day,
-            "price": float(price),
-            "source": source,
-            
-        })
-
-    if not rows:
-        return 0
-
-    total_upserted = 0
-    for batch in chunked(rows, UPSERT_BATCH):
-        
-        supabase.table("asset_prices_daily").upsert(batch).execute()
-        total_upserted += len(batch)
-
-    return total_upserted
+    return price_payload(close_series, instrument_id, date_key="day", source=source)
 
 
-def upsert_instrument_return(instrument_id: str, close_series, years: int, source: str = "yfinance") -> Optional[float]:
+def instrument_return_row(instrument_id: str, close_series, years: int, source: str = "yfinance") -> Optional[Dict[str, Any]]:
     """
-    Calcule le CAGR sur YEARS en utilisant les daily close du dernier YEAR.
+    Calcule le CAGR sur `years` années et renvoie la ligne instrument_returns
+    correspondante (None si incalculable). Le prix de départ est le dernier
+    close à la date calendaire (dernier jour - years ans), pas un nombre de lignes.
     """
-    if close_series is None or close_series.empty:
+    if close_series is None:
+        return None
+    close_series = close_series.dropna()
+    if close_series.empty:
         return None
 
     
     end_price = float(close_series.iloc[-1])
 
     
-    
-    start_index = max(0, len(close_series) - (252 * years))  
-    start_price = float(close_series.iloc[start_index])
+    index = pd.DatetimeIndex(close_series.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    target = index[-1] - pd.DateOffset(years=years)
+    head = close_series[index <= target]
+    if head.empty or (target - index[index <= target][-1]).days > MAX_START_GAP_DAYS:
+        return None
+    start_price = float(head.iloc[-1])
 
     cagr = calculate_cagr(start_price, end_price, years)
     if cagr is None:
         return None
 
-    supabase.table("instrument_returns").upsert(
-        {
-            "instrument_id": instrument_id,
-            "cagr": cagr,
-            "period_years": years,
-            "source": source,
-            "last_updated_at": dt.datetime.utcnow().isoformat(),
-        }
-    ).execute()
-
-    return cagr
+    return {
+        "instrument_id": instrument_id,
+        "cagr": cagr,
+        "period_years": years,
+        "source": source,
+        "last_updated_at": dt.datetime.utcnow().isoformat(),
+    }
 
 
-def fetch_and_store(inst: Dict[str, Any]) -> None:
+def prepare_instrument(inst: Dict[str, Any], frames=None) -> Iterator[Tuple[str, Any]]:
+    """
+    Partie "téléchargement" : télécharge l'historique daily d'un instrument et
+    produit les unités d'upsert (table, payload) : chunks asset_prices_daily
+    puis la ligne instrument_returns.
+
+    frames : DataFrames déjà téléchargés par une étape précédente
+    (olympe.dag.FrameStore, cf. nightly_pipeline.py), ramenés à HISTORY_YEARS
+    et retirés du store une fois lus ; téléchargement (cache olympe.yf_cache)
+    pour les symboles absents.
+    """
     symbol = inst["symbol"]
     iid = inst["id"]
 
-    print(f"\n📥 {symbol} -> download daily history ({HISTORY_YEARS}y)")
+    df = frames.pop(symbol) if frames is not None else None
+    if df is not None:
+        df = frame_since(df, history_start(HISTORY_YEARS))
+        print(f"\n♻ {symbol} -> daily history déjà téléchargé ({HISTORY_YEARS}y)")
 
-    df = fetch_daily_history(symbol, HISTORY_YEARS)
+    if df is None:
+        print(f"\n📥 {symbol} -> download daily history ({HISTORY_YEARS}y)")
+        df = fetch_daily_history(symbol, HISTORY_YEARS)
     if df is None:
         print(f"⚠ Aucun historique daily pour {symbol}")
         return
@@ -190,34 +171,207 @@ def fetch_and_store(inst: Dict[str, Any]) -> None:
         return
 
     
-    upserted = upsert_asset_prices_daily(iid, closes, source="yfinance")
-    print(f"✅ asset_prices_daily upserted rows: {upserted}")
+    rows = daily_price_rows(iid, closes, source="yfinance")
+    print(f"✅ {symbol} asset_prices_daily rows à upsert: {len(rows)}")
+    for batch in chunked(rows, UPSERT_BATCH):
+        yield "asset_prices_daily", batch
 
     
-    cagr = upsert_instrument_return(iid, closes, YEARS, source="yfinance")
-    if cagr is None:
+    row = instrument_return_row(iid, closes, YEARS, source="yfinance")
+    if row is None:
         print(f"⚠ Impossible de calculer le rendement 1 an pour {symbol}")
     else:
-        print(f"✔ {symbol} return ({YEARS} an) = {cagr * 100:.2f} %")
+        print(f"✔ {symbol} return ({YEARS} an) = {row['cagr'] * 100:.2f} %")
+        yield "instrument_returns", row
 
 
-def main():
-    instruments = get_instruments()
+def store_unit(unit: Tuple[str, Any]) -> None:
+    """
+    Partie "upsert" : écrit une unité (table, payload) produite par prepare_instrument.
+    """
+    table, payload = unit
+    if table == "instrument_returns":
+        supabase.table(table).upsert(payload, on_conflict=RETURNS_CONFLICT).execute()
+    else:
+        supabase.table(table).upsert(payload).execute()
+    METRICS.incr("rows_written", len(payload) if isinstance(payload, list) else 1)
+
+
+def compute_returns(
+    matrix: PriceMatrix,
+    horizons: Tuple[int, ...] = HORIZONS,
+    source: str = "asset_prices_daily",
+) -> List[Dict[str, Any]]:
+    """
+    CAGR de tous les instruments de la matrice pour chaque horizon, en une
+    passe vectorisée par horizon : prix de fin = dernier prix de l'instrument,
+    prix de départ = dernier prix connu à (jour de fin - N ans calendaires).
+    """
+    last = matrix.last_valid_index()
+    cols = np.flatnonzero(last >= 0)
+    if not len(cols):
+        return []
+
+    end_rows = last[cols]
+    end_days = matrix.days[end_rows]
+    end_prices = matrix.values[end_rows, cols]
+
+    now = dt.datetime.utcnow().isoformat()
+    out: List[Dict[str, Any]] = []
+
+    for years in horizons:
+        targets = shift_years(end_days, -years)
+        start_prices, start_days = matrix.asof(targets, cols)
+
+        ok = np.isfinite(start_prices)
+        ok[ok] &= (targets[ok] - start_days[ok]) <= np.timedelta64(MAX_START_GAP_DAYS, "D")
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cagr = (end_prices / start_prices) ** (1.0 / years) - 1.0
+        ok &= np.isfinite(cagr)
+
+        for j, value in zip(cols[ok].tolist(), cagr[ok].tolist()):
+            out.append(
+                {
+                    "instrument_id": matrix.instrument_ids[j],
+                    "cagr": value,
+                    "period_years": years,
+                    "source": source,
+                    "last_updated_at": now,
+                }
+            )
+
+    return out
+
+
+def run_returns_from_daily(
+    horizons: Tuple[int, ...] = HORIZONS,
+    batch_size: int = UPSERT_BATCH,
+) -> UpsertResult:
+    """
+    Rendements calculés depuis asset_prices_daily (aucune requête Yahoo) :
+    une lecture keyset de la table, une matrice date x instrument,
+    puis upserts instrument_returns par paquets.
+
+    Prérequis : asset_prices_daily doit couvrir max(horizons) ans par
+    instrument. sync_asset_prices_daily la construit depuis asset_prices
+    (historique complet écrit par le backfill) sur RETENTION_YEARS ans :
+    amorçage une fois avec `sync_asset_prices_daily.py --full`, puis
+    incrémental (nightly_pipeline reconstruit les instruments dont le
+    backfill a réécrit l'historique). Un instrument sans cet historique n'a
+    pas de rendement pour l'horizon (et sa ligne existante n'est pas mise à jour).
+    """
+    since = (dt.date.today() - dt.timedelta(days=366 * max(horizons) + MAX_START_GAP_DAYS + 7)).isoformat()
+
+    with timer("load_matrix"):
+        matrix = load_daily_matrix(supabase, since=since)
+    print(f"🧮 asset_prices_daily depuis {since} : {matrix.shape[0]} jours x {matrix.shape[1]} instruments")
+
+    with timer("compute"):
+        rows = compute_returns(matrix, horizons)
+    for years in horizons:
+        n = sum(1 for r in rows if r["period_years"] == years)
+        print(f"✔ CAGR {years} an(s) : {n}/{matrix.shape[1]} instruments")
+
+    with timer("upsert"):
+        res = upsert_batched(
+            supabase,
+            "instrument_returns",
+            rows,
+            on_conflict=RETURNS_CONFLICT,
+            batch_size=batch_size,
+        )
+    print(f"\n🎉 instrument_returns : {res.written}/{len(rows)} lignes en {res.batches} paquet(s)")
+    return res
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rendements des instruments (asset_prices_daily ou yfinance)")
+    parser.add_argument(
+        "--source",
+        choices=("daily", "yfinance"),
+        default="daily",
+        help="daily (défaut) : tout depuis asset_prices_daily, aucune requête Yahoo (table "
+        "amorcée par sync_asset_prices_daily.py --full) ; yfinance : téléchargement de "
+        "l'historique par instrument, qui alimente aussi asset_prices_daily sur 10 ans.",
+    )
+    parser.add_argument("--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS)
+    parser.add_argument("--upsert-workers", type=int, default=DEFAULT_UPSERT_WORKERS)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Nombre max d'unités en attente d'upsert (plafond mémoire).",
+    )
+    return parser.parse_args()
+
+
+def run_returns(
+    *,
+    frames=None,
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    upsert_workers: int = DEFAULT_UPSERT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> Optional[PipelineStats]:
+    """
+    Prix daily + rendements de tous les instruments. frames : cf. prepare_instrument.
+
+    Le téléchargement alimente asset_prices_daily sur HISTORY_YEARS ans : les
+    horizons pluriannuels (HORIZONS) sont ensuite calculés depuis cette table
+    (run_returns_from_daily), qui contient alors l'historique nécessaire.
+    """
+    with timer("instruments"):
+        instruments = get_instruments()
 
     if not instruments:
         print("Aucun instrument trouvé dans la table 'instruments'.")
-        return
+        return None
 
     print(f"🔎 Instruments trouvés: {len(instruments)}")
 
-    for inst in instruments:
-        try:
-            fetch_and_store(inst)
-        except Exception as e:
-            print(f"❌ Erreur sur {inst.get('symbol')} : {e}")
+    # Instruments détenus d'abord : servis en priorité si Yahoo throttle.
+    held = prioritize_held(supabase)
+    instruments.sort(key=lambda inst: YF_SCHEDULER.priority_of([inst["symbol"]]))
+    print(f"⭐ Instruments détenus traités en premier : {len(held)}")
+
+    with timer("pipeline"):
+        stats = run_pipeline(
+            instruments,
+            lambda inst: prepare_instrument(inst, frames),
+            store_unit,
+            download_workers=download_workers,
+            upsert_workers=upsert_workers,
+            queue_size=queue_size,
+            label=lambda x: x.get("symbol") if isinstance(x, dict) else x[0],
+        )
+
+    res = run_returns_from_daily(horizons=tuple(h for h in HORIZONS if h != YEARS))
+    if res.failed:
+        stats.errors.append(f"{len(res.failed)} ligne(s) instrument_returns pluriannuelles non écrite(s)")
+
+    if stats.errors:
+        print(f"\n⚠ {len(stats.errors)} erreur(s) pendant la mise à jour.")
 
     print("\n🎉 Mise à jour des prix daily + rendements terminée !")
+    return stats
+
+
+def main():
+    args = parse_args()
+
+    if args.source == "daily":
+        res = run_returns_from_daily()
+        if res.failed:
+            raise SystemExit(f"{len(res.failed)} ligne(s) instrument_returns non écrite(s).")
+        return
+
+    run_returns(
+        download_workers=args.download_workers,
+        upsert_workers=args.upsert_workers,
+        queue_size=args.queue_size,
+    )
 
 
 if __name__ == "__main__":
-    main()
+    with job("fetch_returns"):
+        main()
@@ -1,65 +1,67 @@
-import os
+import argparse
 import sys
-import math
 import datetime as dt
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
 
-import yfinance as yf
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from olympe.batch import upsert_batched
+from olympe.client import supabase as sb
+from olympe.lazy import yf
+from olympe.reader import fetch_rows
+from olympe.utils import chunked, paris_day_today, positive_float
+from olympe.yf_cache import cached_download, cached_quotes, store_quotes
+from olympe.yf_scheduler import YF_SCHEDULER
 
-load_dotenv()
+HISTORY_CACHE_TTL_SECONDS = 15 * 60
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+# Un prix résolu il y a moins de 5 min est réutilisé tel quel (scripts appelés en boucle).
+QUOTE_CACHE_TTL_SECONDS = 5 * 60
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    raise SystemExit("❌ Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY in .env")
+DEFAULT_WORKERS = 8
 
-sb: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+IN_CHUNK = 200
+
+UPSERT_BATCH = 500
 
 
 def now_iso() -> str:
     return dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc).isoformat()
 
 
-def today_key_utc() -> str:
-    return dt.datetime.utcnow().date().isoformat()
-
-
-def to_float(v) -> Optional[float]:
-    try:
-        if v is None:
-            return None
-        n = float(v)
-        if not math.isfinite(n) or n <= 0:
-            return None
-        return n
-    except Exception:
-        return None
-
-
 def yfinance_last_price(symbol: str) -> Optional[float]:
     """
-    Récupère un prix 'dernier' via yfinance (plusieurs méthodes fallback)
+    Récupère un prix 'dernier' via yfinance (plusieurs méthodes fallback) :
+    fast_info, puis historique 5j (cache), puis info (requête la plus lourde).
     """
     t = yf.Ticker(symbol)
 
-    
-    try:
-        fi = getattr(t, "fast_info", None) or {}
-        for key in ["last_price", "regular_market_price", "previous_close"]:
-            p = to_float(fi.get(key))
+    # fast_info / info font leurs requêtes à l'accès : lecture complète
+    # dans YF_SCHEDULER (cadence + retries sur throttling).
+    def first_price(source: str, keys):
+        data = getattr(t, source, None) or {}
+        for key in keys:
+            p = positive_float(data.get(key))
             if p:
                 return p
+        return None
+
+    
+    try:
+        p = YF_SCHEDULER.call(
+            lambda: first_price("fast_info", ["last_price", "regular_market_price", "previous_close"]),
+            [symbol],
+            empty=lambda r: False,
+        )
+        if p:
+            return p
     except Exception:
         pass
 
     
     try:
-        info = t.info or {}
-        for key in ["regularMarketPrice", "currentPrice", "previousClose"]:
-            p = to_float(info.get(key))
+        hist = cached_download([symbol], period="5d", ttl=HISTORY_CACHE_TTL_SECONDS).get(symbol)
+        if hist is not None and not hist.empty:
+            p = positive_float(hist["Close"].iloc[-1])
             if p:
                 return p
     except Exception:
@@ -67,76 +69,187 @@ def yfinance_last_price(symbol: str) -> Optional[float]:
 
     
     try:
-        hist = t.history(period="5d", interval="1d")
-        if hist is not None and not hist.empty:
-            p = to_float(hist["Close"].iloc[-1])
-            if p:
-                return p
+        p = YF_SCHEDULER.call(
+            lambda: first_price("info", ["regularMarketPrice", "currentPrice", "previousClose"]),
+            [symbol],
+            empty=lambda r: False,
+        )
+        if p:
+            return p
     except Exception:
         pass
 
     return None
 
 
-def get_instrument_by_symbol(symbol: str) -> Optional[Dict[str, Any]]:
-    res = sb.table("instruments").select("id,symbol,name").eq("symbol", symbol).limit(1).execute()
-    rows = res.data or []
-    return rows[0] if rows else None
-
-
-def insert_asset_price(instrument_id: str, price: float, currency: str = "EUR", source: str = "yfinance"):
-    sb.table("asset_prices").insert({
-        "instrument_id": instrument_id,
-        "price": price,
-        "currency": currency,
-        "source": source,
-        "fetched_at": now_iso(),
-    }).execute()
+def get_instruments_by_symbol(symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Instruments des symboles demandés, en une requête par paquet de IN_CHUNK.
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    for chunk in chunked(symbols, IN_CHUNK):
+        for row in fetch_rows(sb, "instruments", "id,symbol,name", filters=lambda q, c=chunk: q.in_("symbol", c)):
+            found.setdefault(row["symbol"], row)
+    return found
 
 
-def upsert_asset_price_daily(instrument_id: str, price: float, currency: str = "EUR", source: str = "yfinance"):
-    
-    sb.table("asset_prices_daily").upsert({
-        "instrument_id": instrument_id,
-        "day": today_key_utc(),
-        "price": price,
-        "currency": currency,
-        "source": source,
-        "fetched_at": now_iso(),
-    }, on_conflict="instrument_id,day").execute()
+def resolve_prices(symbols: List[str], workers: int = DEFAULT_WORKERS, ttl: float = QUOTE_CACHE_TTL_SECONDS) -> Dict[str, Tuple[Optional[float], str]]:
+    """
+    {symbol: (prix, "cached" | "fetched" | "no_price")}. Les prix résolus il y a
+    moins de ttl secondes sont repris du cache local (aucun appel Yahoo) ;
+    les autres sont résolus en parallèle (cadence : YF_SCHEDULER).
+    """
+    cached = cached_quotes(symbols, ttl)
+    out: Dict[str, Tuple[Optional[float], str]] = {s: (p, "cached") for s, p in cached.items()}
 
+    todo = [s for s in symbols if s not in cached]
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as pool:
+            for symbol, price in zip(todo, pool.map(safe_last_price, todo)):
+                out[symbol] = (price, "fetched") if price else (None, "no_price")
 
-def main():
-    if len(sys.argv) < 2:
-        raise SystemExit("Usage: python yf_get_price_and_store.py <TICKER>  (ex: ESE.PA)")
+    store_quotes({s: p for s, (p, status) in out.items() if status == "fetched"})
+    return out
 
-    symbol = sys.argv[1].strip()
-    if not symbol:
-        raise SystemExit("❌ Empty symbol")
 
-    price = yfinance_last_price(symbol)
-    if not price:
-        print("❌ No price found")
-        sys.exit(2)
+def safe_last_price(symbol: str) -> Optional[float]:
+    try:
+        return yfinance_last_price(symbol)
+    except Exception as e:
+        print(f"⚠️ {symbol}: {e}", file=sys.stderr)
+        return None
 
-    inst = get_instrument_by_symbol(symbol)
-    if not inst:
-        print(f"⚠️ Instrument not found in DB for symbol={symbol}. Price={price}")
-        
-        print(price)
-        return
 
-    instrument_id = inst["id"]
+def store_prices(prices: Dict[str, float], instruments: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Écrit les prix fraîchement résolus : un upsert groupé asset_prices et un
+    upsert groupé asset_prices_daily (jour Paris). Renvoie {symbol: statut}.
+    """
+    fetched_at, day = now_iso(), paris_day_today()
+    status: Dict[str, str] = {}
+    quotes, daily = [], []
+
+    for symbol, price in prices.items():
+        inst = instruments.get(symbol)
+        if not inst:
+            status[symbol] = "not_in_db"
+            continue
+        status[symbol] = "stored"
+        quotes.append(
+            {
+                "instrument_id": inst["id"],
+                "price": price,
+                "currency": "EUR",
+                "source": "yfinance",
+                "fetched_at": fetched_at,
+            }
+        )
+        daily.append(
+            {
+                "instrument_id": inst["id"],
+                "day": day,
+                "price": price,
+                "currency": "EUR",
+                "source": "yfinance",
+                "fetched_at": fetched_at,
+            }
+        )
+
+    def log(*args):
+        print(*args, file=sys.stderr)
+
+    res = upsert_batched(sb, "asset_prices", quotes, on_conflict="instrument_id,fetched_at", batch_size=UPSERT_BATCH, log=log)
+    failed = {r["instrument_id"] for r in res.failed}
 
-    
-    insert_asset_price(instrument_id, price, currency="EUR", source="yfinance")
     try:
-        upsert_asset_price_daily(instrument_id, price, currency="EUR", source="yfinance")
+        upsert_batched(sb, "asset_prices_daily", daily, on_conflict="instrument_id,day", batch_size=UPSERT_BATCH, log=log)
     except Exception as e:
-        
-        print(f"⚠️ daily upsert failed (ok if no unique index): {e}")
+        print(f"⚠️ daily upsert failed: {e}", file=sys.stderr)
 
-    print(price)
+    for symbol, inst in instruments.items():
+        if inst["id"] in failed and symbol in status:
+            status[symbol] = "write_failed"
+    return status
+
+
+def read_tickers(args) -> List[str]:
+    """
+    Tickers des arguments, de --file et de stdin ("-" ou --stdin) ;
+    lignes vides et commentaires (#) ignorés, doublons retirés.
+    """
+    raw = [t for t in args.tickers if t != "-"]
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            raw.extend(f.read().split("\n"))
+
+    if args.stdin or "-" in args.tickers:
+        raw.extend(sys.stdin.read().split("\n"))
+
+    tickers = []
+    for line in raw:
+        for token in line.split("#", 1)[0].replace(",", " ").split():
+            tickers.append(token.strip())
+    return list(dict.fromkeys(t for t in tickers if t))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Dernier prix yfinance d'un ou plusieurs tickers, écrit dans asset_prices / asset_prices_daily"
+    )
+    parser.add_argument("tickers", nargs="*", help="Tickers (ex. ESE.PA) ; '-' pour lire stdin.")
+    parser.add_argument("--file", help="Fichier de tickers (un par ligne, ou séparés par espaces / virgules).")
+    parser.add_argument("--stdin", action="store_true", help="Lit les tickers sur l'entrée standard.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Résolutions yfinance en parallèle.")
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=QUOTE_CACHE_TTL_SECONDS,
+        help="Durée (s) de réutilisation d'un prix déjà résolu (0 : toujours interroger Yahoo).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    tickers = read_tickers(args)
+    if not tickers:
+        raise SystemExit("Usage: python get_price_yfinance.py <TICKER> [TICKER...] | --file tickers.txt | -  (ex: ESE.PA)")
+
+    # Un ticker en argument : sortie historique (le prix seul sur la dernière ligne).
+    single = len(args.tickers) == 1 and args.tickers != ["-"] and not args.file and not args.stdin
+
+    resolved = resolve_prices(tickers, workers=args.workers, ttl=args.ttl)
+    fresh = {s: p for s, (p, status) in resolved.items() if status == "fetched"}
+    priced = [s for s, (p, _) in resolved.items() if p]
+
+    instruments = get_instruments_by_symbol(priced) if priced else {}
+    written = store_prices(fresh, instruments) if fresh else {}
+
+    if single:
+        symbol = tickers[0]
+        price, status = resolved[symbol]
+        if not price:
+            print("❌ No price found")
+            sys.exit(2)
+        if symbol not in instruments:
+            print(f"⚠️ Instrument not found in DB for symbol={symbol}. Price={price}")
+        print(price)
+        return
+
+    missing = 0
+    for symbol in tickers:
+        price, status = resolved[symbol]
+        if not price:
+            missing += 1
+        elif symbol not in instruments:
+            status = "not_in_db"
+        else:
+            status = written.get(symbol, status)
+        print(f"{symbol}\t{price if price else '-'}\t{status}")
+
+    if missing:
+        sys.exit(2)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+import argparse
+from typing import Any, Dict, List
+
+from olympe.dag import FAILED, OK, FrameStore, Stage, run_stages, select_stages
+from olympe.metrics import job
+from olympe.workers import DEFAULT_DOWNLOAD_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_UPSERT_WORKERS
+
+import backfill_yfinance
+import compute_portfolio_history_daily
+import fetch_returns
+import sync_asset_prices_daily
+
+
+# Graphe des étapes :
+#   backfill -> sync_daily -> returns   (--returns-source daily, défaut : depuis asset_prices_daily,
+#                                        que sync_daily construit depuis asset_prices ; aucune
+#                                        requête Yahoo hors backfill)
+#   backfill -> returns                 (--returns-source yfinance : DataFrames du backfill,
+#                                        qui alimentent aussi asset_prices_daily sur 10 ans)
+#            -> portfolio
+STAGE_NAMES = ("backfill", "returns", "sync_daily", "portfolio")
+
+
+def stage_list(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def build_stages(args) -> List[Stage]:
+
+    def backfill(ctx: Dict[str, Any]) -> None:
+        share = ctx.get("share_frames", False)
+        backfill_yfinance.run_backfill(
+            full=args.full,
+            batch_size=args.batch_size,
+            download_workers=args.download_workers,
+            upsert_workers=args.upsert_workers,
+            queue_size=args.queue_size,
+            history_start=fetch_returns.history_start(fetch_returns.HISTORY_YEARS).date().isoformat() if share else None,
+            on_frame=ctx["frames"].put if share else None,
+            on_history=ctx["rewritten"].add,
+        )
+        print(f"[pipeline] backfill : {len(ctx['frames'])} DataFrame(s) partagé(s)")
+
+    def returns(ctx: Dict[str, Any]) -> None:
+        if args.returns_source == "daily":
+            res = fetch_returns.run_returns_from_daily()
+            if res.failed:
+                raise RuntimeError(f"{len(res.failed)} ligne(s) instrument_returns non écrite(s)")
+            return
+
+        stats = fetch_returns.run_returns(
+            frames=ctx["frames"],
+            download_workers=args.download_workers,
+            upsert_workers=args.upsert_workers,
+            queue_size=args.queue_size,
+        )
+        if stats is not None and stats.errors:
+            raise RuntimeError(f"{len(stats.errors)} instrument(s) en erreur")
+
+    def sync_daily(ctx: Dict[str, Any]) -> None:
+        # Historique complet réécrit par le backfill (nouveaux instruments,
+        # réajustements) : antérieur au watermark, reconstruit à part.
+        sync_asset_prices_daily.run_sync(full=args.full_sync, instrument_ids=sorted(ctx["rewritten"]))
+
+    def portfolio(ctx: Dict[str, Any]) -> None:
+        failed = compute_portfolio_history_daily.run_portfolio(bulk=True)
+        if failed:
+            raise RuntimeError(f"{failed} snapshot(s) could not be written.")
+
+    return [
+        Stage("backfill", backfill),
+        Stage("returns", returns, after=("sync_daily",) if args.returns_source == "daily" else ("backfill",)),
+        Stage("sync_daily", sync_daily, after=("backfill",)),
+        Stage("portfolio", portfolio, after=("backfill",)),
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pipeline nocturne : backfill, returns, sync_daily, portfolio dans un seul process"
+    )
+    parser.add_argument(
+        "--stages",
+        type=stage_list,
+        default=None,
+        help=f"Étapes à exécuter, séparées par des virgules (défaut : toutes) parmi {','.join(STAGE_NAMES)}.",
+    )
+    parser.add_argument(
+        "--skip",
+        type=stage_list,
+        default=[],
+        help="Étapes à ne pas exécuter, séparées par des virgules.",
+    )
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=2,
+        help="Nombre max d'étapes indépendantes exécutées en même temps.",
+    )
+    parser.add_argument(
+        "--returns-source",
+        choices=("daily", "yfinance"),
+        default="daily",
+        help="returns : calcul depuis asset_prices_daily (défaut, table amorcée par "
+        "sync_asset_prices_daily.py --full) ou téléchargement yfinance.",
+    )
+    parser.add_argument("--full", action="store_true", help="Backfill complet (cf. backfill_yfinance.py --full).")
+    parser.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="sync_daily : reconstruit toute la fenêtre (10 ans) au lieu de repartir du watermark.",
+    )
+    parser.add_argument("--batch-size", type=int, default=backfill_yfinance.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS)
+    parser.add_argument("--upsert-workers", type=int, default=DEFAULT_UPSERT_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    try:
+        stages = select_stages(build_stages(args), args.stages, args.skip)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    if not stages:
+        print("Aucune étape sélectionnée, fin.")
+        return
+
+    names = [s.name for s in stages]
+    print(f"=== Pipeline nocturne : {', '.join(names)} ===")
+
+    context = {
+        "frames": FrameStore(),
+        # instrument_ids dont le backfill a écrit tout l'historique (set.add atomique).
+        "rewritten": set(),
+        # Les DataFrames du backfill ne servent qu'à returns en mode yfinance
+        # (inutile de télécharger 10 ans d'historique sinon) ; seuls les
+        # symboles réellement téléchargés sont partagés, et returns les retire
+        # du store à l'usage.
+        "share_frames": "backfill" in names and "returns" in names and args.returns_source == "yfinance",
+    }
+    status = run_stages(stages, context=context, max_parallel=args.max_parallel)
+
+    print("\n=== Résumé ===")
+    for name in names:
+        print(f"  {name:<12} {status.get(name)}")
+
+    if any(v != OK for v in status.values()):
+        failed = [n for n, v in status.items() if v == FAILED]
+        raise SystemExit(f"Pipeline incomplet (échecs : {', '.join(failed) or 'aucun'}).")
+
+
+if __name__ == "__main__":
+    with job("nightly_pipeline"):
+        main()
@@ -0,0 +1,39 @@
+"""
+Runtime partagé des scripts Olympe (jobs GitHub Actions).
+
+Les sous-modules lourds (frames, yf_cache : pandas) ne sont pas importés ici ;
+seuls les helpers légers sont ré-exportés.
+"""
+from olympe.client import get_supabase, set_supabase, supabase, supabase_credentials
+from olympe.lazy import lazy_import
+from olympe.reader import fetch_rows, stream_rows
+from olympe.utils import (
+    PARIS,
+    chunked,
+    chunks,
+    paris_day_bounds_utc,
+    paris_day_today,
+    parse_ts,
+    positive_float,
+    to_float,
+    to_paris_day,
+)
+
+__all__ = [
+    "PARIS",
+    "chunked",
+    "chunks",
+    "fetch_rows",
+    "get_supabase",
+    "lazy_import",
+    "paris_day_bounds_utc",
+    "paris_day_today",
+    "parse_ts",
+    "positive_float",
+    "set_supabase",
+    "stream_rows",
+    "supabase",
+    "supabase_credentials",
+    "to_float",
+    "to_paris_day",
+]
@@ -0,0 +1,67 @@
+"""
+Upserts Supabase par paquets, avec repli ligne par ligne.
+
+Un paquet en erreur (ex. une ligne qui viole une contrainte) est rejoué
+ligne par ligne : une mauvaise ligne ne fait pas perdre tout le paquet.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from olympe.metrics import METRICS
+
+
+@dataclass
+class UpsertResult:
+    written: int = 0
+    batches: int = 0
+    fallbacks: int = 0
+    failed: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def upsert_batched(
+    client,
+    table: str,
+    rows: List[Dict[str, Any]],
+    *,
+    on_conflict: Optional[str] = None,
+    batch_size: int = 500,
+    log: Callable[..., None] = print,
+    row_fallback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> UpsertResult:
+    """
+    Upsert de `rows` dans `table` par paquets de batch_size.
+    Si un paquet échoue, chacune de ses lignes est réécrite séparément
+    (upsert, ou row_fallback(row) si fourni, ex. un UPDATE par id) ;
+    les lignes toujours en échec sont renvoyées dans result.failed.
+    """
+    result = UpsertResult()
+    kwargs = {"on_conflict": on_conflict} if on_conflict else {}
+
+    for i in range(0, len(rows), max(1, batch_size)):
+        batch = rows[i: i + max(1, batch_size)]
+        result.batches += 1
+
+        try:
+            client.table(table).upsert(batch, **kwargs).execute()
+            result.written += len(batch)
+            continue
+        except Exception as e:
+            log(f"[WARN] upsert {table} batch {i}-{i + len(batch)} failed ({e}), retrying row by row")
+            result.fallbacks += 1
+
+        for row in batch:
+            try:
+                if row_fallback is not None:
+                    row_fallback(row)
+                else:
+                    client.table(table).upsert(row, **kwargs).execute()
+                result.written += 1
+            except Exception as e:
+                log(f"[ERROR] upsert {table} row failed: {row} ({e})")
+                result.failed.append(row)
+
+    METRICS.incr("rows_written", result.written)
+    METRICS.incr("upsert_batches", result.batches)
+    METRICS.incr("upsert_fallbacks", result.fallbacks)
+    METRICS.incr("upsert_failed", len(result.failed))
+    return result
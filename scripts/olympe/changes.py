@@ -0,0 +1,66 @@
+"""
+Détection des changements avant écriture : une valeur n'est réécrite que si
+elle s'écarte de la dernière valeur écrite de plus que la tolérance de
+l'instrument (bruit de flottants Yahoo, prix inchangé marché calme).
+
+Tolérance d'un prix : relative au prix de référence, selon la classe d'actif
+(OLYMPE_PRICE_TOLERANCE pour les autres) ; les valorisations de holdings
+tolèrent en plus un écart d'un demi-centime.
+"""
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from olympe.utils import to_float
+
+
+DEFAULT_REL_TOLERANCE = float(os.getenv("OLYMPE_PRICE_TOLERANCE", "1e-6"))
+
+# Cryptos cotées avec 8+ décimales et bruitées d'un appel à l'autre.
+ASSET_CLASS_REL_TOLERANCE = {
+    "crypto": 1e-5,
+}
+
+ABS_TOLERANCE = 1e-9
+
+MONEY_TOLERANCE = 0.005
+
+
+def price_tolerance(reference: Optional[float], asset_class: Optional[str] = None) -> float:
+    """
+    Écart de prix absolu en deçà duquel un instrument est considéré inchangé.
+    """
+    rel = ASSET_CLASS_REL_TOLERANCE.get((asset_class or "").lower(), DEFAULT_REL_TOLERANCE)
+    return max(ABS_TOLERANCE, abs(reference or 0.0) * rel)
+
+
+def changed(old: Any, new: float, tolerance: float) -> bool:
+    """
+    True si `new` s'écarte de `old` (valeur stockée, None = jamais écrite) de plus que tolerance.
+    """
+    if old is None or old == "":
+        return True
+    return abs(to_float(old) - new) > tolerance
+
+
+def holding_updates(
+    holdings: Iterable[Dict[str, Any]],
+    price: float,
+    tolerance: float,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Holdings dont current_price / current_value stockés diffèrent de la
+    valorisation à `price` : (holdings à réécrire, avec les nouvelles valeurs ;
+    nombre de holdings inchangés).
+    """
+    updates: List[Dict[str, Any]] = []
+    unchanged = 0
+    for h in holdings:
+        qty = to_float(h.get("quantity"))
+        value = qty * price
+        if changed(h.get("current_price"), price, tolerance) or changed(
+            h.get("current_value"), value, max(MONEY_TOLERANCE, abs(qty) * tolerance)
+        ):
+            updates.append({**h, "current_price": price, "current_value": value})
+        else:
+            unchanged += 1
+    return updates, unchanged
@@ -0,0 +1,144 @@
+"""
+Client Supabase unique par process.
+
+get_supabase() crée le client au premier appel puis le réutilise : tous les
+modules (et tous les threads) partagent le même pool de connexions HTTP
+keep-alive, au lieu d'un create_client par script à l'import.
+"""
+import os
+import threading
+from typing import Optional, Tuple
+
+from olympe.metrics import METRICS
+
+
+HTTP_POOL_SIZE = int(os.getenv("OLYMPE_HTTP_POOL_SIZE", "20"))
+
+HTTP_KEEPALIVE_SECONDS = 60
+
+HTTP_TIMEOUT_SECONDS = 120
+
+# Fonction RPC absente du schéma (migration pas encore déployée) : PostgREST
+# répond 404 avec le code PGRST202.
+MISSING_FUNCTION_CODES = ("PGRST202", "404")
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def _load_dotenv() -> None:
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+def supabase_credentials() -> Tuple[str, str]:
+    """
+    (SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY) depuis l'environnement (ou un .env).
+    """
+    _load_dotenv()
+
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+    if not url or not key:
+        raise RuntimeError(
+            "SUPABASE_URL ou SUPABASE_SERVICE_ROLE_KEY manquants dans les variables d'environnement."
+        )
+    return url, key
+
+
+def _on_request(request) -> None:
+    METRICS.incr("http_requests")
+    try:
+        METRICS.incr("http_bytes_sent", len(request.content))
+    except Exception:
+        pass  # corps en streaming : taille inconnue
+
+
+def _on_response(response) -> None:
+    if response.status_code >= 400:
+        METRICS.incr("http_errors")
+
+
+def _client_options():
+    """
+    Options du client : httpx.Client partagé (pool + keep-alive, hooks de
+    métriques olympe.metrics) quand la
+    version de supabase-py le permet (ClientOptions.httpx_client).
+    """
+    try:
+        import httpx
+        from supabase import ClientOptions
+    except ImportError:
+        return None
+
+    http = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+        timeout=HTTP_TIMEOUT_SECONDS,
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+
+    try:
+        return ClientOptions(httpx_client=http, postgrest_client_timeout=HTTP_TIMEOUT_SECONDS)
+    except TypeError:
+        http.close()
+        return ClientOptions(postgrest_client_timeout=HTTP_TIMEOUT_SECONDS)
+
+
+def get_supabase():
+    """
+    Client Supabase (service role) partagé par tout le process.
+    """
+    global _client
+
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from supabase import create_client
+
+                url, key = supabase_credentials()
+                options = _client_options()
+                if options is None:
+                    _client = create_client(url, key)
+                else:
+                    _client = create_client(url, key, options=options)
+
+    return _client
+
+
+def is_missing_function(exc: Exception) -> bool:
+    """
+    True si exc signale une fonction RPC inexistante (et non une erreur
+    réseau ou SQL passagère).
+    """
+    return str(getattr(exc, "code", "")) in MISSING_FUNCTION_CODES
+
+
+class SupabaseProxy:
+    """
+    Se comporte comme le client partagé, mais ne le crée qu'au premier usage
+    (aucune connexion ni lecture d'env à l'import des scripts).
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(get_supabase(), name)
+
+
+supabase = SupabaseProxy()
+
+
+def set_supabase(client: Optional[object]) -> None:
+    """
+    Remplace le client partagé (ex. client de test / bench) ; None = réinitialise.
+    """
+    global _client
+    with _lock:
+        _client = client
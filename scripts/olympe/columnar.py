@@ -0,0 +1,94 @@
+"""
+Décodage colonnaire des pages PostgREST de quotes (asset_prices).
+
+Au lieu de parser chaque fetched_at avec datetime.fromisoformat puis
+.astimezone(PARIS) ligne par ligne, une page entière devient trois colonnes
+NumPy (ids, prix float64, timestamps datetime64 UTC) ; la conversion en jour
+calendaire Paris (heure d'été comprise) et la réduction "dernière quote par
+(instrument, jour)" se font en bloc (tri + groupes), sans dict de dicts.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Tuple
+
+from olympe.lazy import np, pd
+from olympe.utils import PARIS
+
+
+@dataclass
+class PriceColumns:
+    instrument_ids: np.ndarray  # str (object)
+    prices: np.ndarray  # float64
+    ts: np.ndarray  # datetime64[ns], UTC
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def take(self, mask_or_index) -> "PriceColumns":
+        return PriceColumns(self.instrument_ids[mask_or_index], self.prices[mask_or_index], self.ts[mask_or_index])
+
+
+def _parse_iso(values):
+    # format="ISO8601" (pandas >= 2) accepte les variantes PostgREST
+    # ('Z' / '+00:00', avec ou sans fractions de seconde) sans inférence par ligne.
+    try:
+        return pd.to_datetime(values, utc=True, errors="coerce", format="ISO8601")
+    except (TypeError, ValueError):
+        return pd.to_datetime(values, utc=True, errors="coerce")
+
+
+def decode_price_rows(
+    rows: Iterable[Dict[str, Any]],
+    *,
+    ts_key: str = "fetched_at",
+    price_key: str = "price",
+) -> PriceColumns:
+    """
+    Lignes {instrument_id, price, fetched_at} -> PriceColumns.
+    Les lignes sans instrument, sans prix numérique ou sans timestamp
+    lisible sont écartées.
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+
+    ids = np.array([r.get("instrument_id") for r in rows], dtype=object)
+    prices = pd.to_numeric(pd.Series([r.get(price_key) for r in rows], dtype=object), errors="coerce")
+    ts = _parse_iso(pd.Series([r.get(ts_key) for r in rows], dtype=object))
+
+    prices = prices.to_numpy(dtype=np.float64, na_value=np.nan)
+    ts = ts.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+
+    ok = (ids != None) & (ids != "") & ~np.isnan(prices) & ~np.isnat(ts)  # noqa: E711
+    return PriceColumns(ids[ok], prices[ok], ts[ok])
+
+
+def paris_days(ts: np.ndarray) -> np.ndarray:
+    """
+    Timestamps UTC (datetime64) -> jours calendaires Paris (datetime64[D]).
+    """
+    local = pd.DatetimeIndex(ts).tz_localize("UTC").tz_convert(PARIS).tz_localize(None)
+    return local.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+
+
+def latest_per_day(cols: PriceColumns) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Dernière quote de chaque (instrument, jour Paris).
+    Renvoie (instrument_ids, days datetime64[D], prices, ts), une entrée par clé.
+    """
+    if not len(cols):
+        empty = np.array([], dtype=object)
+        return empty, np.array([], dtype="datetime64[D]"), np.array([], dtype=np.float64), np.array([], dtype="datetime64[ns]")
+
+    days = paris_days(cols.ts)
+    _, id_codes = np.unique(cols.instrument_ids.astype(str), return_inverse=True)
+
+    # Tri par (instrument, jour, timestamp) : la dernière ligne de chaque groupe
+    # (instrument, jour) est la quote la plus récente de la journée.
+    order = np.lexsort((cols.ts, days, id_codes))
+    id_sorted, day_sorted = id_codes[order], days[order]
+
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (id_sorted[1:] != id_sorted[:-1]) | (day_sorted[1:] != day_sorted[:-1])
+    pick = order[last]
+
+    return cols.instrument_ids[pick], days[pick], cols.prices[pick], cols.ts[pick]
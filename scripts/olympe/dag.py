@@ -0,0 +1,161 @@
+"""
+Exécution d'étapes (stages) en graphe de dépendances dans un seul process.
+
+- chaque Stage déclare les étapes dont il dépend (after) ;
+- les étapes prêtes (dépendances terminées) tournent en parallèle, dans la
+  limite de max_parallel threads ;
+- une étape en échec entraîne le saut de toutes celles qui en dépendent ;
+- une dépendance non sélectionnée (--stages / --skip) est considérée comme
+  satisfaite : on suppose qu'elle a tourné ailleurs.
+
+Les étapes partagent un contexte (dict) ; FrameStore y transporte les
+DataFrames déjà téléchargés d'une étape à l'autre.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from olympe.metrics import METRICS
+
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Nombre max de DataFrames gardés par FrameStore (~100 Ko par série daily de
+# 10 ans) ; au-delà, l'étape suivante relit le symbole via olympe.yf_cache.
+DEFAULT_MAX_FRAMES = int(os.getenv("OLYMPE_FRAME_STORE_MAX", "500"))
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[Dict[str, Any]], Any]
+    after: Tuple[str, ...] = ()
+
+
+class FrameStore:
+    """
+    Dictionnaire thread-safe symbol -> DataFrame, rempli par une étape
+    (backfill) et consommé par la suivante (returns, cf. pop) sans nouveau
+    téléchargement. Borné à max_frames : les DataFrames en trop ne sont pas
+    gardés (compteur frames_dropped).
+    """
+
+    def __init__(self, max_frames: int = DEFAULT_MAX_FRAMES):
+        self._frames: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.max_frames = max_frames
+
+    def put(self, symbol: str, frame) -> None:
+        if frame is None:
+            return
+        with self._lock:
+            if symbol not in self._frames and len(self._frames) >= self.max_frames:
+                METRICS.incr("frames_dropped")
+                return
+            self._frames[symbol] = frame
+
+    def get(self, symbol: str):
+        with self._lock:
+            return self._frames.get(symbol)
+
+    def pop(self, symbol: str):
+        """
+        Retire et renvoie le DataFrame (None si absent) : libéré dès son usage.
+        """
+        with self._lock:
+            return self._frames.pop(symbol, None)
+
+    def __contains__(self, symbol: str) -> bool:
+        with self._lock:
+            return symbol in self._frames
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._frames)
+
+
+def select_stages(
+    stages: Sequence[Stage],
+    only: Optional[Iterable[str]] = None,
+    skip: Iterable[str] = (),
+) -> List[Stage]:
+    """
+    Filtre les étapes (only = liste blanche, skip = liste noire) en gardant
+    l'ordre de déclaration. Lève ValueError sur un nom inconnu.
+    """
+    names = {s.name for s in stages}
+    only = list(only) if only else None
+    skip = list(skip)
+
+    unknown = [n for n in (only or []) + skip if n not in names]
+    if unknown:
+        raise ValueError(f"Étape(s) inconnue(s) : {', '.join(unknown)} (disponibles : {', '.join(sorted(names))})")
+
+    return [s for s in stages if (only is None or s.name in only) and s.name not in skip]
+
+
+def run_stages(
+    stages: Sequence[Stage],
+    *,
+    context: Optional[Dict[str, Any]] = None,
+    max_parallel: int = 2,
+) -> Dict[str, str]:
+    """
+    Exécute les étapes selon leurs dépendances. Renvoie {nom: ok|failed|skipped}.
+    Les exceptions d'une étape sont journalisées, pas propagées.
+    """
+    context = {} if context is None else context
+    selected = {s.name for s in stages}
+    pending = {s.name: s for s in stages}
+    status: Dict[str, str] = {}
+
+    def deps(stage: Stage) -> List[str]:
+        return [d for d in stage.after if d in selected]
+
+    def timed(stage: Stage) -> float:
+        t0 = time.monotonic()
+        try:
+            stage.run(context)
+        finally:
+            elapsed = time.monotonic() - t0
+            METRICS.add_time(f"stage.{stage.name}", elapsed)
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool:
+        running = {}
+
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(status.get(d) in (FAILED, SKIPPED) for d in deps(stage)):
+                    print(f"[pipeline] {name} : ignorée (dépendance en échec)")
+                    status[name] = SKIPPED
+                    del pending[name]
+                elif all(status.get(d) == OK for d in deps(stage)):
+                    print(f"[pipeline] {name} : démarrage")
+                    running[pool.submit(timed, stage)] = name
+                    del pending[name]
+
+            if not running:
+                # Plus rien d'exécutable : reste = cycle de dépendances.
+                for name in pending:
+                    print(f"[pipeline] {name} : ignorée (dépendances circulaires)")
+                    status[name] = SKIPPED
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    elapsed = fut.result()
+                    status[name] = OK
+                    print(f"[pipeline] {name} : terminée en {elapsed:.1f}s")
+                except Exception as e:
+                    status[name] = FAILED
+                    print(f"[pipeline] {name} : ÉCHEC ({e})")
+
+    return status
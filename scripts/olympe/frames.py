@@ -0,0 +1,158 @@
+"""
+Conversion vectorisée des DataFrames yfinance en payloads Supabase.
+
+Toutes les opérations (choix de la colonne de prix, filtrage NaN/inf/<= 0,
+formatage des dates) se font en une passe NumPy/pandas sur la colonne entière,
+au lieu d'une boucle Python par ligne (iterrows / items).
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from olympe.lazy import np, pd
+
+
+PRICE_COLUMNS = ("Adj Close", "Close")
+
+
+def extract_symbol_frame(df, symbol: str):
+    """
+    Extrait d'un DataFrame yfinance (mono ou multi-ticker) les colonnes d'un
+    seul symbole, avec des noms de champs simples (Open, Close, Adj Close…).
+    Les lignes entièrement vides (dates d'un autre ticker du lot) sont retirées.
+    Retourne None si le symbole est absent ou n'a aucune donnée.
+    """
+    if df is None or df.empty:
+        return None
+
+    columns = df.columns
+    if hasattr(columns, "nlevels") and columns.nlevels > 1:
+        level = None
+        for i in range(columns.nlevels):
+            if symbol in columns.get_level_values(i):
+                level = i
+                break
+
+        if level is None:
+            return None
+
+        df = df.xs(symbol, axis=1, level=level)
+
+    df = df.dropna(how="all")
+    if df.empty:
+        return None
+    return df
+
+
+def pick_price_series(df) -> Optional[pd.Series]:
+    """
+    Choisit 'Adj Close' si dispo, sinon 'Close'. Accepte aussi directement
+    une Series (déjà choisie). Retourne None si aucune colonne de prix.
+    """
+    if df is None:
+        return None
+
+    if isinstance(df, pd.Series):
+        s = df
+    else:
+        s = None
+        for col in PRICE_COLUMNS:
+            if col in df.columns:
+                s = df[col]
+                break
+        if s is None:
+            return None
+
+    if isinstance(s, pd.DataFrame):
+        s = s.iloc[:, 0]
+
+    if s.empty:
+        return None
+    return s
+
+
+def frame_since(df, start):
+    """
+    Lignes de df (index daté) à partir de start (date, datetime ou 'YYYY-MM-DD').
+    L'index tz-aware est comparé en heure locale. None si rien ne reste.
+    """
+    if df is None:
+        return None
+
+    index = df.index
+    if isinstance(index, pd.DatetimeIndex) and index.tz is not None:
+        index = index.tz_localize(None)
+
+    out = df[index >= pd.Timestamp(start).tz_localize(None)]
+    return None if out.empty else out
+
+
+def price_columns(df) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Renvoie (days, prices) pour les lignes valides uniquement :
+    days   = tableau de chaînes 'YYYY-MM-DD' (date locale de l'index)
+    prices = tableau float64, NaN / inf / <= 0 exclus
+    """
+    s = pick_price_series(df)
+    if s is None:
+        return np.array([], dtype="<U10"), np.array([], dtype=np.float64)
+
+    prices = pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(invalid="ignore"):
+        mask = np.isfinite(prices) & (prices > 0)
+
+    index = s.index
+    if not isinstance(index, pd.DatetimeIndex):
+        index = pd.to_datetime(index.astype(str).str[:10], errors="coerce")
+        mask &= ~index.isna()
+    elif index.tz is not None:
+        index = index.tz_localize(None)
+
+    days = index.to_numpy(dtype="datetime64[ns]")[mask].astype("datetime64[D]")
+    return np.datetime_as_string(days, unit="D"), prices[mask]
+
+
+def price_payload(
+    df,
+    instrument_id: str,
+    *,
+    date_key: str,
+    date_suffix: str = "",
+    columnar: bool = False,
+    **constants: Any,
+):
+    """
+    Construit le payload d'upsert pour un instrument à partir d'un DataFrame
+    (ou d'une Series) de prix yfinance.
+
+    - date_key / date_suffix : ex. ("fetched_at", "T00:00:00Z") pour asset_prices,
+      ("day", "") pour asset_prices_daily
+    - constants : colonnes constantes (source, currency…)
+    - columnar=False : liste de dicts (format PostgREST)
+      columnar=True  : dict colonne -> liste de valeurs
+    """
+    days, prices = price_columns(df)
+
+    if date_suffix:
+        dates = np.char.add(days, date_suffix)
+    else:
+        dates = days
+
+    dates_list = dates.tolist()
+    prices_list = prices.tolist()
+
+    if columnar:
+        n = len(prices_list)
+        payload: Dict[str, List[Any]] = {
+            "instrument_id": [instrument_id] * n,
+            "price": prices_list,
+            date_key: dates_list,
+        }
+        for key, value in constants.items():
+            payload[key] = [value] * n
+        return payload
+
+    return [
+        {"instrument_id": instrument_id, "price": price, date_key: date, **constants}
+        for date, price in zip(dates_list, prices_list)
+    ]
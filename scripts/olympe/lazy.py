@@ -0,0 +1,37 @@
+"""
+Imports paresseux des dépendances lourdes (yfinance, pandas, numpy).
+
+`from olympe.lazy import yf` ne coûte rien : le vrai module n'est importé
+qu'au premier accès à un attribut (yf.download, pd.Series…). Un job qui ne
+fait que des lectures Supabase ne paie donc jamais l'import de pandas.
+"""
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_target"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_target"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+yf = lazy_import("yfinance")
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
@@ -0,0 +1,303 @@
+"""
+Calendrier de cotation des places couvertes par yfinance : horaires de
+séance (heure locale), fuseau et jours fériés, sans dépendance externe.
+
+Le marché d'un instrument est déduit de instruments.exchange (code Yahoo
+"PAR", MIC "XPAR", "coingecko:<id>" pour les cryptos), sinon du suffixe du
+symbole (.PA, .DE, .L, pas de suffixe = US, -USD / -EUR = crypto 24/7).
+Marché inconnu (indices ^, devises =X, futures =F, places non décrites) :
+None, l'instrument est toujours rafraîchi.
+
+settled_at(market, now) : instant à partir duquel le dernier prix de la
+dernière séance est définitif (clôture + délai de diffusion Yahoo), ou None
+si la séance est en cours. Un prix stocké après cet instant ne peut plus
+changer avant la séance suivante : refresh et backfill sautent l'instrument.
+
+Les demi-séances (24 / 31 décembre à Londres, veilles de fêtes US) sont
+traitées comme des séances complètes : au pire un appel inutile.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, FrozenSet, Optional
+from zoneinfo import ZoneInfo
+
+from olympe.utils import PARIS
+
+
+# Délai de diffusion des cours Yahoo (jusqu'à 15-20 min) + fixing de clôture.
+PUBLICATION_DELAY = timedelta(minutes=30)
+
+# Au-delà, on renonce à trouver une séance (calendrier incohérent) : pas de saut.
+MAX_LOOKBACK_DAYS = 15
+
+CRYPTO_QUOTES = ("USD", "EUR", "USDT", "USDC", "BTC", "ETH", "GBP")
+
+
+def easter(year: int) -> date:
+    """
+    Dimanche de Pâques (calendrier grégorien, algorithme de Meeus / Butcher).
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """
+    n-ième `weekday` (0 = lundi) du mois ; n = -1 : le dernier.
+    """
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed_us(d: date) -> date:
+    # Férié un samedi : chômé le vendredi ; un dimanche : le lundi.
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+
+def euronext_holidays(year: int) -> FrozenSet[date]:
+    e = easter(year)
+    return frozenset(
+        {
+            date(year, 1, 1),
+            e - timedelta(days=2),
+            e + timedelta(days=1),
+            date(year, 5, 1),
+            date(year, 12, 25),
+            date(year, 12, 26),
+        }
+    )
+
+
+def xetra_holidays(year: int) -> FrozenSet[date]:
+    return euronext_holidays(year) | {date(year, 12, 24), date(year, 12, 31)}
+
+
+def milan_holidays(year: int) -> FrozenSet[date]:
+    return xetra_holidays(year) | {date(year, 8, 15)}
+
+
+def six_holidays(year: int) -> FrozenSet[date]:
+    e = easter(year)
+    return xetra_holidays(year) | {
+        date(year, 1, 2),
+        e + timedelta(days=39),  # Ascension
+        e + timedelta(days=50),  # lundi de Pentecôte
+        date(year, 8, 1),
+    }
+
+
+def london_holidays(year: int) -> FrozenSet[date]:
+    e = easter(year)
+    new_year = date(year, 1, 1)
+    while new_year.weekday() >= 5:
+        new_year += timedelta(days=1)
+
+    # Noël / Boxing Day tombant un week-end : reportés aux jours ouvrés suivants.
+    christmas = []
+    d = date(year, 12, 25)
+    for holiday in (date(year, 12, 25), date(year, 12, 26)):
+        d = max(d, holiday)
+        while d.weekday() >= 5 or d in christmas:
+            d += timedelta(days=1)
+        christmas.append(d)
+
+    return frozenset(
+        {
+            new_year,
+            e - timedelta(days=2),
+            e + timedelta(days=1),
+            nth_weekday(year, 5, 0, 1),
+            nth_weekday(year, 5, 0, -1),
+            nth_weekday(year, 8, 0, -1),
+            *christmas,
+        }
+    )
+
+
+def nyse_holidays(year: int) -> FrozenSet[date]:
+    days = {
+        nth_weekday(year, 1, 0, 3),  # Martin Luther King
+        nth_weekday(year, 2, 0, 3),  # Presidents' Day
+        easter(year) - timedelta(days=2),
+        nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed_us(date(year, 7, 4)),
+        nth_weekday(year, 9, 0, 1),  # Labor Day
+        nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed_us(date(year, 12, 25)),
+    }
+    # Jour de l'an un samedi : pas de report au 31 décembre précédent.
+    if date(year, 1, 1).weekday() != 5:
+        days.add(_observed_us(date(year, 1, 1)))
+    if year >= 2022:
+        days.add(_observed_us(date(year, 6, 19)))  # Juneteenth
+    return frozenset(days)
+
+
+@dataclass(frozen=True)
+class Market:
+    code: str
+    tz: ZoneInfo
+    open: time
+    close: time  # fin du fixing de clôture
+    holidays: Optional[Callable[[int], FrozenSet[date]]] = None
+    always_open: bool = False
+
+    def is_trading_day(self, day: date) -> bool:
+        if self.always_open:
+            return True
+        if day.weekday() >= 5:
+            return False
+        return self.holidays is None or day not in _holidays(self.holidays, day.year)
+
+    def session(self, day: date):
+        """
+        (ouverture, clôture) de la séance de `day`, en datetimes aware.
+        """
+        return (
+            datetime.combine(day, self.open, tzinfo=self.tz),
+            datetime.combine(day, self.close, tzinfo=self.tz),
+        )
+
+    def last_session(self, now: datetime) -> Optional[date]:
+        """
+        Jour de la dernière séance terminée et publiée (clôture + PUBLICATION_DELAY <= now).
+        """
+        day = now.astimezone(self.tz).date()
+        for _ in range(MAX_LOOKBACK_DAYS):
+            if self.is_trading_day(day) and self.session(day)[1] + PUBLICATION_DELAY <= now:
+                return day
+            day -= timedelta(days=1)
+        return None
+
+
+@lru_cache(maxsize=None)
+def _holidays(rule: Callable[[int], FrozenSet[date]], year: int) -> FrozenSet[date]:
+    return rule(year)
+
+
+EURONEXT_PARIS = Market("XPAR", PARIS, time(9, 0), time(17, 35), euronext_holidays)
+EURONEXT_AMSTERDAM = Market("XAMS", ZoneInfo("Europe/Amsterdam"), time(9, 0), time(17, 35), euronext_holidays)
+EURONEXT_BRUSSELS = Market("XBRU", ZoneInfo("Europe/Brussels"), time(9, 0), time(17, 35), euronext_holidays)
+EURONEXT_LISBON = Market("XLIS", ZoneInfo("Europe/Lisbon"), time(8, 0), time(16, 35), euronext_holidays)
+XETRA = Market("XETR", ZoneInfo("Europe/Berlin"), time(9, 0), time(17, 35), xetra_holidays)
+FRANKFURT = Market("XFRA", ZoneInfo("Europe/Berlin"), time(8, 0), time(22, 0), xetra_holidays)
+LONDON = Market("XLON", ZoneInfo("Europe/London"), time(8, 0), time(16, 35), london_holidays)
+SIX = Market("XSWX", ZoneInfo("Europe/Zurich"), time(9, 0), time(17, 35), six_holidays)
+MILAN = Market("XMIL", ZoneInfo("Europe/Rome"), time(9, 0), time(17, 35), milan_holidays)
+MADRID = Market("XMAD", ZoneInfo("Europe/Madrid"), time(9, 0), time(17, 35), xetra_holidays)
+US = Market("XNYS", ZoneInfo("America/New_York"), time(9, 30), time(16, 0), nyse_holidays)
+CRYPTO = Market("CRYPTO", ZoneInfo("UTC"), time(0, 0), time(0, 0), always_open=True)
+
+
+SUFFIXES = {
+    ".PA": EURONEXT_PARIS,
+    ".AS": EURONEXT_AMSTERDAM,
+    ".BR": EURONEXT_BRUSSELS,
+    ".LS": EURONEXT_LISBON,
+    ".DE": XETRA,
+    ".F": FRANKFURT,
+    ".L": LONDON,
+    ".SW": SIX,
+    ".MI": MILAN,
+    ".MC": MADRID,
+}
+
+# Codes Yahoo (quote.exchange) et MIC.
+EXCHANGES = {
+    "PAR": EURONEXT_PARIS, "XPAR": EURONEXT_PARIS,
+    "AMS": EURONEXT_AMSTERDAM, "XAMS": EURONEXT_AMSTERDAM,
+    "BRU": EURONEXT_BRUSSELS, "XBRU": EURONEXT_BRUSSELS,
+    "LIS": EURONEXT_LISBON, "XLIS": EURONEXT_LISBON,
+    "GER": XETRA, "XETR": XETRA,
+    "FRA": FRANKFURT, "XFRA": FRANKFURT,
+    "LSE": LONDON, "XLON": LONDON,
+    "EBS": SIX, "XSWX": SIX,
+    "MIL": MILAN, "XMIL": MILAN,
+    "MCE": MADRID, "XMAD": MADRID,
+    "NYQ": US, "NMS": US, "NGM": US, "NCM": US, "ASE": US, "PCX": US, "BTS": US,
+    "XNYS": US, "XNAS": US, "ARCX": US, "BATS": US,
+    "CCC": CRYPTO,
+}
+
+
+def market_for(symbol: Optional[str], exchange: Optional[str] = None, asset_class: Optional[str] = None) -> Optional[Market]:
+    """
+    Marché d'un instrument (colonnes instruments.symbol / exchange / asset_class),
+    ou None si inconnu.
+    """
+    exchange = (exchange or "").strip()
+    if exchange.lower().startswith("coingecko:") or (asset_class or "").lower() == "crypto":
+        return CRYPTO
+    if exchange.upper() in EXCHANGES:
+        return EXCHANGES[exchange.upper()]
+
+    symbol = (symbol or "").strip().upper()
+    if not symbol or symbol.startswith("^") or "=" in symbol:
+        return None
+    if "-" in symbol and symbol.rsplit("-", 1)[1] in CRYPTO_QUOTES:
+        return CRYPTO
+    if "." in symbol:
+        return SUFFIXES.get("." + symbol.rsplit(".", 1)[1])
+    return US
+
+
+def settled_at(market: Optional[Market], now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Instant à partir duquel le prix de la dernière séance est définitif, ou
+    None si le marché cote encore (séance en cours, ou clôture pas encore publiée)
+    ou est inconnu / ouvert en continu.
+    """
+    if market is None or market.always_open:
+        return None
+    now = now or datetime.now(timezone.utc)
+
+    local = now.astimezone(market.tz)
+    if market.is_trading_day(local.date()):
+        opens, closes = market.session(local.date())
+        if opens <= now < closes + PUBLICATION_DELAY:
+            return None
+
+    day = market.last_session(now)
+    if day is None:
+        return None
+    return market.session(day)[1] + PUBLICATION_DELAY
+
+
+def has_traded_since(market: Optional[Market], last_quote_at: Optional[datetime], now: Optional[datetime] = None) -> bool:
+    """
+    True si un prix stocké à last_quote_at peut avoir changé depuis (séance en
+    cours, ou séance terminée après ce prix). False : rien à demander à Yahoo.
+    """
+    if last_quote_at is None:
+        return True
+    settled = settled_at(market, now)
+    return settled is None or last_quote_at < settled
+
+
+def has_session_after(market: Optional[Market], day: Optional[str], now: Optional[datetime] = None) -> bool:
+    """
+    True si une séance terminée et publiée est postérieure au jour `day`
+    (YYYY-MM-DD, dernière barre daily stockée) : il y a une nouvelle barre à
+    télécharger. Marché inconnu ou crypto : toujours True.
+    """
+    if day is None or market is None or market.always_open:
+        return True
+    last = market.last_session(now or datetime.now(timezone.utc))
+    return last is None or last.isoformat() > day
@@ -0,0 +1,172 @@
+"""
+Instrumentation légère des jobs : timers par étape, compteurs, éléments les plus lents.
+
+Un registre unique par process (METRICS), thread-safe, alimenté par les
+helpers partagés (client HTTP, reader, batch, workers) et par les scripts
+(with timer("download"): ...). En fin de job, job() produit un résumé JSON :
+
+- une ligne "METRICS {...}" sur stdout (lisible / grep-able dans les logs Actions) ;
+- le fichier OLYMPE_METRICS_FILE s'il est défini ;
+- une ligne dans la table OLYMPE_METRICS_TABLE (ex. job_metrics) si elle est définie.
+
+Compteurs alimentés automatiquement :
+- http_requests, http_bytes_sent, http_errors (hooks httpx du client partagé)
+- rows_read, pages_read (olympe.reader), rows_written, upsert_batches,
+  upsert_fallbacks, upsert_failed (olympe.batch)
+- yf_calls, yf_symbols, yf_errors, yf_empty (yf_download), yf_missing (yf_cache)
+"""
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+SLOWEST_KEEP = 10
+
+LABEL_MAX_LENGTH = 120
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: Counter = Counter()
+            self.timers: Dict[str, List[float]] = {}  # nom -> [total, nombre, max]
+            self.slowest: Dict[str, List[Tuple[float, str]]] = {}  # catégorie -> min-heap
+
+    def incr(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            t = self.timers.setdefault(name, [0.0, 0, 0.0])
+            t[0] += seconds
+            t[1] += 1
+            t[2] = max(t[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """
+        Ajoute la durée du bloc au timer `name` (même en cas d'exception).
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def observe(self, category: str, label: str, seconds: float) -> None:
+        """
+        Garde les SLOWEST_KEEP éléments les plus lents de `category` (ex. un symbole).
+        """
+        label = str(label)
+        if len(label) > LABEL_MAX_LENGTH:
+            label = label[: LABEL_MAX_LENGTH - 1] + "…"
+        with self._lock:
+            heap = self.slowest.setdefault(category, [])
+            if len(heap) < SLOWEST_KEEP:
+                heapq.heappush(heap, (seconds, label))
+            elif seconds > heap[0][0]:
+                heapq.heapreplace(heap, (seconds, label))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "timers": {
+                    name: {"total_s": round(total, 4), "count": count, "max_s": round(peak, 4)}
+                    for name, (total, count, peak) in sorted(self.timers.items())
+                },
+                "slowest": {
+                    category: [
+                        {"label": label, "seconds": round(seconds, 4)}
+                        for seconds, label in sorted(heap, reverse=True)
+                    ]
+                    for category, heap in sorted(self.slowest.items())
+                },
+            }
+
+
+METRICS = Metrics()
+
+incr = METRICS.incr
+timer = METRICS.timer
+observe = METRICS.observe
+
+
+def write_summary(summary: Dict[str, Any]) -> None:
+    """
+    Écrit le résumé de fin de job (stdout, OLYMPE_METRICS_FILE, OLYMPE_METRICS_TABLE).
+    Une erreur d'écriture est signalée sans faire échouer le job.
+    """
+    payload = json.dumps(summary, default=str)
+    print(f"METRICS {payload}", flush=True)
+
+    path = os.getenv("OLYMPE_METRICS_FILE")
+    if path:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(payload + "\n")
+        except OSError as e:
+            print(f"[metrics] écriture de {path} impossible : {e}", file=sys.stderr)
+
+    table = os.getenv("OLYMPE_METRICS_TABLE")
+    if table:
+        try:
+            from olympe.client import get_supabase
+
+            get_supabase().table(table).insert(
+                {
+                    "job": summary["job"],
+                    "status": summary["status"],
+                    "started_at": summary["started_at"],
+                    "finished_at": summary["finished_at"],
+                    "duration_s": summary["duration_s"],
+                    "summary": summary,
+                }
+            ).execute()
+        except Exception as e:
+            print(f"[metrics] insertion dans {table} impossible : {e}", file=sys.stderr)
+
+
+@contextmanager
+def job(name: str, *, write: bool = True) -> Iterator[Metrics]:
+    """
+    Délimite un job : remet METRICS à zéro, chronomètre le tout, puis écrit
+    le résumé (statut failed si le bloc lève, sauf sys.exit(0)).
+    """
+    METRICS.reset()
+    started = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    status: Optional[str] = "ok"
+    try:
+        yield METRICS
+    except SystemExit as e:
+        status = "ok" if e.code in (None, 0) else "failed"
+        raise
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        if write:
+            write_summary(
+                {
+                    "job": name,
+                    "status": status,
+                    "started_at": started.isoformat(),
+                    "finished_at": datetime.now(timezone.utc).isoformat(),
+                    "duration_s": round(time.perf_counter() - t0, 4),
+                    **METRICS.snapshot(),
+                }
+            )
@@ -0,0 +1,199 @@
+"""
+Matrice dense date x instrument des prix daily (asset_prices_daily).
+
+Chargée en une lecture keyset de la table, elle remplace les téléchargements
+yfinance par instrument pour tous les calculs "prix à une date" : rendements
+(fetch_returns), snapshots de performance, historique de portefeuille.
+
+values[i, j] = prix de l'instrument j le jour days[i], NaN si absent.
+Les lookups "dernier prix connu à la date d" passent par asof_index()
+(index de ligne propagé vers l'avant), sans boucle Python par instrument.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from olympe.lazy import np, pd
+from olympe.reader import stream_rows
+
+
+DEFAULT_IN_CHUNK = 200
+
+
+@dataclass
+class PriceMatrix:
+    days: np.ndarray  # datetime64[D], croissant
+    instrument_ids: List[str]
+    values: np.ndarray  # float64 (len(days), len(instrument_ids))
+    _asof: Optional[np.ndarray] = field(default=None, repr=False)
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Iterable[Dict[str, Any]],
+        *,
+        day_key: str = "day",
+        price_key: str = "price",
+    ) -> "PriceMatrix":
+        """
+        Construit la matrice depuis des lignes {instrument_id, day, price}.
+        Prix NaN / inf / <= 0 ignorés ; en cas de doublon, la dernière ligne gagne.
+        """
+        ids, days, prices = [], [], []
+        for r in rows:
+            iid, day, price = r.get("instrument_id"), r.get(day_key), r.get(price_key)
+            if iid and day and price is not None:
+                ids.append(iid)
+                days.append(str(day)[:10])
+                prices.append(price)
+
+        if not ids:
+            return cls.empty()
+
+        price_arr = pd.to_numeric(pd.Series(prices), errors="coerce").to_numpy(dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            ok = np.isfinite(price_arr) & (price_arr > 0)
+
+        id_arr = np.asarray(ids, dtype=object)[ok]
+        day_arr = np.asarray(days, dtype="datetime64[D]")[ok]
+        price_arr = price_arr[ok]
+        if not len(price_arr):
+            return cls.empty()
+
+        uniq_ids, col = np.unique(id_arr.astype(str), return_inverse=True)
+        uniq_days, row = np.unique(day_arr, return_inverse=True)
+
+        values = np.full((len(uniq_days), len(uniq_ids)), np.nan)
+        values[row, col] = price_arr
+        return cls(uniq_days, uniq_ids.tolist(), values)
+
+    @classmethod
+    def empty(cls) -> "PriceMatrix":
+        return cls(np.array([], dtype="datetime64[D]"), [], np.empty((0, 0)))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.values.shape
+
+    def columns(self, instrument_ids: Sequence[str]) -> np.ndarray:
+        """
+        Indices de colonnes des instruments demandés (-1 si absent de la matrice).
+        """
+        index = {iid: j for j, iid in enumerate(self.instrument_ids)}
+        return np.array([index.get(iid, -1) for iid in instrument_ids], dtype=np.int64)
+
+    def asof_index(self) -> np.ndarray:
+        """
+        asof_index()[i, j] = ligne du dernier prix connu de j au jour days[i]
+        (-1 avant son premier prix). Calculé une fois, puis mis en cache.
+        """
+        if self._asof is None:
+            n = len(self.days)
+            idx = np.where(~np.isnan(self.values), np.arange(n)[:, None], -1)
+            self._asof = np.maximum.accumulate(idx, axis=0) if n else idx
+        return self._asof
+
+    def last_valid_index(self) -> np.ndarray:
+        """
+        Ligne du dernier prix de chaque instrument (-1 si aucun).
+        """
+        if not len(self.days):
+            return np.full(len(self.instrument_ids), -1, dtype=np.int64)
+        return self.asof_index()[-1]
+
+    def ffill(self) -> np.ndarray:
+        """
+        Prix propagés vers l'avant (dernier prix connu), NaN avant le premier prix.
+        """
+        src = self.asof_index()
+        cols = np.arange(self.values.shape[1])[None, :]
+        out = self.values[np.maximum(src, 0), cols]
+        out[src < 0] = np.nan
+        return out
+
+    def ffill_on(self, days: np.ndarray) -> np.ndarray:
+        """
+        Prix propagés vers l'avant sur une autre grille de jours (len(days), n) :
+        ligne k = dernier prix connu de chaque instrument au jour days[k].
+        """
+        days = np.asarray(days, dtype="datetime64[D]")
+        out = np.full((len(days), len(self.instrument_ids)), np.nan)
+        if not len(self.days) or not len(days):
+            return out
+
+        pos = np.searchsorted(self.days, days, side="right") - 1
+        inside = pos >= 0
+        out[inside] = self.ffill()[pos[inside]]
+        return out
+
+    def asof(self, targets: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Dernier prix connu au jour targets[k] (inclus) pour la colonne cols[k].
+        Renvoie (prix, jour du prix) ; NaN / NaT si aucun prix à cette date.
+        """
+        targets = np.asarray(targets, dtype="datetime64[D]")
+        cols = np.asarray(cols, dtype=np.int64)
+
+        pos = np.searchsorted(self.days, targets, side="right") - 1
+        src = np.full(len(cols), -1, dtype=np.int64)
+        inside = pos >= 0
+        if len(self.days):
+            src[inside] = self.asof_index()[pos[inside], cols[inside]]
+
+        found = src >= 0
+        prices = np.full(len(cols), np.nan)
+        days = np.full(len(cols), np.datetime64("NaT"), dtype="datetime64[D]")
+        prices[found] = self.values[src[found], cols[found]]
+        days[found] = self.days[src[found]]
+        return prices, days
+
+
+def shift_years(days: np.ndarray, years: int) -> np.ndarray:
+    """
+    Décale des dates de `years` années calendaires (29/02 -> 28/02).
+    """
+    shifted = pd.DatetimeIndex(np.asarray(days, dtype="datetime64[ns]")) + pd.DateOffset(years=years)
+    return shifted.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+
+
+def load_daily_matrix(
+    client,
+    *,
+    since: Optional[str] = None,
+    instrument_ids: Optional[Sequence[str]] = None,
+    in_chunk: int = DEFAULT_IN_CHUNK,
+    page_size: int = 1000,
+) -> PriceMatrix:
+    """
+    Charge asset_prices_daily (depuis `since` si fourni, pour `instrument_ids`
+    si fourni) en PriceMatrix. Lecture keyset sur (day, instrument_id),
+    clé unique de la table.
+    """
+
+    def read(ids: Optional[Sequence[str]]):
+        def filters(q):
+            if since:
+                q = q.gte("day", since)
+            if ids is not None:
+                q = q.in_("instrument_id", list(ids))
+            return q
+
+        return stream_rows(
+            client,
+            "asset_prices_daily",
+            "instrument_id,day,price",
+            order="day",
+            id_column="instrument_id",
+            filters=filters,
+            page_size=page_size,
+        )
+
+    if instrument_ids is None:
+        return PriceMatrix.from_rows(read(None))
+
+    ids = list(instrument_ids)
+    rows: List[Dict[str, Any]] = []
+    for i in range(0, len(ids), in_chunk):
+        rows.extend(read(ids[i: i + in_chunk]))
+    return PriceMatrix.from_rows(rows)
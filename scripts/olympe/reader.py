@@ -0,0 +1,135 @@
+"""
+Lecture en flux d'une table PostgREST, paginée par keyset composite.
+
+Une pagination .range(offset) devient lente sur les grandes tables (le serveur
+relit tout l'offset) et un curseur sur une seule colonne (.lt("fetched_at", c))
+perd les lignes qui partagent la valeur du curseur en fin de page. Ici l'ordre
+est (colonne d'ordre, id) et la page suivante reprend strictement après le
+couple (valeur, id) de la dernière ligne lue : aucune ligne perdue ni relue.
+
+stream_rows est un générateur : une ou deux pages en mémoire quelle que soit
+la taille de la table ; avec prefetch, la page suivante est demandée dans un
+thread pendant que l'appelant traite la page courante. stream_pages donne les
+mêmes lignes page par page (décodage colonnaire, cf. olympe.columnar).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from olympe.metrics import METRICS
+
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+def _top_level_columns(columns: str) -> List[str]:
+    """
+    Noms des colonnes de premier niveau d'un select PostgREST
+    (les embeddings "alias:table(...)" sont ignorés).
+    """
+    names, depth, current = [], 0, ""
+    for ch in columns:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            names.append(current)
+            current = ""
+        else:
+            current += ch
+    names.append(current)
+    return [n.strip() for n in names if n.strip() and "(" not in n]
+
+
+def _quote(value: Any) -> str:
+    # Valeur entre guillemets dans un filtre or=(...) : les timestamps
+    # contiennent ':' et '+', les textes peuvent contenir ',' ou '('.
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def stream_pages(
+    client,
+    table: str,
+    columns: str,
+    *,
+    order: str = "id",
+    desc: bool = False,
+    id_column: str = "id",
+    filters: Optional[Callable[[Any], Any]] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    prefetch: bool = True,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Itère sur les pages (listes de lignes, non vides) de `table` triées
+    par (order, id_column).
+
+    - columns : select PostgREST ; order et id_column y sont ajoutés si absents
+    - filters : fonction query -> query appliquée à chaque page
+      (ex. lambda q: q.gte("fetched_at", since).in_("instrument_id", ids))
+    - order doit être NOT NULL (les NULL cassent la comparaison keyset)
+    - page_size <= max_rows du serveur (1000 par défaut sur Supabase)
+    """
+    present = set(_top_level_columns(columns))
+    for col in (order, id_column):
+        if col not in present:
+            columns = f"{columns},{col}"
+            present.add(col)
+
+    op = "lt" if desc else "gt"
+
+    def fetch(last: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        q = client.table(table).select(columns)
+        if filters is not None:
+            q = filters(q)
+
+        if last is not None:
+            last_id = _quote(last[id_column])
+            if order == id_column:
+                q = q.filter(id_column, op, last[id_column])
+            else:
+                value = _quote(last[order])
+                q = q.or_(f"{order}.{op}.{value},and({order}.eq.{value},{id_column}.{op}.{last_id})")
+
+        q = q.order(order, desc=desc)
+        if order != id_column:
+            q = q.order(id_column, desc=desc)
+
+        rows = q.limit(page_size).execute().data or []
+        METRICS.incr("pages_read")
+        METRICS.incr("rows_read", len(rows))
+        return rows
+
+    if not prefetch:
+        last = None
+        while True:
+            page = fetch(last)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        page = fetch(None)
+        while True:
+            pending = pool.submit(fetch, page[-1]) if len(page) >= page_size else None
+            if page:
+                yield page
+            if pending is None:
+                return
+            page = pending.result()
+
+
+def stream_rows(client, table: str, columns: str, **kwargs) -> Iterator[Dict[str, Any]]:
+    """
+    Itère sur les lignes de `table` (mêmes options que stream_pages).
+    """
+    for page in stream_pages(client, table, columns, **kwargs):
+        yield from page
+
+
+def fetch_rows(client, table: str, columns: str, **kwargs) -> List[Dict[str, Any]]:
+    """
+    stream_rows matérialisé en liste (tables de taille raisonnable).
+    """
+    return list(stream_rows(client, table, columns, **kwargs))
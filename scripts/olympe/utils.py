@@ -0,0 +1,74 @@
+"""
+Petits helpers partagés par les scripts (conversions, découpage, jours Paris).
+"""
+import math
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+
+PARIS = ZoneInfo("Europe/Paris")
+
+
+def to_float(v, default: float = 0.0) -> float:
+    """
+    float(v), ou `default` si v est vide / non convertible.
+    """
+    if v is None or v == "":
+        return default
+    try:
+        return float(v)
+    except Exception:
+        return default
+
+
+def positive_float(v) -> Optional[float]:
+    """
+    float(v) si v est un nombre fini > 0, sinon None (prix exploitable).
+    """
+    try:
+        if v is None:
+            return None
+        n = float(v)
+        if not math.isfinite(n) or n <= 0:
+            return None
+        return n
+    except Exception:
+        return None
+
+
+def chunked(lst: List[Any], n: int) -> List[List[Any]]:
+    return [lst[i:i + n] for i in range(0, len(lst), n)]
+
+
+def chunks(lst: List[Any], n: int) -> Iterator[List[Any]]:
+    for i in range(0, len(lst), n):
+        yield lst[i : i + n]
+
+
+def parse_ts(ts: str) -> datetime:
+    """
+    Timestamp ISO PostgREST ('...Z' ou '+00:00') -> datetime aware.
+    """
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+def paris_day_today() -> str:
+    return datetime.now(PARIS).date().isoformat()
+
+
+def to_paris_day(ts: str) -> date:
+    """
+    Jour calendaire à Paris d'un timestamp ISO UTC.
+    """
+    return parse_ts(ts).astimezone(PARIS).date()
+
+
+def paris_day_bounds_utc(day: str) -> Tuple[str, str]:
+    """
+    Bornes UTC [début, fin[ de la journée `day` (YYYY-MM-DD) à Paris.
+    """
+    d = date.fromisoformat(day)
+    start = datetime.combine(d, time.min, tzinfo=PARIS)
+    end = datetime.combine(d + timedelta(days=1), time.min, tzinfo=PARIS)
+    return start.astimezone(timezone.utc).isoformat(), end.astimezone(timezone.utc).isoformat()
@@ -0,0 +1,212 @@
+"""
+Pipeline producteur / consommateur pour les jobs "téléchargement -> upsert".
+
+- un pool de threads borné exécute produce(item) (téléchargements yfinance,
+  préparation des payloads) ;
+- un second pool de threads exécute consume(unit) (upserts Supabase) ;
+- entre les deux, une queue bornée : quand les upserts prennent du retard,
+  les producteurs se bloquent, la mémoire reste plafonnée.
+
+Le temps total tend ainsi vers le plus lent des deux côtés au lieu de leur somme.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List
+
+from olympe.lazy import pd, yf
+from olympe.metrics import METRICS
+from olympe.yf_scheduler import YF_SCHEDULER, RateLimited, is_empty, is_throttle
+
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_UPSERT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 16
+
+
+_STOP = object()
+
+
+# yf.download n'est pas thread-safe : il stocke ses résultats dans un état global
+# (yfinance.shared) réinitialisé à chaque appel. Les appels sont donc sérialisés,
+# par YF_SCHEDULER.call(..., exclusive=True) pour que le verrou respecte les
+# priorités ; un download multi-ticker parallélise déjà ses tickers en interne.
+
+
+def _throttled_symbols(symbols: List[str]) -> List[str]:
+    """
+    Symboles du dernier yf.download en erreur de throttling (yfinance.shared._ERRORS,
+    à lire dans l'appel exclusif). Liste vide si l'info n'est pas disponible.
+    """
+    try:
+        errors = dict(yf.shared._ERRORS)
+    except Exception:
+        return []
+    return [s for s in symbols if is_throttle(errors.get(s) or errors.get(s.upper()))]
+
+
+def _merge_frames(df, more, symbols: List[str]):
+    """
+    Remplace dans df (multi-ticker) les colonnes de `symbols` par celles de more.
+    """
+    if is_empty(df):
+        return more
+    columns = df.columns
+    if getattr(columns, "nlevels", 1) > 1:
+        for level in range(columns.nlevels):
+            if any(s in columns.get_level_values(level) for s in symbols):
+                df = df.drop(columns=symbols, level=level, errors="ignore")
+                break
+    return pd.concat([df, more], axis=1)
+
+
+def _download_once(symbols: List[str], single: bool, args, kwargs):
+    t0 = time.perf_counter()
+    try:
+        df = yf.download(symbols[0] if single else symbols, *args, **kwargs)
+        throttled = _throttled_symbols(symbols)
+    except Exception:
+        METRICS.incr("yf_errors")
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        METRICS.incr("yf_calls")
+        METRICS.incr("yf_symbols", len(symbols))
+        METRICS.add_time("yf_download", elapsed)
+        METRICS.observe("yf_download", ",".join(symbols), elapsed)
+
+    if throttled and len(throttled) == len(symbols):
+        raise RateLimited(f"yf.download throttlé pour {len(symbols)} symbole(s)")
+    return df, throttled
+
+
+def yf_download(tickers, *args, **kwargs):
+    """
+    yf.download sérialisé et cadencé par YF_SCHEDULER (verrou exclusif et
+    token bucket attribués par priorité, retries avec backoff) : appelable
+    depuis plusieurs threads.
+    Les symboles d'un multi-ticker throttlés isolément sont retentés une fois
+    en un second appel, fusionné au premier résultat.
+    Compte appels, symboles demandés, erreurs et réponses vides ; la durée
+    (hors attentes du scheduler) alimente le timer et le classement "yf_download".
+    """
+    single = isinstance(tickers, str)
+    symbols = tickers.split() if single else list(tickers)
+    single = single and len(symbols) == 1
+
+    def empty(result) -> bool:
+        return is_empty(result[0])
+
+    df, throttled = YF_SCHEDULER.call(
+        lambda: _download_once(symbols, single, args, kwargs),
+        symbols,
+        empty=empty,
+        exclusive=True,
+    )
+
+    if throttled:
+        METRICS.incr("yf_throttled_symbols", len(throttled))
+        try:
+            more, _ = YF_SCHEDULER.call(
+                lambda: _download_once(throttled, False, args, kwargs),
+                throttled,
+                empty=empty,
+                exclusive=True,
+            )
+            if not is_empty(more):
+                df = _merge_frames(df, more, throttled)
+        except Exception as e:
+            print(f"⚠️ retry des symboles throttlés impossible ({e})", flush=True)
+
+    if is_empty(df):
+        METRICS.incr("yf_empty")
+    return df
+
+
+@dataclass
+class PipelineStats:
+    items: int = 0
+    units: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def run_pipeline(
+    items: Iterable[Any],
+    produce: Callable[[Any], Iterable[Any]],
+    consume: Callable[[Any], None],
+    *,
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    upsert_workers: int = DEFAULT_UPSERT_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    label: Callable[[Any], str] = str,
+) -> PipelineStats:
+    """
+    Exécute produce(item) pour chaque item dans download_workers threads ;
+    chaque unité produite passe par une queue bornée (queue_size) et est
+    traitée par consume(unit) dans upsert_workers threads.
+
+    Une erreur sur un item ou une unité est journalisée et comptée dans
+    stats.errors, sans interrompre le reste du pipeline. Les items et unités
+    les plus lents sont suivis dans olympe.metrics ("produce" / "consume").
+    """
+    stats = PipelineStats()
+    lock = threading.Lock()
+    units: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+
+    def record_error(message: str) -> None:
+        print(f"❌ {message}", flush=True)
+        with lock:
+            stats.errors.append(message)
+
+    def consumer_loop() -> None:
+        while True:
+            unit = units.get()
+            try:
+                if unit is _STOP:
+                    return
+                t0 = time.perf_counter()
+                consume(unit)
+                METRICS.observe("consume", label(unit), time.perf_counter() - t0)
+                with lock:
+                    stats.units += 1
+            except Exception as e:
+                record_error(f"upsert {label(unit)} : {e}")
+            finally:
+                units.task_done()
+
+    def producer_task(item: Any) -> None:
+        # Temps de production seul : l'attente d'une place dans la queue n'est pas comptée.
+        busy, t0 = 0.0, time.perf_counter()
+        for unit in produce(item) or ():
+            busy += time.perf_counter() - t0
+            units.put(unit)
+            t0 = time.perf_counter()
+        busy += time.perf_counter() - t0
+        METRICS.observe("produce", label(item), busy)
+
+    consumers = [
+        threading.Thread(target=consumer_loop, name=f"upsert-{i}", daemon=True)
+        for i in range(max(1, upsert_workers))
+    ]
+    for t in consumers:
+        t.start()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, download_workers), thread_name_prefix="download") as pool:
+            futures = {pool.submit(producer_task, item): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                stats.items += 1
+                try:
+                    future.result()
+                except Exception as e:
+                    record_error(f"download {label(item)} : {e}")
+    finally:
+        for _ in consumers:
+            units.put(_STOP)
+        for t in consumers:
+            t.join()
+
+    return stats
@@ -0,0 +1,428 @@
+"""
+Cache local (SQLite) des historiques daily yfinance, partagé par les scripts.
+
+- une table `bars` (symbol, interval, ts) -> OHLC / Adj Close / Volume ;
+- une table `coverage` qui mémorise, par (symbol, interval), la plage déjà
+  téléchargée et la date du dernier téléchargement ;
+- une table `quotes` : dernier prix résolu par symbole (cache court, cf.
+  cached_quotes / store_quotes, utilisé par get_price_yfinance).
+
+Une demande déjà couverte et récente (TTL) est servie sans appel à Yahoo ;
+sinon seule la fin de la série (depuis le dernier jour connu - recouvrement)
+est re-téléchargée puis fusionnée dans le cache ; si les Adj Close des jours
+recouverts ont changé (dividende, split), toute la plage est re-téléchargée.
+Les symboles à télécharger sont regroupés dans des yf.download multi-ticker.
+
+Variables d'environnement :
+- OLYMPE_YF_CACHE : chemin du fichier SQLite ("off" pour désactiver)
+- OLYMPE_YF_CACHE_TTL_HOURS : durée de fraîcheur (défaut 12 h)
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from olympe.frames import extract_symbol_frame
+from olympe.lazy import np, pd
+from olympe.metrics import METRICS
+from olympe.workers import yf_download
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "olympe", "yfinance.sqlite")
+
+DEFAULT_TTL_SECONDS = float(os.getenv("OLYMPE_YF_CACHE_TTL_HOURS", "12")) * 3600
+
+OVERLAP_DAYS = 5
+
+# Écart relatif d'Adj Close au-delà duquel une barre en cache est jugée réajustée.
+ADJ_TOLERANCE = 1e-6
+
+
+FIELDS = [
+    ("Open", "open"),
+    ("High", "high"),
+    ("Low", "low"),
+    ("Close", "close"),
+    ("Adj Close", "adj_close"),
+    ("Volume", "volume"),
+]
+
+
+_LOCK = threading.Lock()
+
+
+def cache_path() -> Optional[str]:
+    path = os.getenv("OLYMPE_YF_CACHE", DEFAULT_CACHE_PATH)
+    if not path or path.lower() in ("0", "off", "false", "none"):
+        return None
+    return path
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bars (
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, adj_close REAL, volume REAL,
+            PRIMARY KEY (symbol, interval, ts)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS coverage (
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            first TEXT,
+            last TEXT,
+            full INTEGER NOT NULL DEFAULT 0,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (symbol, interval)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS quotes (
+            symbol TEXT PRIMARY KEY,
+            price REAL NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def period_start(period: Optional[str]) -> Optional[str]:
+    """
+    Convertit une période yfinance ('5d', '1mo', '10y', 'max') en date de début
+    (None = tout l'historique).
+    """
+    if not period or period == "max":
+        return None
+
+    units = {"d": 1, "wk": 7, "mo": 31, "y": 366}
+    for suffix, days in units.items():
+        if period.endswith(suffix) and period[: -len(suffix)].isdigit():
+            n = int(period[: -len(suffix)])
+            return (date.today() - timedelta(days=n * days)).isoformat()
+
+    raise ValueError(f"Période yfinance non supportée par le cache : {period}")
+
+
+def _day(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+
+def _plan(
+    cov: Optional[Tuple[Optional[str], Optional[str], int, float]],
+    start: Optional[str],
+    ttl: float,
+    refresh: bool,
+) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    Décide quoi télécharger pour un symbole :
+    None                  -> servi depuis le cache
+    ("full", start)       -> toute la plage demandée (start None = period max)
+    ("tail", tail_start)  -> seulement la fin de la série
+    """
+    if cov is None or refresh:
+        return "full", start
+
+    first, last, full, fetched_at = cov
+    head_covered = bool(full) or (start is not None and first is not None and first <= start)
+    if not head_covered:
+        return "full", start
+
+    if time.time() - fetched_at < ttl:
+        return None
+
+    if not last:
+        return "full", start
+
+    tail = (datetime.strptime(last, "%Y-%m-%d") - timedelta(days=OVERLAP_DAYS)).date().isoformat()
+    return "tail", tail
+
+
+def _frame_days(frame) -> List[str]:
+    index = frame.index
+    if isinstance(index, pd.DatetimeIndex) and index.tz is not None:
+        index = index.tz_localize(None)
+    if isinstance(index, pd.DatetimeIndex):
+        return index.strftime("%Y-%m-%d").tolist()
+    return [_day(ts) for ts in index]
+
+
+def _adjustment_changed(conn: sqlite3.Connection, symbol: str, interval: str, frame, last: Optional[str]) -> bool:
+    """
+    True si l'Adj Close d'une barre déjà en cache (hors dernière, encore
+    susceptible d'être partielle) diffère de celui du téléchargement.
+    """
+    if frame is None or frame.empty or "Adj Close" not in frame.columns or not last:
+        return False
+
+    days = _frame_days(frame)
+    values = pd.to_numeric(frame["Adj Close"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    cached = dict(
+        conn.execute(
+            "SELECT ts, adj_close FROM bars WHERE symbol = ? AND interval = ? AND ts >= ? AND ts < ?",
+            (symbol, interval, min(days), last),
+        ).fetchall()
+    )
+    for day, value in zip(days, values):
+        old = cached.get(day)
+        if old is not None and not np.isnan(value) and abs(old - value) > ADJ_TOLERANCE * max(abs(old), 1.0):
+            return True
+    return False
+
+
+def _store(conn: sqlite3.Connection, symbol: str, interval: str, frame) -> Tuple[Optional[str], Optional[str]]:
+    if frame is None or frame.empty:
+        return None, None
+
+    days = _frame_days(frame)
+
+    columns = []
+    for name, _ in FIELDS:
+        if name in frame.columns:
+            values = pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            cells = values.astype(object)
+            cells[np.isnan(values)] = None
+            columns.append(cells.tolist())
+        else:
+            columns.append([None] * len(days))
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO bars (symbol, interval, ts, open, high, low, close, adj_close, volume) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(symbol, interval, d, *vals) for d, vals in zip(days, zip(*columns))],
+    )
+    return min(days), max(days)
+
+
+def _update_coverage(
+    conn: sqlite3.Connection,
+    symbol: str,
+    interval: str,
+    mode: str,
+    start: Optional[str],
+    data_last: Optional[str],
+) -> None:
+    row = conn.execute(
+        "SELECT first, last, full FROM coverage WHERE symbol = ? AND interval = ?",
+        (symbol, interval),
+    ).fetchone()
+    first, last, full = row if row else (None, None, 0)
+
+    if mode == "full":
+        if start is None:
+            full = 1
+        elif first is None or start < first:
+            first = start
+
+    if data_last and (last is None or data_last > last):
+        last = data_last
+
+    conn.execute(
+        "INSERT OR REPLACE INTO coverage (symbol, interval, first, last, full, fetched_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (symbol, interval, first, last, full, time.time()),
+    )
+
+
+def _load(conn: sqlite3.Connection, symbol: str, interval: str, start: Optional[str], end: Optional[str]):
+    sql = "SELECT ts, open, high, low, close, adj_close, volume FROM bars WHERE symbol = ? AND interval = ?"
+    params: List = [symbol, interval]
+    if start:
+        sql += " AND ts >= ?"
+        params.append(start)
+    if end:
+        sql += " AND ts < ?"
+        params.append(end)
+    sql += " ORDER BY ts"
+
+    rows = conn.execute(sql, params).fetchall()
+    if not rows:
+        return None
+
+    frame = pd.DataFrame(rows, columns=["Date"] + [name for name, _ in FIELDS])
+    frame["Date"] = pd.to_datetime(frame["Date"])
+    frame = frame.set_index("Date").dropna(axis=1, how="all").dropna(how="all")
+    return frame if not frame.empty else None
+
+
+def _download(
+    downloader: Callable,
+    symbols: List[str],
+    start: Optional[str],
+    end: Optional[str],
+    interval: str,
+) -> Dict[str, object]:
+    kwargs = {"start": start} if start else {"period": "max"}
+    if end:
+        kwargs["end"] = end
+
+    df = downloader(
+        symbols if len(symbols) > 1 else symbols[0],
+        interval=interval,
+        auto_adjust=False,
+        group_by="ticker",
+        progress=False,
+        threads=True,
+        **kwargs,
+    )
+    frames = {symbol: extract_symbol_frame(df, symbol) for symbol in symbols}
+    METRICS.incr("yf_missing", sum(1 for frame in frames.values() if frame is None))
+    return frames
+
+
+def cached_download(
+    symbols: Iterable[str],
+    *,
+    start=None,
+    end=None,
+    period: Optional[str] = None,
+    interval: str = "1d",
+    ttl: Optional[float] = None,
+    refresh: bool = False,
+    downloader: Callable = yf_download,
+) -> Dict[str, object]:
+    """
+    Équivalent de yf.download(symbols, start/end ou period, auto_adjust=False)
+    lu à travers le cache : renvoie {symbol: DataFrame mono-symbole (colonnes
+    Open…Adj Close, Volume) ou None}.
+
+    - ttl : fraîcheur en secondes (défaut OLYMPE_YF_CACHE_TTL_HOURS)
+    - refresh : ignore le cache et re-télécharge toute la plage demandée
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start = _day(start) or period_start(period)
+    end = _day(end)
+    ttl = DEFAULT_TTL_SECONDS if ttl is None else ttl
+
+    path = cache_path()
+    if path is None:
+        return _download(downloader, symbols, start, end, interval) if symbols else {}
+
+    # Le verrou ne couvre que les accès SQLite : les téléchargements de
+    # threads différents ne se sérialisent pas ici (cf. YF_SCHEDULER).
+    with _LOCK:
+        conn = _connect(path)
+        try:
+            covs = {
+                symbol: conn.execute(
+                    "SELECT first, last, full, fetched_at FROM coverage WHERE symbol = ? AND interval = ?",
+                    (symbol, interval),
+                ).fetchone()
+                for symbol in symbols
+            }
+        finally:
+            conn.close()
+
+    groups: Dict[Tuple[str, Optional[str]], List[str]] = {}
+    for symbol in symbols:
+        plan = _plan(covs[symbol], start, ttl, refresh)
+        if plan is not None:
+            groups.setdefault(plan, []).append(symbol)
+        else:
+            METRICS.incr("yf_cache_hits")
+
+    fetched: List[Tuple[str, Optional[str], List[str], Dict[str, object]]] = []
+    for (mode, fetch_start), group in groups.items():
+        print(f"  [yf_cache] {mode} {interval} depuis {fetch_start or 'max'} : {len(group)} symbole(s)")
+        fetched.append((mode, fetch_start, group, _download(downloader, group, fetch_start, end, interval)))
+
+    # Fin de série dont les Adj Close déjà en cache ont bougé (dividende,
+    # split) : toute la plage en cache est à la nouvelle base, on la recharge.
+    readjust: Dict[Optional[str], List[str]] = {}
+    with _LOCK:
+        conn = _connect(path)
+        try:
+            for mode, _, group, frames in fetched:
+                if mode != "tail":
+                    continue
+                for symbol in list(group):
+                    first, last, full, _ = covs[symbol]
+                    if _adjustment_changed(conn, symbol, interval, frames.get(symbol), last):
+                        group.remove(symbol)
+                        readjust.setdefault(None if full else first, []).append(symbol)
+        finally:
+            conn.close()
+
+    for fetch_start, group in readjust.items():
+        print(f"  [yf_cache] Adj Close réajusté, full {interval} depuis {fetch_start or 'max'} : {len(group)} symbole(s)")
+        METRICS.incr("yf_cache_readjusted", len(group))
+        fetched.append(("full", fetch_start, group, _download(downloader, group, fetch_start, end, interval)))
+
+    with _LOCK:
+        conn = _connect(path)
+        try:
+            for mode, fetch_start, group, frames in fetched:
+                for symbol in group:
+                    _, data_last = _store(conn, symbol, interval, frames.get(symbol))
+                    _update_coverage(conn, symbol, interval, mode, fetch_start, data_last)
+            conn.commit()
+
+            return {symbol: _load(conn, symbol, interval, start, end) for symbol in symbols}
+        finally:
+            conn.close()
+
+
+def cached_quotes(symbols: Iterable[str], ttl: float) -> Dict[str, float]:
+    """
+    Derniers prix résolus il y a moins de ttl secondes : {symbol: price}
+    (vide si le cache est désactivé).
+    """
+    symbols = list(dict.fromkeys(symbols))
+    path = cache_path()
+    if path is None or not symbols or ttl <= 0:
+        return {}
+
+    cutoff = time.time() - ttl
+    out: Dict[str, float] = {}
+    with _LOCK:
+        conn = _connect(path)
+        try:
+            for i in range(0, len(symbols), 500):
+                chunk = symbols[i: i + 500]
+                rows = conn.execute(
+                    f"SELECT symbol, price FROM quotes WHERE fetched_at >= ? AND symbol IN ({','.join('?' * len(chunk))})",
+                    [cutoff, *chunk],
+                ).fetchall()
+                out.update(rows)
+        finally:
+            conn.close()
+    METRICS.incr("quote_cache_hits", len(out))
+    return out
+
+
+def store_quotes(prices: Dict[str, float]) -> None:
+    """
+    Mémorise des prix fraîchement résolus (horodatés maintenant).
+    """
+    path = cache_path()
+    if path is None or not prices:
+        return
+
+    now = time.time()
+    with _LOCK:
+        conn = _connect(path)
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO quotes (symbol, price, fetched_at) VALUES (?, ?, ?)",
+                [(symbol, price, now) for symbol, price in prices.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
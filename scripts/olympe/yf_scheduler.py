@@ -0,0 +1,332 @@
+"""
+Ordonnanceur central des appels Yahoo (yf.download, Ticker.history, fast_info…).
+
+- token bucket : au plus `rate` appels / seconde (rafale `burst`), partagé par
+  tous les threads du process ;
+- débit adaptatif : divisé par deux à chaque throttling (429, "Too Many
+  Requests", YFRateLimitError), puis remonté progressivement après succès ;
+- retries : backoff exponentiel avec jitter sur throttling, erreur réseau ou
+  réponse vide ; après un throttling, tous les appels du process marquent la
+  même pause (Yahoo limite par IP) ;
+- priorités : quand plusieurs threads attendent un jeton, les symboles
+  prioritaires (instruments détenus, cf. prioritize) passent avant la longue traîne ;
+- exclusivité : les appels non thread-safe (yf.download, état global
+  yfinance.shared) passent call(..., exclusive=True) ; le verrou qui les
+  sérialise est lui aussi attribué par priorité, avant le jeton.
+
+Compteurs olympe.metrics : yf_retries, yf_throttled, yf_abandoned, timers
+yf_wait (jeton) et yf_lock_wait (verrou exclusif).
+
+Variables d'environnement : OLYMPE_YF_RATE (appels/s, <= 0 : illimité),
+OLYMPE_YF_BURST, OLYMPE_YF_MAX_RETRIES.
+"""
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional, Sequence
+
+from olympe.metrics import METRICS
+from olympe.reader import stream_rows
+
+
+PRIORITY_HELD = 0
+PRIORITY_TAIL = 10
+
+DEFAULT_RATE = float(os.getenv("OLYMPE_YF_RATE", "2"))
+DEFAULT_BURST = int(os.getenv("OLYMPE_YF_BURST", "4"))
+DEFAULT_MAX_RETRIES = int(os.getenv("OLYMPE_YF_MAX_RETRIES", "4"))
+
+# Une réponse vide est souvent légitime (titre radié, marché fermé) : un seul retry, court.
+EMPTY_RETRIES = 1
+
+BACKOFF_BASE_SECONDS = 2.0
+EMPTY_BACKOFF_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 60.0
+
+MIN_RATE = 0.1
+RECOVERY_STEP = 0.05  # fraction du débit nominal regagnée par succès
+
+
+_THROTTLE_MARKERS = ("too many requests", "rate limit", "ratelimit", "429")
+# Erreurs réseau (requests / urllib3 / socket dérivent toutes d'OSError).
+_TRANSIENT_ERRORS = (OSError,)
+
+
+class RateLimited(Exception):
+    """
+    Réponse throttlée sans exception côté yfinance (ex. tous les symboles
+    d'un yf.download en erreur "Too Many Requests").
+    """
+
+
+def is_throttle(error: Any) -> bool:
+    if error is None:
+        return False
+    if isinstance(error, RateLimited) or type(error).__name__ == "YFRateLimitError":
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in _THROTTLE_MARKERS)
+
+
+def is_empty(result: Any) -> bool:
+    return result is None or bool(getattr(result, "empty", False))
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe à file de priorité : le jeton suivant revient au
+    demandeur de plus petite priorité (puis au plus ancien).
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.nominal = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters: list = []
+        self._seq = itertools.count()
+
+    def configure(self, rate: float, burst: Optional[int] = None) -> None:
+        with self._cond:
+            self.nominal = self.rate = rate
+            if burst is not None:
+                self.burst = max(1, burst)
+            self.tokens = min(self.tokens, float(self.burst))
+            self._cond.notify_all()
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = PRIORITY_TAIL) -> float:
+        """
+        Bloque jusqu'à obtenir un jeton ; renvoie le temps d'attente (s).
+        """
+        t0 = time.monotonic()
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._waiters, me)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    head = self._waiters[0] == me
+                    if head and now >= self.paused_until and (self.rate <= 0 or self.tokens >= 1):
+                        heapq.heappop(self._waiters)
+                        if self.rate > 0:
+                            self.tokens -= 1
+                        self._cond.notify_all()
+                        return time.monotonic() - t0
+
+                    if not head:
+                        self._cond.wait()
+                    elif now < self.paused_until:
+                        self._cond.wait(self.paused_until - now)
+                    else:
+                        self._cond.wait((1 - self.tokens) / self.rate)
+            except BaseException:
+                if me in self._waiters:
+                    self._waiters.remove(me)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    def throttled(self, pause: float) -> None:
+        """
+        Throttling constaté : débit divisé par deux et pause commune à tous les threads.
+        """
+        with self._cond:
+            if self.rate > 0:
+                self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self._cond.notify_all()
+
+    def succeeded(self) -> None:
+        with self._cond:
+            if 0 < self.rate < self.nominal:
+                self.rate = min(self.nominal, self.rate + self.nominal * RECOVERY_STEP)
+
+
+class PriorityLock:
+    """
+    Verrou exclusif attribué par priorité (puis ordre d'arrivée), au lieu de
+    l'ordre arbitraire de réveil d'un threading.Lock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._held = False
+
+    def acquire(self, priority: int = PRIORITY_TAIL) -> float:
+        """
+        Bloque jusqu'à obtenir le verrou ; renvoie le temps d'attente (s).
+        """
+        t0 = time.monotonic()
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._waiters, me)
+            try:
+                while self._held or self._waiters[0] != me:
+                    self._cond.wait()
+            except BaseException:
+                self._waiters.remove(me)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self._held = True
+            return time.monotonic() - t0
+
+    def release(self) -> None:
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+
+class YFScheduler:
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        empty_retries: int = EMPTY_RETRIES,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.exclusive = PriorityLock()
+        self.max_retries = max_retries
+        self.empty_retries = empty_retries
+        self._priorities: dict = {}
+        self._lock = threading.Lock()
+
+    def configure(self, *, rate: Optional[float] = None, burst: Optional[int] = None, max_retries: Optional[int] = None) -> None:
+        if rate is not None or burst is not None:
+            self.bucket.configure(self.bucket.nominal if rate is None else rate, burst)
+        if max_retries is not None:
+            self.max_retries = max_retries
+
+    def prioritize(self, symbols: Iterable[str], priority: int = PRIORITY_HELD) -> None:
+        """
+        Enregistre la priorité de symboles (ex. instruments détenus).
+        """
+        with self._lock:
+            for symbol in symbols:
+                if symbol:
+                    self._priorities[symbol] = priority
+
+    def priority_of(self, symbols: Sequence[str]) -> int:
+        with self._lock:
+            return min((self._priorities.get(s, PRIORITY_TAIL) for s in symbols), default=PRIORITY_TAIL)
+
+    def order(self, symbols: Iterable[str]) -> list:
+        """
+        Symboles triés par priorité (stable) : les détenus d'abord.
+        """
+        return sorted(symbols, key=lambda s: self.priority_of([s]))
+
+    def call(
+        self,
+        fn: Callable[[], Any],
+        symbols: Sequence[str] = (),
+        *,
+        empty: Callable[[Any], bool] = is_empty,
+        exclusive: bool = False,
+    ) -> Any:
+        """
+        Exécute fn() au rythme du token bucket, avec retries. Sur throttling ou
+        erreur réseau persistante, l'exception finale est propagée ; une
+        réponse toujours vide après EMPTY_RETRIES est renvoyée telle quelle.
+        exclusive : fn() s'exécute seul dans le process (verrou par priorité),
+        les attentes de backoff se font hors verrou.
+        """
+        priority = self.priority_of(symbols)
+        retries = empties = 0
+
+        while True:
+            try:
+                result = self._attempt(fn, priority, exclusive)
+            except Exception as e:
+                throttle = is_throttle(e)
+                if throttle:
+                    METRICS.incr("yf_throttled")
+                if not (throttle or isinstance(e, _TRANSIENT_ERRORS)) or retries >= self.max_retries:
+                    if throttle or isinstance(e, _TRANSIENT_ERRORS):
+                        METRICS.incr("yf_abandoned")
+                    raise
+                delay = self._backoff(BACKOFF_BASE_SECONDS, retries)
+                if throttle:
+                    self.bucket.throttled(delay)
+                else:
+                    time.sleep(delay)
+                retries += 1
+                METRICS.incr("yf_retries")
+                continue
+
+            if empty(result):
+                if empties >= self.empty_retries:
+                    METRICS.incr("yf_abandoned")
+                    return result
+                time.sleep(self._backoff(EMPTY_BACKOFF_SECONDS, empties))
+                empties += 1
+                METRICS.incr("yf_retries")
+                continue
+
+            self.bucket.succeeded()
+            return result
+
+    def _attempt(self, fn: Callable[[], Any], priority: int, exclusive: bool) -> Any:
+        if not exclusive:
+            METRICS.add_time("yf_wait", self.bucket.acquire(priority))
+            return fn()
+
+        METRICS.add_time("yf_lock_wait", self.exclusive.acquire(priority))
+        try:
+            METRICS.add_time("yf_wait", self.bucket.acquire(priority))
+            return fn()
+        finally:
+            self.exclusive.release()
+
+    @staticmethod
+    def _backoff(base: float, attempt: int) -> float:
+        # Backoff exponentiel, jitter "equal" : entre la moitié et la totalité du délai.
+        delay = min(BACKOFF_MAX_SECONDS, base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+YF_SCHEDULER = YFScheduler()
+
+
+def held_symbols(client) -> list:
+    """
+    Symboles des instruments détenus (holdings.quantity > 0).
+    """
+    rows = stream_rows(
+        client,
+        "holdings",
+        "id,instrument:instruments!holdings_instrument_id_fkey(symbol)",
+        filters=lambda q: q.gt("quantity", 0),
+    )
+    return sorted({(r.get("instrument") or {}).get("symbol") for r in rows} - {None})
+
+
+def prioritize_held(client) -> list:
+    """
+    Donne la priorité aux instruments détenus ; renvoie leurs symboles.
+    Une erreur de lecture laisse simplement tous les symboles au même rang.
+    """
+    try:
+        symbols = held_symbols(client)
+    except Exception as e:
+        print(f"[yf_scheduler] holdings illisibles ({e}) : pas de priorité")
+        return []
+    YF_SCHEDULER.prioritize(symbols)
+    return symbols
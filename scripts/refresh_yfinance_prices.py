@@ -1,33 +1,115 @@
 
 
+import argparse
 import os
-from datetime import datetime, timezone
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 
-from supabase import create_client, Client
-import yfinance as yf
+from olympe.batch import upsert_batched
+from olympe.changes import changed, holding_updates, price_tolerance
+from olympe.client import is_missing_function, supabase
+from olympe.frames import extract_symbol_frame
+from olympe.lazy import yf
+from olympe.market_calendar import has_traded_since, market_for, settled_at
+from olympe.metrics import METRICS, job, timer
+from olympe.reader import fetch_rows
+from olympe.utils import parse_ts
+from olympe.workers import yf_download
+from olympe.yf_scheduler import YF_SCHEDULER
 
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_SERVICE_ROLE_KEY = os.environ["SUPABASE_SERVICE_ROLE_KEY"]
+from compute_instrument_performance import run_performance
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+UPSERT_BATCH = 500
+
+
+RPC_CHUNK = 1000
+
+
+FETCH_CHUNK = 100
+
+
+DAEMON_INTERVAL_SECONDS = float(os.getenv("OLYMPE_REFRESH_INTERVAL", "300"))
+
+FULL_RELOAD_SECONDS = float(os.getenv("OLYMPE_REFRESH_FULL_RELOAD", "3600"))
+
+# Marge de relecture incrémentale : une transaction longue peut committer un
+# updated_at antérieur au dernier vu.
+HOLDINGS_OVERLAP_SECONDS = 120
+
+
+HOLDINGS_COLUMNS = """
+    id,
+    user_id,
+    account_id,
+    quantity,
+    current_price,
+    current_value,
+    instrument_id,
+    instrument:instruments!holdings_instrument_id_fkey (
+        symbol,
+        exchange,
+        asset_class
+    )
+"""
+
+
+@dataclass
+class RefreshState:
+    """
+    État gardé d'un cycle à l'autre en mode --daemon (un seul cycle sinon).
+    """
+    holdings: dict[str, dict] = field(default_factory=dict)  # id -> ligne holdings (quantity > 0)
+    last_prices: dict[str, float] = field(default_factory=dict)  # instrument_id -> dernier prix écrit
+    last_quoted_at: dict[str, datetime] = field(default_factory=dict)  # instrument_id -> son fetched_at
+    watermark: datetime | None = None  # max(holdings.updated_at) déjà lu
+    incremental: bool = True  # False si holdings.updated_at n'existe pas
+    full_loaded_at: float = float("-inf")  # time.monotonic() de la dernière relecture complète
+
+    def advance_watermark(self, ts: str | None) -> None:
+        if ts:
+            seen = parse_ts(ts)
+            if self.watermark is None or seen > self.watermark:
+                self.watermark = seen
 
 
 def log(*args):
     print("[refresh_yfinance]", *args, flush=True)
 
 
+def ticker_history(symbol: str):
+    """
+    Un appel Ticker.history 1m (compté dans olympe.metrics).
+    """
+    t0 = time.perf_counter()
+    try:
+        return yf.Ticker(symbol).history(period="1d", interval="1m")
+    except Exception:
+        METRICS.incr("yf_errors")
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        METRICS.incr("yf_calls")
+        METRICS.incr("yf_symbols")
+        METRICS.add_time("yf_history", elapsed)
+        METRICS.observe("yf_history", symbol, elapsed)
+
+
 def fetch_yf_price(symbol: str) -> float | None:
     """
     Récupère le dernier prix de marché via yfinance.
     On prend la dernière clôture (ou le dernier "Close" intraday si dispo).
+    L'appel passe par YF_SCHEDULER (cadence, retries sur throttling / réponse vide).
     """
     try:
-        ticker = yf.Ticker(symbol)
-        
-        hist = ticker.history(period="1d", interval="1m")
+        hist = YF_SCHEDULER.call(lambda: ticker_history(symbol), [symbol])
 
         if hist is None or hist.empty:
             log("Pas de data yfinance pour", symbol)
+            METRICS.incr("yf_empty")
             return None
 
         
@@ -46,15 +128,77 @@ def fetch_yf_price(symbol: str) -> float | None:
         return None
 
 
-def get_last_recorded_price(instrument_id: str) -> float | None:
+def last_valid_close(frame) -> float | None:
     """
-    Récupère le dernier prix enregistré dans asset_prices pour un instrument.
-    Retourne None s'il n'y a encore aucun enregistrement.
+    Dernier "Close" valide (> 0) d'un DataFrame yfinance mono-symbole.
+    """
+    if frame is None or "Close" not in frame.columns:
+        return None
+
+    last_valid = frame["Close"].dropna()
+    if last_valid.empty:
+        return None
+
+    price = float(last_valid.iloc[-1])
+    if price <= 0:
+        return None
+    return price
+
+
+def fetch_yf_prices(symbols: list[str], chunk_size: int = FETCH_CHUNK) -> dict[str, float]:
+    """
+    Dernier prix intraday (1m) de tous les symboles via des yf.download
+    multi-ticker par paquets de chunk_size ; les symboles absents du
+    résultat sont retentés un par un avec fetch_yf_price.
+    """
+    prices: dict[str, float] = {}
+    chunk_size = max(1, chunk_size)
+
+    for i in range(0, len(symbols), chunk_size):
+        chunk = symbols[i: i + chunk_size]
+        log("Téléchargement intraday multi-ticker:", len(chunk), "symboles")
+
+        try:
+            df = yf_download(
+                chunk,
+                period="1d",
+                interval="1m",
+                group_by="ticker",
+                auto_adjust=True,
+                progress=False,
+                threads=True,
+            )
+        except Exception as e:
+            log("Erreur yfinance multi-ticker :", e)
+            df = None
+
+        for symbol in chunk:
+            price = last_valid_close(extract_symbol_frame(df, symbol))
+            if price is not None:
+                prices[symbol] = price
+
+    missing = [s for s in symbols if s not in prices]
+    if missing:
+        log("Symboles absents du batch, retry un par un:", len(missing))
+        METRICS.incr("yf_missing", len(missing))
+
+    for symbol in missing:
+        price = fetch_yf_price(symbol)
+        if price is not None:
+            prices[symbol] = price
+
+    return prices
+
+
+def get_last_recorded_price(instrument_id: str) -> tuple[float, str | None] | None:
+    """
+    Récupère le dernier prix enregistré dans asset_prices pour un instrument,
+    avec son fetched_at. Retourne None s'il n'y a encore aucun enregistrement.
     """
     try:
         res = (
             supabase.table("asset_prices")
-            .select("price")
+            .select("price,fetched_at")
             .eq("instrument_id", instrument_id)
             .order("fetched_at", desc=True)
             .limit(1)
@@ -63,40 +207,224 @@ def get_last_recorded_price(instrument_id: str) -> float | None:
         rows = res.data or []
         if not rows:
             return None
-        return float(rows[0]["price"])
+        return float(rows[0]["price"]), rows[0].get("fetched_at")
     except Exception as e:
         log("Erreur lors de la récupération du dernier prix pour", instrument_id, ":", e)
         return None
 
 
-def main():
-    log("=== Début refresh via yfinance ===")
-
-    
+def update_holding(row: dict) -> bool:
+    """
+    Repli ligne à ligne pour les holdings : UPDATE par id des seules
+    colonnes de valorisation. Renvoie True si la ligne existe encore.
+    """
     res = (
         supabase.table("holdings")
-        .select(
-            """
-            id,
-            quantity,
-            instrument_id,
-            instrument:instruments!holdings_instrument_id_fkey (
-                symbol
-            )
-        """
+        .update(
+            {
+                "current_price": row["current_price"],
+                "current_value": row["current_value"],
+            }
         )
-        .gt("quantity", 0)
+        .eq("id", row["id"])
         .execute()
     )
+    return bool(res.data)
+
+
+def update_holding_values(rows: list[dict]) -> tuple[set[str], set[str]]:
+    """
+    UPDATE de current_price / current_value des holdings (jamais d'upsert :
+    ni quantity / user_id / account_id réécrits, ni holding supprimé recréé),
+    en une requête RPC update_holding_values par paquet de UPSERT_BATCH.
+    Si la fonction n'est pas déployée (PGRST202), repli ligne à ligne
+    (update_holding) ; toute autre erreur met le paquet en échec.
+    Renvoie (ids mis à jour, ids en échec) ; les autres n'existent plus.
+    """
+    updated: set[str] = set()
+    failed: set[str] = set()
+    rpc = True
+
+    for i in range(0, len(rows), UPSERT_BATCH):
+        batch = rows[i: i + UPSERT_BATCH]
+        if rpc:
+            try:
+                res = supabase.rpc(
+                    "update_holding_values",
+                    {
+                        "p_ids": [r["id"] for r in batch],
+                        "p_prices": [r["current_price"] for r in batch],
+                        "p_values": [r["current_value"] for r in batch],
+                    },
+                ).execute()
+                # returns setof uuid : tableau JSON des ids mis à jour.
+                data = res.data or []
+                if not all(isinstance(hid, str) for hid in data):
+                    raise ValueError(f"réponse update_holding_values inattendue : {data[:1]!r}")
+                updated.update(data)
+                METRICS.incr("rows_written", len(data))
+                continue
+            except Exception as e:
+                if not is_missing_function(e):
+                    log("[ERROR] update_holding_values :", len(batch), "holdings non écrits :", e)
+                    METRICS.incr("upsert_failed", len(batch))
+                    failed.update(r["id"] for r in batch)
+                    continue
+                log("RPC update_holding_values indisponible (", e, "), repli ligne par ligne")
+                rpc = False
+
+        for row in batch:
+            try:
+                if update_holding(row):
+                    updated.add(row["id"])
+                    METRICS.incr("rows_written")
+            except Exception as e:
+                log("[ERROR] update holding", row["id"], "failed:", e)
+                METRICS.incr("upsert_failed")
+                failed.add(row["id"])
+
+    return updated, failed
+
+
+def get_last_recorded_prices(instrument_ids: list[str]) -> dict[str, tuple[float, str | None]]:
+    """
+    Dernier prix enregistré dans asset_prices (prix, fetched_at) pour tous les
+    instruments, en une requête (RPC latest_prices) par paquet de RPC_CHUNK ids.
+    Si la fonction n'est pas déployée, repli sur get_last_recorded_price.
+    """
+    prices: dict[str, tuple[float, str | None]] = {}
+
+    try:
+        for i in range(0, len(instrument_ids), RPC_CHUNK):
+            res = supabase.rpc(
+                "latest_prices",
+                {"p_instrument_ids": instrument_ids[i: i + RPC_CHUNK]},
+            ).execute()
+            for row in res.data or []:
+                if row.get("instrument_id") and row.get("price") is not None:
+                    prices[row["instrument_id"]] = (float(row["price"]), row.get("fetched_at"))
+    except Exception as e:
+        log("RPC latest_prices indisponible (", e, "), repli instrument par instrument")
+        prices = {}
+        for instrument_id in instrument_ids:
+            last_price = get_last_recorded_price(instrument_id)
+            if last_price is not None:
+                prices[instrument_id] = last_price
+
+    return prices
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Refresh des prix via yfinance")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=FETCH_CHUNK,
+        help="Nombre de symboles par yf.download intraday multi-ticker.",
+    )
+    parser.add_argument(
+        "--skip-performance",
+        action="store_true",
+        help="Ne pas recalculer instrument_performance après le refresh.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Reste résident et rafraîchit toutes les --interval secondes (arrêt : SIGTERM / SIGINT).",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DAEMON_INTERVAL_SECONDS,
+        help="Période des cycles en mode --daemon, en secondes.",
+    )
+    parser.add_argument(
+        "--full-reload",
+        type=float,
+        default=FULL_RELOAD_SECONDS,
+        help="Période (s) de relecture complète des holdings en mode --daemon ; entre-temps, relecture incrémentale.",
+    )
+    return parser.parse_args()
 
-    holdings = res.data or []
-    log("Holdings bruts:", len(holdings))
+
+def load_holdings(state: RefreshState, full_reload_seconds: float = FULL_RELOAD_SECONDS) -> None:
+    """
+    Met à jour state.holdings (quantity > 0). Relecture complète au premier
+    cycle, puis toutes les full_reload_seconds ; entre les deux, seules les
+    lignes dont updated_at a avancé sont relues, et les ids encore présents
+    en base (select id) retirent de l'état les holdings supprimés.
+    Sans colonne holdings.updated_at : relecture complète à chaque cycle.
+    """
+    due = time.monotonic() - state.full_loaded_at >= full_reload_seconds
+    if state.incremental and state.watermark is not None and not due:
+        since = (state.watermark - timedelta(seconds=HOLDINGS_OVERLAP_SECONDS)).isoformat()
+        try:
+            rows = fetch_rows(
+                supabase,
+                "holdings",
+                "updated_at," + HOLDINGS_COLUMNS,
+                filters=lambda q: q.gte("updated_at", since),
+            )
+        except Exception as e:
+            log("Relecture incrémentale des holdings impossible (", e, "), relecture complète")
+        else:
+            for row in rows:
+                if float(row.get("quantity") or 0) > 0:
+                    state.holdings[row["id"]] = row
+                else:
+                    state.holdings.pop(row["id"], None)
+                state.advance_watermark(row.get("updated_at"))
+            METRICS.incr("holdings_incremental_rows", len(rows))
+            log("Holdings modifiés depuis", since, ":", len(rows))
+
+            # Les suppressions (vente totale) n'apparaissent pas dans updated_at :
+            # réconciliation sur la liste des ids, une requête légère par cycle.
+            live = {r["id"] for r in fetch_rows(supabase, "holdings", "id", filters=lambda q: q.gt("quantity", 0))}
+            gone = [hid for hid in state.holdings if hid not in live]
+            for hid in gone:
+                del state.holdings[hid]
+            if gone:
+                log("Holdings supprimés depuis le dernier cycle :", len(gone))
+            if live <= state.holdings.keys():
+                return
+            log("Holdings inconnus de l'état : relecture complète")
+
+    columns = ("updated_at," if state.incremental else "") + HOLDINGS_COLUMNS
+    try:
+        rows = fetch_rows(supabase, "holdings", columns, filters=lambda q: q.gt("quantity", 0))
+    except Exception as e:
+        if not state.incremental:
+            raise
+        log("holdings.updated_at indisponible (", e, "), relecture complète à chaque cycle")
+        state.incremental = False
+        rows = fetch_rows(supabase, "holdings", HOLDINGS_COLUMNS, filters=lambda q: q.gt("quantity", 0))
+
+    state.holdings = {row["id"]: row for row in rows}
+    state.full_loaded_at = time.monotonic()
+    # Resynchronise aussi les derniers prix (écrits entre-temps par d'autres jobs).
+    state.last_prices = {}
+    state.last_quoted_at = {}
+    for row in rows:
+        state.advance_watermark(row.get("updated_at"))
+    METRICS.incr("holdings_full_reloads")
+    log("Holdings bruts:", len(rows))
+
+
+def main(args=None, state: RefreshState | None = None):
+    args = args or parse_args()
+    state = state or RefreshState()
+
+    log("=== Début refresh via yfinance ===")
+
+    
+    with timer("load_holdings"):
+        load_holdings(state, args.full_reload)
+    holdings = list(state.holdings.values())
 
     if not holdings:
         log("Aucun holding > 0, fin.")
         return
 
-    
     instruments_map: dict[str, dict] = {}  
 
     for row in holdings:
@@ -117,48 +445,86 @@ def main():
             continue
 
         if instrument_id not in instruments_map:
-            instruments_map[instrument_id] = {"symbol": symbol, "holdings": []}
+            instruments_map[instrument_id] = {
+                "symbol": symbol,
+                "market": market_for(symbol, instrument.get("exchange"), instrument.get("asset_class")),
+                "asset_class": instrument.get("asset_class"),
+                "holdings": [],
+            }
 
         instruments_map[instrument_id]["holdings"].append(row)
 
     log("Instruments distincts à mettre à jour:", len(instruments_map))
 
-    updated = 0
-    now_iso = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+
+    missing_last = [i for i in instruments_map if i not in state.last_prices]
+    if missing_last:
+        with timer("last_prices"):
+            recorded = get_last_recorded_prices(missing_last)
+        for instrument_id, (price, fetched_at) in recorded.items():
+            state.last_prices[instrument_id] = price
+            if fetched_at:
+                state.last_quoted_at[instrument_id] = parse_ts(fetched_at)
+        log("Derniers prix enregistrés chargés:", len(recorded), "/", len(missing_last))
+    last_prices = state.last_prices
+
+    # Marché sans séance depuis le dernier prix stocké (nuit, week-end, férié) :
+    # pas d'appel yfinance, les holdings sont valorisés au dernier prix.
+    closed = {
+        instrument_id
+        for instrument_id, info in instruments_map.items()
+        if instrument_id in last_prices
+        and not has_traded_since(info["market"], state.last_quoted_at.get(instrument_id), now)
+    }
+    if closed:
+        log("Marchés fermés depuis le dernier prix :", len(closed), "instrument(s) sans appel yfinance")
+        METRICS.incr("calendar_skipped", len(closed))
+
+    symbols = sorted({str(info["symbol"]) for iid, info in instruments_map.items() if iid not in closed})
+    with timer("yf_prices"):
+        yf_prices = fetch_yf_prices(symbols, args.chunk_size)
+    log("Prix yfinance récupérés:", len(yf_prices), "/", len(symbols))
+
+    price_rows: list[dict] = []
+    holding_rows: list[dict] = []
+    prices_unchanged = holdings_unchanged = 0
 
     
     for instrument_id, info in instruments_map.items():
         symbol = info["symbol"]
         symbol_str = str(symbol)
 
-        log("=== Instrument", instrument_id, "symbol =", symbol_str, "===")
+        if instrument_id in closed:
+            price = last_prices[instrument_id]
+        else:
+            log("=== Instrument", instrument_id, "symbol =", symbol_str, "===")
 
-        price = fetch_yf_price(symbol_str)
-        if price is None:
-            log("Impossible de récupérer un prix pour", symbol_str)
-            continue
+            price = yf_prices.get(symbol_str)
+            if price is None:
+                log("Impossible de récupérer un prix pour", symbol_str)
+                continue
 
-        log("Prix yfinance retenu pour", symbol_str, "=", price)
+            log("Prix yfinance retenu pour", symbol_str, "=", price)
 
-        
-        last_price = get_last_recorded_price(instrument_id)
-        is_duplicate = False
-        if last_price is not None:
             
-            if abs(last_price - price) < 1e-6:
-                is_duplicate = True
-
-        if is_duplicate:
-            log(
-                "Prix identique au dernier enregistré pour",
-                instrument_id,
-                "(asset_prices non mis à jour).",
-            )
-        else:
-            
-            insert_res = (
-                supabase.table("asset_prices")
-                .insert(
+            last_price = last_prices.get(instrument_id)
+            tolerance = price_tolerance(last_price or price, info["asset_class"])
+            is_duplicate = last_price is not None and not changed(last_price, price, tolerance)
+
+            # Premier prix après la clôture publiée : écrit même s'il est identique,
+            # son fetched_at permet de sauter l'instrument jusqu'à la séance suivante.
+            if is_duplicate and settled_at(info["market"], now) is None:
+                prices_unchanged += 1
+                log(
+                    "Prix identique au dernier enregistré pour",
+                    instrument_id,
+                    "(asset_prices non mis à jour).",
+                )
+            else:
+                
+                price_rows.append(
                     {
                         "instrument_id": instrument_id,
                         "price": price,
@@ -167,43 +533,116 @@ def main():
                         "fetched_at": now_iso,
                     }
                 )
-                .execute()
+
+        # Seuls les holdings dont la valorisation stockée change sont réécrits.
+        updates, unchanged = holding_updates(
+            info["holdings"],
+            price,
+            price_tolerance(price, info["asset_class"]),
+        )
+        holdings_unchanged += unchanged
+        for h in updates:
+            holding_rows.append(
+                {
+                    "id": h["id"],
+                    "current_price": h["current_price"],
+                    "current_value": h["current_value"],
+                }
             )
 
-            if insert_res.data is None:
-                log("Erreur insert asset_prices pour", instrument_id, ":", insert_res)
-                
-            else:
-                log("Insertion asset_prices OK pour", instrument_id)
+    METRICS.incr("prices_unchanged", prices_unchanged)
+    METRICS.incr("holdings_unchanged", holdings_unchanged)
+    log(
+        "Écritures évitées (valeurs inchangées) :",
+        prices_unchanged,
+        "prix,",
+        holdings_unchanged,
+        "holdings",
+    )
 
-        
-        for h in info["holdings"]:
-            holding_id = h["id"]
-            qty = float(h.get("quantity") or 0)
-            current_value = qty * price
-
-            upd_res = (
-                supabase.table("holdings")
-                .update(
-                    {
-                        "current_price": price,
-                        "current_value": current_value,
-                    }
-                )
-                .eq("id", holding_id)
-                .execute()
+    if price_rows:
+        with timer("upsert_prices"):
+            res = upsert_batched(
+                supabase,
+                "asset_prices",
+                price_rows,
+                on_conflict="instrument_id,fetched_at",
+                batch_size=UPSERT_BATCH,
+                log=log,
             )
+        log("Insertion asset_prices OK pour", res.written, "/", len(price_rows), "instruments")
 
-            if upd_res.data is None:
-                log("Erreur update holding", holding_id, ":", upd_res)
-                continue
+        failed = {row["instrument_id"] for row in res.failed}
+        for row in price_rows:
+            if row["instrument_id"] not in failed:
+                state.last_prices[row["instrument_id"]] = row["price"]
+                state.last_quoted_at[row["instrument_id"]] = now
 
-            updated += 1
+    
+    with timer("update_holdings"):
+        updated, failed = update_holding_values(holding_rows)
+    log("Nombre de holdings mis à jour =", len(updated), "/", len(holding_rows))
+
+    # Snapshot des valeurs stockées, comparé au cycle suivant (mode --daemon) ;
+    # un holding absent de la base (supprimé pendant le run) sort de l'état.
+    for row in holding_rows:
+        if row["id"] in updated:
+            stored = state.holdings.get(row["id"])
+            if stored is not None:
+                stored["current_price"] = row["current_price"]
+                stored["current_value"] = row["current_value"]
+        elif row["id"] not in failed:
+            state.holdings.pop(row["id"], None)
+
+    if not args.skip_performance:
+        try:
+            with timer("performance"):
+                run_performance(list(instruments_map.keys()), log=log)
+        except Exception as e:
+            log("Snapshot instrument_performance impossible :", e)
 
-    log("Nombre de holdings mis à jour =", updated)
     log("=== Fin refresh via yfinance ===")
 
 
+def run_daemon(args) -> None:
+    """
+    Mode résident : un cycle toutes les args.interval secondes, en gardant
+    client, holdings et derniers prix en mémoire. SIGTERM / SIGINT arrêtent
+    la boucle après le cycle en cours (un second signal sort immédiatement).
+    Chaque cycle produit son propre résumé olympe.metrics.
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set():
+            log("Second signal, arrêt immédiat")
+            raise SystemExit(128 + signum)
+        log("Signal", signal.Signals(signum).name, "reçu : arrêt après le cycle en cours")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    state = RefreshState()
+    log("=== Mode daemon : un cycle toutes les", args.interval, "s ===")
+
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            with job("refresh_yfinance"):
+                main(args, state)
+        except Exception as e:
+            log("Cycle en échec :", e)
+        stop.wait(max(0.0, args.interval - (time.monotonic() - started)))
+
+    log("=== Daemon arrêté ===")
+
+
 if __name__ == "__main__":
-    main()
+    cli_args = parse_args()
+    if cli_args.daemon:
+        run_daemon(cli_args)
+    else:
+        with job("refresh_yfinance"):
+            main(cli_args)
 
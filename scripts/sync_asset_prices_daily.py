@@ -1,91 +1,113 @@
-import os
+import argparse
 import datetime as dt
-from supabase import create_client
-import pytz
+from typing import List, Optional, Sequence, Tuple
 
+from olympe.client import supabase
+from olympe.columnar import decode_price_rows, latest_per_day
+from olympe.lazy import np
+from olympe.metrics import METRICS, job, timer
+from olympe.reader import stream_pages
+from olympe.utils import PARIS as TZ_PARIS, parse_ts
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise RuntimeError("SUPABASE_URL ou SUPABASE_SERVICE_ROLE_KEY manquant.")
+# Profondeur d'asset_prices_daily : une reconstruction (--full, ou premier run
+# sans watermark) relit autant d'asset_prices, et la purge ne retire rien de
+# plus récent. fetch_returns (--source daily) en tire l'horizon le plus long.
+RETENTION_YEARS = 10
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-TZ_PARIS = pytz.timezone("Europe/Paris")
-
-LOOKBACK_YEARS = 2
+# Ids par lecture ciblée (run_sync(instrument_ids=...)) : longueur d'URL bornée.
+INSTRUMENT_CHUNK = 100
 
 PAGE_SIZE = 1000
 UPSERT_BATCH = 500
 
 
-def to_paris_day(ts: str) -> dt.date:
-    utc_dt = dt.datetime.fromisoformat(ts.replace("Z", "+00:00"))
-    paris_dt = utc_dt.astimezone(TZ_PARIS)
-    return paris_dt.date()
+WATERMARK_JOB = "sync_asset_prices_daily"
 
 
-def chunks(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+# En incrémental, on relit aussi les quotes un peu plus anciennes que le
+# watermark (quotes insérées en retard : backfill, refresh concurrent).
+# Toute clé (instrument, jour) touchée par la relecture garde la bonne
+# valeur : sa dernière quote est forcément dans la fenêtre relue.
+OVERLAP_HOURS = 36
 
 
-def main():
-    print("📥 Build asset_prices_daily depuis asset_prices (dernier prix/jour, récent)")
-
-    now_utc = dt.datetime.now(dt.timezone.utc)
-    start_utc = now_utc - dt.timedelta(days=365 * LOOKBACK_YEARS + 10)
-    start_iso = start_utc.isoformat()
-
-    print(f"🕒 Fenêtre: depuis {start_iso} (UTC) ~ {LOOKBACK_YEARS} an(s)")
-
+def read_watermark() -> Optional[str]:
+    """
+    Dernier fetched_at traité (table sync_watermarks), None si absent
+    ou si la table n'est pas déployée.
+    """
+    try:
+        rows = (
+            supabase.table("sync_watermarks")
+            .select("watermark")
+            .eq("job", WATERMARK_JOB)
+            .limit(1)
+            .execute()
+            .data
+            or []
+        )
+    except Exception as e:
+        print(f"⚠️ Watermark illisible ({e}), reconstruction complète.")
+        return None
+
+    return rows[0]["watermark"] if rows else None
+
+
+def write_watermark(fetched_at: str) -> None:
+    try:
+        supabase.table("sync_watermarks").upsert(
+            {
+                "job": WATERMARK_JOB,
+                "watermark": fetched_at,
+                "updated_at": dt.datetime.utcnow().isoformat(),
+            },
+            on_conflict="job",
+        ).execute()
+    except Exception as e:
+        print(f"⚠️ Watermark non enregistré ({e}) : le prochain run repartira de l'ancien.")
+
+
+def sync_since(start_iso: str, instrument_ids: Optional[Sequence[str]] = None) -> Tuple[int, Optional[str]]:
+    """
+    Relit asset_prices depuis start_iso (plus récent d'abord, keyset
+    (fetched_at, id) par pages de PAGE_SIZE, cf. olympe.reader) et upsert
+    le dernier prix de chaque (instrument, jour Paris) rencontré.
+    instrument_ids : limite la relecture à ces instruments.
+    Renvoie (nombre de points daily, plus grand fetched_at lu).
+    """
     seen = set()  
     batch_payload = []
     total_rows = 0
     total_daily_points = 0
-
-    
-    cursor_fetched_at = None
+    max_fetched_at = None
 
     now_str = dt.datetime.utcnow().isoformat()
 
-    while True:
-        q = (
-            supabase.table("asset_prices")
-            .select("instrument_id, price, fetched_at")  
-            .gte("fetched_at", start_iso)
-            .order("fetched_at", desc=True)
-            .limit(PAGE_SIZE)
-        )
-
-        
-        if cursor_fetched_at is not None:
-            q = q.lt("fetched_at", cursor_fetched_at)
-
-        resp = q.execute()
-        rows = resp.data or []
-        if not rows:
-            break
-
-        total_rows += len(rows)
-
-        
-        cursor_fetched_at = rows[-1].get("fetched_at")
-
-        for r in rows:
-            instrument_id = r.get("instrument_id")
-            price = r.get("price")
-            fetched_at = r.get("fetched_at")
-
-            if not instrument_id or price is None or not fetched_at:
-                continue
-
-            try:
-                day = to_paris_day(fetched_at)
-            except Exception:
-                continue
-
+    rows = stream_pages(
+        supabase,
+        "asset_prices",
+        "instrument_id, price, fetched_at",
+        order="fetched_at",
+        desc=True,
+        filters=lambda q: (q.in_("instrument_id", list(instrument_ids)) if instrument_ids else q).gte(
+            "fetched_at", start_iso
+        ),
+        page_size=PAGE_SIZE,
+    )
+
+    for page in rows:
+        total_rows += len(page)
+
+        if max_fetched_at is None:
+            max_fetched_at = page[0].get("fetched_at")
+
+        # Page décodée en colonnes puis réduite à une quote par (instrument, jour Paris).
+        # Les pages arrivent du plus récent au plus ancien : une clé déjà vue
+        # a déjà reçu la dernière quote de sa journée.
+        ids, days, prices, _ = latest_per_day(decode_price_rows(page))
+
+        for instrument_id, day, price in zip(ids.tolist(), np.datetime_as_string(days, unit="D").tolist(), prices.tolist()):
             key = (instrument_id, day)
 
             
@@ -98,8 +120,8 @@ def main():
             batch_payload.append(
                 {
                     "instrument_id": instrument_id,
-                    "day": day.isoformat(),
-                    "price": float(price),
+                    "day": day,
+                    "price": price,
                     "source": "asset_prices",
                     "updated_at": now_str,
                 }
@@ -107,36 +129,113 @@ def main():
 
             
             if len(batch_payload) >= UPSERT_BATCH:
-                supabase.table("asset_prices_daily").upsert(
-                    batch_payload,
-                    on_conflict="instrument_id,day"
-                ).execute()
+                with timer("upsert_daily"):
+                    supabase.table("asset_prices_daily").upsert(
+                        batch_payload,
+                        on_conflict="instrument_id,day"
+                    ).execute()
+                METRICS.incr("rows_written", len(batch_payload))
                 batch_payload.clear()
 
         print(
-            f"… page ok | rows lus={total_rows} | daily points={total_daily_points} | curseur={cursor_fetched_at}"
+            f"… page ok | rows lus={total_rows} | daily points={total_daily_points} | curseur={page[-1].get('fetched_at')}"
         )
 
     
     if batch_payload:
-        supabase.table("asset_prices_daily").upsert(
-            batch_payload,
-            on_conflict="instrument_id,day"
-        ).execute()
+        with timer("upsert_daily"):
+            supabase.table("asset_prices_daily").upsert(
+                batch_payload,
+                on_conflict="instrument_id,day"
+            ).execute()
+        METRICS.incr("rows_written", len(batch_payload))
+
+    return total_daily_points, max_fetched_at
+
+
+def resync_instruments(instrument_ids: Sequence[str], start_iso: str) -> int:
+    """
+    Reconstruit la fenêtre depuis start_iso des seuls instrument_ids, par
+    paquets de INSTRUMENT_CHUNK. Le watermark n'est pas modifié.
+    """
+    ids: List[str] = sorted(set(instrument_ids))
+    total = 0
+    for i in range(0, len(ids), INSTRUMENT_CHUNK):
+        points, _ = sync_since(start_iso, ids[i: i + INSTRUMENT_CHUNK])
+        total += points
+    return total
+
+
+def run_sync(full: bool = False, instrument_ids: Optional[Sequence[str]] = None) -> int:
+    """
+    Incrémental par défaut : ne relit que les quotes postérieures au watermark
+    (moins OVERLAP_HOURS). full=True (ou pas de watermark) : relecture des
+    RETENTION_YEARS dernières années, qui amorce l'historique long dont
+    fetch_returns a besoin.
+
+    instrument_ids : instruments dont le backfill vient d'écrire tout
+    l'historique (cold start, Adj Close réajusté) ; leurs quotes anciennes
+    sont antérieures au watermark, leur fenêtre RETENTION_YEARS est donc
+    reconstruite en plus de l'incrémental.
+    Renvoie le nombre de points daily écrits.
+    """
+    print("📥 Build asset_prices_daily depuis asset_prices (dernier prix/jour)")
+
+    now_utc = dt.datetime.now(dt.timezone.utc)
+    lookback_start = now_utc - dt.timedelta(days=366 * RETENTION_YEARS + 10)
+
+    watermark = None if full else read_watermark()
+
+    if watermark:
+        start_utc = max(parse_ts(watermark) - dt.timedelta(hours=OVERLAP_HOURS), lookback_start)
+        print(f"🕒 Incrémental: watermark {watermark}, relecture depuis {start_utc.isoformat()} (UTC)")
+    else:
+        start_utc = lookback_start
+        print(f"🕒 Fenêtre: depuis {start_utc.isoformat()} (UTC) ~ {RETENTION_YEARS} an(s)")
+
+    with timer("sync"):
+        total_daily_points, max_fetched_at = sync_since(start_utc.isoformat())
+
+    if max_fetched_at:
+        write_watermark(max_fetched_at)
+
+    if watermark and instrument_ids:
+        print(f"🕒 Historique complet réécrit par le backfill : {len(set(instrument_ids))} instrument(s) reconstruit(s)")
+        with timer("resync"):
+            total_daily_points += resync_instruments(instrument_ids, lookback_start.isoformat())
 
     if total_daily_points == 0:
         print("⚠️ Aucun prix récent trouvé dans asset_prices.")
-        return
+        return 0
 
     print(f"✅ asset_prices_daily mise à jour. points={total_daily_points}")
 
     
-    cutoff_day = (now_utc.astimezone(TZ_PARIS).date() - dt.timedelta(days=365 * LOOKBACK_YEARS + 10)).isoformat()
+    cutoff_day = (now_utc.astimezone(TZ_PARIS).date() - dt.timedelta(days=366 * RETENTION_YEARS + 30)).isoformat()
     print(f"🧹 Purge optionnelle des days < {cutoff_day}")
-    supabase.table("asset_prices_daily").delete().lt("day", cutoff_day).execute()
+    with timer("purge"):
+        supabase.table("asset_prices_daily").delete().lt("day", cutoff_day).execute()
 
     print("✅ Purge terminée (si autorisée par RLS/policies).")
+    return total_daily_points
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="asset_prices -> asset_prices_daily (dernier prix par jour Paris)")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help=f"Reconstruit toute la fenêtre ({RETENTION_YEARS} ans) au lieu de repartir du watermark "
+        "(amorçage de l'historique long pour fetch_returns --source daily).",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    run_sync(full=args.full)
 
 
 if __name__ == "__main__":
-    main()
+    with job("sync_asset_prices_daily"):
+        main()
@@ -0,0 +1,24 @@
+-- Dernier prix (asset_prices) par instrument pour une journée de Paris.
+-- Utilisé par scripts/compute_portfolio_history_daily.py : une ligne par
+-- instrument au lieu de toutes les quotes intraday de la journée.
+create or replace function public.latest_prices_for_day(
+  p_instrument_ids uuid[],
+  p_day date
+)
+returns table (instrument_id uuid, price numeric, fetched_at timestamptz)
+language sql
+stable
+as $$
+  select distinct on (ap.instrument_id)
+    ap.instrument_id,
+    ap.price::numeric,
+    ap.fetched_at
+  from public.asset_prices ap
+  where ap.instrument_id = any (p_instrument_ids)
+    and ap.fetched_at >= (p_day::timestamp at time zone 'Europe/Paris')
+    and ap.fetched_at < ((p_day + 1)::timestamp at time zone 'Europe/Paris')
+  order by ap.instrument_id, ap.fetched_at desc;
+$$;
+
+revoke execute on function public.latest_prices_for_day(uuid[], date) from public, anon;
+grant execute on function public.latest_prices_for_day(uuid[], date) to authenticated, service_role;
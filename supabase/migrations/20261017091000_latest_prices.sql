@@ -0,0 +1,24 @@
+-- Dernier prix enregistré (asset_prices) pour chaque instrument demandé.
+-- Utilisé par scripts/refresh_yfinance_prices.py : une requête pour tous les
+-- instruments au lieu d'un SELECT ... ORDER BY fetched_at DESC LIMIT 1 chacun.
+-- Le LATERAL ... LIMIT 1 s'appuie sur l'index unique (instrument_id, fetched_at).
+create or replace function public.latest_prices(
+  p_instrument_ids uuid[]
+)
+returns table (instrument_id uuid, price numeric, fetched_at timestamptz)
+language sql
+stable
+as $$
+  select ids.instrument_id, lp.price, lp.fetched_at
+  from unnest(p_instrument_ids) as ids(instrument_id)
+  cross join lateral (
+    select ap.price::numeric as price, ap.fetched_at
+    from public.asset_prices ap
+    where ap.instrument_id = ids.instrument_id
+    order by ap.fetched_at desc
+    limit 1
+  ) lp;
+$$;
+
+revoke execute on function public.latest_prices(uuid[]) from public, anon;
+grant execute on function public.latest_prices(uuid[]) to authenticated, service_role;
@@ -0,0 +1,12 @@
+-- Watermarks des jobs incrémentaux (scripts/).
+-- sync_asset_prices_daily.py y stocke le dernier asset_prices.fetched_at
+-- traité : les runs suivants ne relisent que les quotes plus récentes.
+create table if not exists public.sync_watermarks (
+  job text primary key,
+  watermark timestamptz not null,
+  updated_at timestamptz not null default now()
+);
+
+-- Table interne aux jobs (service_role, qui contourne la RLS) : aucune policy.
+alter table public.sync_watermarks enable row level security;
+revoke all on table public.sync_watermarks from anon, authenticated;
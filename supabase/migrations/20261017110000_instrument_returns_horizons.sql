@@ -0,0 +1,26 @@
+-- instrument_returns : une ligne par (instrument, horizon) au lieu d'une par
+-- instrument, pour les CAGR 1/3/5/10 ans calculés par scripts/fetch_returns.py
+-- depuis asset_prices_daily (upsert on_conflict instrument_id,period_years).
+
+-- Une éventuelle contrainte unique / PK portant sur instrument_id seul
+-- empêcherait plusieurs horizons par instrument : on la retire.
+do $$
+declare
+  c record;
+begin
+  for c in
+    select con.conname
+    from pg_constraint con
+    join pg_attribute att
+      on att.attrelid = con.conrelid
+     and att.attname = 'instrument_id'
+    where con.conrelid = 'public.instrument_returns'::regclass
+      and con.contype in ('p', 'u')
+      and con.conkey = array[att.attnum]::int2[]
+  loop
+    execute format('alter table public.instrument_returns drop constraint %I', c.conname);
+  end loop;
+end $$;
+
+create unique index if not exists instrument_returns_instrument_period_key
+  on public.instrument_returns (instrument_id, period_years);
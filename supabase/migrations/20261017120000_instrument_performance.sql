@@ -0,0 +1,69 @@
+-- Snapshot de performance par instrument (1D / 30D / YTD / 1Y), écrit par
+-- scripts/compute_instrument_performance.py après chaque refresh des prix.
+-- Les pages (Analyse, Dashboard, Portfolio) lisent une ligne par instrument
+-- au lieu de parcourir les quotes brutes d'asset_prices.
+create table if not exists public.instrument_performance (
+  instrument_id uuid primary key references public.instruments (id) on delete cascade,
+  last_price numeric,
+  last_price_at timestamptz,
+  ref_1d numeric,
+  ref_1d_at timestamptz,
+  change_1d double precision,
+  ref_30d numeric,
+  ref_30d_at timestamptz,
+  change_30d double precision,
+  ref_ytd numeric,
+  ref_ytd_at timestamptz,
+  change_ytd double precision,
+  ref_1y numeric,
+  ref_1y_at timestamptz,
+  change_1y double precision,
+  computed_at timestamptz not null default now()
+);
+
+alter table public.instrument_performance enable row level security;
+
+drop policy if exists "instrument_performance lisible" on public.instrument_performance;
+create policy "instrument_performance lisible"
+  on public.instrument_performance
+  for select
+  to authenticated
+  using (true);
+
+-- Prix de référence à un instant donné pour chaque instrument demandé :
+-- dernière quote <= p_at, sinon (instrument plus récent que la fenêtre)
+-- première quote après p_at. Deux LIMIT 1 sur l'index (instrument_id, fetched_at).
+create or replace function public.prices_at(
+  p_instrument_ids uuid[],
+  p_at timestamptz
+)
+returns table (instrument_id uuid, price numeric, fetched_at timestamptz)
+language sql
+stable
+as $$
+  select
+    ids.instrument_id,
+    coalesce(b.price, a.price) as price,
+    coalesce(b.fetched_at, a.fetched_at) as fetched_at
+  from unnest(p_instrument_ids) as ids(instrument_id)
+  left join lateral (
+    select ap.price::numeric as price, ap.fetched_at
+    from public.asset_prices ap
+    where ap.instrument_id = ids.instrument_id
+      and ap.fetched_at <= p_at
+    order by ap.fetched_at desc
+    limit 1
+  ) b on true
+  left join lateral (
+    select ap.price::numeric as price, ap.fetched_at
+    from public.asset_prices ap
+    where ap.instrument_id = ids.instrument_id
+      and ap.fetched_at > p_at
+    order by ap.fetched_at asc
+    limit 1
+  ) a on true
+  where coalesce(b.price, a.price) is not null;
+$$;
+
+revoke execute on function public.prices_at(uuid[], timestamptz) from public, anon;
+grant execute on function public.prices_at(uuid[], timestamptz) to authenticated, service_role;
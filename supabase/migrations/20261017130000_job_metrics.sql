@@ -0,0 +1,19 @@
+-- Résumés de fin de job (scripts/, olympe.metrics) quand
+-- OLYMPE_METRICS_TABLE=job_metrics : durées par étape, compteurs
+-- HTTP / lignes / yfinance, symboles les plus lents.
+create table if not exists public.job_metrics (
+  id bigint generated always as identity primary key,
+  job text not null,
+  status text not null,
+  started_at timestamptz not null,
+  finished_at timestamptz not null,
+  duration_s double precision not null,
+  summary jsonb not null
+);
+
+create index if not exists job_metrics_job_started_idx
+  on public.job_metrics (job, started_at desc);
+
+-- Table interne aux jobs (service_role, qui contourne la RLS) : aucune policy.
+alter table public.job_metrics enable row level security;
+revoke all on table public.job_metrics from anon, authenticated;
@@ -0,0 +1,34 @@
+-- Date de dernière modification des positions (scripts/).
+-- refresh_yfinance_prices.py --daemon ne relit à chaque cycle que les
+-- holdings modifiés depuis le précédent (updated_at >= dernier vu).
+-- Seuls les changements de position font avancer updated_at : la
+-- revalorisation (current_price / current_value) écrite par le refresh
+-- lui-même ne déclenche pas de relecture.
+alter table public.holdings
+  add column if not exists updated_at timestamptz not null default now();
+
+create index if not exists holdings_updated_at_idx
+  on public.holdings (updated_at);
+
+create or replace function public.holdings_touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op = 'INSERT'
+     or new.quantity is distinct from old.quantity
+     or new.instrument_id is distinct from old.instrument_id
+     or new.account_id is distinct from old.account_id
+     or new.user_id is distinct from old.user_id then
+    new.updated_at := now();
+  else
+    new.updated_at := old.updated_at;
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists holdings_touch_updated_at on public.holdings;
+create trigger holdings_touch_updated_at
+  before insert or update on public.holdings
+  for each row execute function public.holdings_touch_updated_at();
@@ -0,0 +1,24 @@
+-- Revalorisation des holdings par scripts/refresh_yfinance_prices.py :
+-- UPDATE des seules colonnes current_price / current_value, en une requête
+-- par paquet. Jamais d'INSERT : un holding supprimé entre-temps (vente
+-- totale) n'est pas recréé, et quantity / user_id / account_id ne sont pas
+-- réécrits avec des valeurs lues en début de run.
+-- Renvoie les ids effectivement mis à jour (les absents n'existent plus).
+create or replace function public.update_holding_values(
+  p_ids uuid[],
+  p_prices numeric[],
+  p_values numeric[]
+)
+returns setof uuid
+language sql
+as $$
+  update public.holdings h
+  set current_price = v.price,
+      current_value = v.value
+  from unnest(p_ids, p_prices, p_values) as v(id, price, value)
+  where h.id = v.id
+  returning h.id;
+$$;
+
+revoke execute on function public.update_holding_values(uuid[], numeric[], numeric[]) from public, anon, authenticated;
+grant execute on function public.update_holding_values(uuid[], numeric[], numeric[]) to service_role;